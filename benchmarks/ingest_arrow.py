@@ -0,0 +1,68 @@
+###
+# Tweet dicts -> arrow: tweets_to_df -> clean_df -> df_with_schema_to_arrow vs tweets_to_arrow
+#
+#   python -m benchmarks.ingest_arrow [--tweets 20000] [--batch 100]
+#
+# Each variant runs in a fresh process; peak memory is the python heap peak
+# (tracemalloc, covers pandas/numpy) plus the arrow pool peak.
+
+import argparse, multiprocessing, time, tracemalloc
+import pyarrow as pa
+
+from benchmarks.synthetic import synthetic_tweets
+
+
+def convert(fh, variant, batch):
+    if variant == 'pandas':
+        return fh.df_with_schema_to_arrow(fh.clean_df(fh.tweets_to_df(batch)), fh.schema)
+    return pa.Table.from_batches([fh.tweets_to_arrow(batch)])
+
+
+def run(variant, n, batch_size, out):
+    from modules.FirehoseJob import FirehoseJob
+    fh = FirehoseJob(writers={})
+    tweets = synthetic_tweets(n)
+    batches = [tweets[i:i + batch_size] for i in range(0, n, batch_size)]
+    convert(fh, variant, batches[0])  # warm up
+
+    tracemalloc.start()
+    tic = time.perf_counter()
+    tables = [convert(fh, variant, batch) for batch in batches]
+    elapsed = time.perf_counter() - tic
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    table = pa.concat_tables(tables).replace_schema_metadata(None)
+    out[variant] = {
+        'tweets_per_s': n / elapsed,
+        'py_peak_mb': py_peak / 1e6,
+        'arrow_peak_mb': pa.default_memory_pool().max_memory() / 1e6,
+        'table': table
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=100, help='tweets per process_tweets call')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    out = ctx.Manager().dict()
+    for variant in ['pandas', 'arrow']:
+        p = ctx.Process(target=run, args=(variant, args.tweets, args.batch, out))
+        p.start()
+        p.join()
+        assert p.exitcode == 0, variant
+
+    old, new = out['pandas']['table'], out['arrow']['table']
+    assert old.equals(new), 'outputs differ'
+    print('%s tweets in batches of %s, identical output' % (args.tweets, args.batch))
+    for variant in ['pandas', 'arrow']:
+        r = out[variant]
+        print('%-7s: %8.0f tweets/s, peak python heap %7.1f MB, peak arrow pool %6.1f MB' % (
+            variant, r['tweets_per_s'], r['py_peak_mb'], r['arrow_peak_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+###
+# Neo4jBulkExport throughput: normalized rows -> neo4j-admin import CSVs
+#
+#   python -m benchmarks.neo4j_bulk_export [--rows 1000000] [--batch-rows 100000]
+#
+# Exports synthetic normalized (DfHelper output) batches, overlapping by 10% so the
+# cross-batch dedupe is exercised, and extrapolates to a 10M-tweet backfill.
+# (The neo4j-admin import itself is not timed: it needs the docker container.)
+
+import argparse, os, tempfile, time
+
+from benchmarks.neo4j_params import synthetic_normalized_df
+from modules.Neo4jBulkExport import Neo4jBulkExport
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--batch-rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    df = synthetic_normalized_df(args.rows)
+    out_dir = tempfile.mkdtemp()
+    export = Neo4jBulkExport(out_dir)
+    step = max(args.batch_rows - args.batch_rows // 10, 1)
+
+    tic = time.perf_counter()
+    for start in range(0, args.rows, step):
+        export.add_normalized_df(df.iloc[start:start + args.batch_rows], 'bench')
+    export.close()
+    elapsed = time.perf_counter() - tic
+
+    size = sum(os.path.getsize(os.path.join(out_dir, f)) for f in os.listdir(out_dir))
+    print('rows        : %s (%s)' % (args.rows, out_dir))
+    print('written     : %s' % dict(export.counts))
+    print('csv size    : %.1f MB' % (size / 1e6))
+    print('export      : %10.0f rows/s (%.2fs), ~%.1f min per 10M tweets' % (
+        args.rows / elapsed, elapsed, 10000000 / (args.rows / elapsed) / 60))
+
+
+if __name__ == '__main__':
+    main()
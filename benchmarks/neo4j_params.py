@@ -0,0 +1,163 @@
+###
+# Neo4j param building: old iterrows loop vs Neo4jDataAccess.df_to_graph_params
+#
+#   python -m benchmarks.neo4j_params [--rows 100000] [--parquet normalized.parquet]
+#
+# Without --parquet, writes a synthetic normalized (DfHelper output) parquet first
+# and benchmarks on what reads back, so types match what the writer sees in prod.
+
+import argparse, os, tempfile, time
+from urllib.parse import urlparse
+import numpy as np
+import pandas as pd
+
+from modules.Neo4jDataAccess import Neo4jDataAccess
+
+
+def synthetic_normalized_df(n, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = 1240000000000000000 + np.arange(n, dtype=np.int64) * 4096
+    kind = rng.integers(0, 4, n)
+    users = rng.integers(1, max(n // 10, 2), n)
+    hosts = ['who.int', 'cdc.gov', 'example.com', 'bit.ly', 'nytimes.com']
+    return pd.DataFrame({
+        'status_id': ids,
+        'full_text': ['tweet %s' % i for i in range(n)],
+        'created_at': pd.to_datetime(1584500000 + np.arange(n) // 10, unit='s', utc=True),
+        'favorite_count': rng.integers(0, 100, n),
+        'retweet_count': rng.integers(0, 100, n),
+        'in_reply_to_status_id': np.where(kind == 1, ids - 1, 0),
+        'quoted_status_id': np.where(kind == 2, ids - 2, 0),
+        'retweet_id': pd.Series(ids - 3, dtype='Int64').where(kind == 3),
+        'user_id': users,
+        'user_name': ['name %s' % u for u in users],
+        'user_location': 'Earth',
+        'user_screen_name': ['user%s' % u for u in users],
+        'user_followers_count': rng.integers(0, 10000, n),
+        'user_friends_count': rng.integers(0, 1000, n),
+        'user_created_at': (1300000000 + users).astype(np.float64),
+        'user_profile_image_url': ['http://pbs.twimg.com/%s.jpg' % u for u in users],
+        'hashtags': [
+            [{'text': 'covid19', 'indices': [0, 8]}, {'text': 'tag%s' % (i % 50), 'indices': [9, 14]}][:i % 3]
+            for i in range(n)],
+        'user_mentions': [
+            [{'id': int(users[(i + 1) % n]), 'name': 'name', 'screen_name': 'sn', 'indices': [0, 3]}][:i % 2]
+            for i in range(n)],
+        'urls': [
+            [{'url': 'https://t.co/x', 'expanded_url': 'https://%s/p/%s?q=1' % (hosts[i % 5], i % 1000)}][:(i % 4) // 2]
+            for i in range(n)],
+    })
+
+
+#### Reference: the per-row loop formerly in Neo4jDataAccess.__save_df_to_graph
+
+def legacy_normalize_hashtags(value):
+    if value is not None and len(value) > 0:
+        return ','.join([h['text'] for h in value])
+    return None
+
+
+def legacy_params(df, job_name, job_id=None):
+    params = []
+    mention_params = []
+    url_params = []
+    for index, row in df.iterrows():
+        tweet_type = 'TWEET'
+        if row["in_reply_to_status_id"] is not None and row["in_reply_to_status_id"] > 0:
+            tweet_type = "REPLY"
+        elif "quoted_status_id" in row and row["quoted_status_id"] is not None and row["quoted_status_id"] > 0:
+            tweet_type = "QUOTE_RETWEET"
+        elif "retweet_id" in row and row["retweet_id"] is not None and row["retweet_id"] > 0:
+            tweet_type = "RETWEET"
+        params.append({'tweet_id': row['status_id'],
+                       'text': row['full_text'],
+                       'tweet_created_at': row['created_at'].to_pydatetime(),
+                       'favorite_count': row['favorite_count'],
+                       'retweet_count': row['retweet_count'],
+                       'tweet_type': tweet_type,
+                       'job_id': job_id,
+                       'job_name': job_name,
+                       'hashtags': legacy_normalize_hashtags(row['hashtags']),
+                       'user_id': row['user_id'],
+                       'user_name': row['user_name'],
+                       'user_location': row['user_location'],
+                       'user_screen_name': row['user_screen_name'],
+                       'user_followers_count': row['user_followers_count'],
+                       'user_friends_count': row['user_friends_count'],
+                       'user_created_at': pd.Timestamp(row['user_created_at'], unit='s').to_pydatetime(),
+                       'user_profile_image_url': row['user_profile_image_url'],
+                       'reply_tweet_id': row['in_reply_to_status_id'],
+                       'quoted_status_id': row['quoted_status_id'],
+                       'retweet_id': row['retweet_id'] if 'retweet_id' in row else None,
+                       })
+        for u in (row['urls'] if row['urls'] is not None else []):
+            parsed = urlparse(u['expanded_url'])
+            url_params.append({
+                'tweet_id': row['status_id'], 'url': u['expanded_url'],
+                'job_id': job_id, 'job_name': job_name,
+                'schema': parsed.scheme, 'netloc': parsed.netloc, 'path': parsed.path,
+                'params': parsed.params, 'query': parsed.query, 'fragment': parsed.fragment,
+                'username': parsed.username, 'password': parsed.password,
+                'hostname': parsed.hostname, 'port': parsed.port,
+            })
+        for m in (row['user_mentions'] if row['user_mentions'] is not None else []):
+            mention_params.append({
+                'tweet_id': row['status_id'], 'user_id': m['id'],
+                'user_name': m['name'], 'user_screen_name': m['screen_name'],
+                'job_id': job_id, 'job_name': job_name,
+            })
+    return {'tweets': params, 'mentions': mention_params, 'urls': url_params}
+
+
+####
+
+def same_values(a, b):
+    if isinstance(a, float) and isinstance(b, float) and np.isnan(a) and np.isnan(b):
+        return True
+    return a == b
+
+
+def check_same(old, new):
+    for k in ['tweets', 'mentions', 'urls']:
+        assert len(old[k]) == len(new[k]), (k, len(old[k]), len(new[k]))
+        for o, n in zip(old[k], new[k]):
+            assert o.keys() == n.keys(), (k, o.keys(), n.keys())
+            bad = [c for c in o if not same_values(o[c], n[c])]
+            assert len(bad) == 0, (k, [(c, o[c], n[c]) for c in bad])
+
+
+def timed(fn, *args):
+    tic = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - tic
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--parquet', default=None, help='normalized parquet file (default: synthetic)')
+    args = parser.parse_args()
+
+    if args.parquet is None:
+        path = os.path.join(tempfile.mkdtemp(), 'normalized.parquet')
+        synthetic_normalized_df(args.rows).to_parquet(path)
+    else:
+        path = args.parquet
+    df = pd.read_parquet(path)
+    print('rows: %s (%s)' % (len(df), path))
+
+    da = Neo4jDataAccess()
+    # the legacy loop predates nullable Int64 ids: hand it python ints / None instead of pd.NA
+    legacy_df = df if not ('retweet_id' in df) else \
+        df.assign(retweet_id=df['retweet_id'].astype('object').where(df['retweet_id'].notnull(), None))
+    old, old_s = timed(legacy_params, legacy_df, 'bench')
+    new, new_s = timed(da.df_to_graph_params, df, 'bench')
+    check_same(old, new)
+
+    print('iterrows    : %10.0f rows/s (%.2fs)' % (len(df) / old_s, old_s))
+    print('columnar    : %10.0f rows/s (%.2fs)' % (len(df) / new_s, new_s))
+    print('speedup     : %.1fx' % (old_s / new_s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+###
+# Neo4j db hits: the former FOREACH/CASE + OPTIONAL MATCH tweet statements vs the current
+# type-partitioned ones, via PROFILE on the same synthetic batch
+#
+#   python -m benchmarks.neo4j_profile [--rows 2000] [--creds neo4jcreds.json]
+#
+# Needs a scratch Neo4j (writer creds, indexes from infra/neo4j/scripts/neo4j-indexes.cypher):
+# each variant writes the batch into an empty graph, then its nodes are deleted by job_name.
+
+import argparse, time, uuid
+
+from benchmarks.neo4j_params import synthetic_normalized_df
+from modules.Neo4jDataAccess import Neo4jDataAccess
+from modules.Neo4jDriverPool import Neo4jDriverPool
+
+
+#### Reference: the conditional Cypher formerly in Neo4jDataAccess.__init__; LEGACY_FOREACH
+# used to close tweetsandaccounts where it now MERGEs TWEETED
+
+LEGACY_FOREACH = """
+                    FOREACH(ignoreMe IN CASE WHEN t.tweet_type='REPLY' THEN [1] ELSE [] END |
+                        MERGE (retweet:Tweet {id:t.reply_tweet_id})
+                            ON CREATE SET retweet.id=t.reply_tweet_id,
+                            retweet.record_created_at = timestamp(),
+                            retweet.job_name = t.job_name,
+                            retweet.job_id = t.job_id,
+                            retweet.hydrated = 'PARTIAL'
+                    )
+                    FOREACH(ignoreMe IN CASE WHEN t.tweet_type='QUOTE_RETWEET' THEN [1] ELSE [] END |
+                        MERGE (quoteTweet:Tweet {id:t.quoted_status_id})
+                            ON CREATE SET quoteTweet.id=t.quoted_status_id,
+                            quoteTweet.record_created_at = timestamp(),
+                            quoteTweet.job_name = t.job_name,
+                            quoteTweet.job_id = t.job_id,
+                            quoteTweet.hydrated = 'PARTIAL'
+                    )
+                    FOREACH(ignoreMe IN CASE WHEN t.tweet_type='RETWEET' THEN [1] ELSE [] END |
+                        MERGE (retweet:Tweet {id:t.retweet_id})
+                            ON CREATE SET retweet.id=t.retweet_id,
+                            retweet.record_created_at = timestamp(),
+                            retweet.job_name = t.job_name,
+                            retweet.job_id = t.job_id,
+                            retweet.hydrated = 'PARTIAL'
+                    )
+"""
+
+LEGACY_TWEETED_REL = """UNWIND $tweets AS t
+                    MATCH (user:Account {id:t.user_id})
+                    MATCH (tweet:Tweet {id:t.tweet_id})
+                    OPTIONAL MATCH (replied:Tweet {id:t.reply_tweet_id})
+                    OPTIONAL MATCH (quoteTweet:Tweet {id:t.quoted_status_id})
+                    OPTIONAL MATCH (retweet:Tweet {id:t.retweet_id})
+                    WITH user, tweet, replied, quoteTweet, retweet
+
+                    MERGE (user)-[r:TWEETED]->(tweet)
+
+                    FOREACH(ignoreMe IN CASE WHEN tweet.type='REPLY' AND replied.id>0 THEN [1] ELSE [] END |
+                        MERGE (tweet)-[:REPLYED]->(replied)
+                    )
+
+                    FOREACH(ignoreMe IN CASE WHEN tweet.type='QUOTE_RETWEET' AND quoteTweet.id>0 THEN [1] ELSE [] END |
+                        MERGE (tweet)-[:QUOTED]->(quoteTweet)
+                    )
+
+                    FOREACH(ignoreMe IN CASE WHEN tweet.type='RETWEET' AND retweet.id>0 THEN [1] ELSE [] END |
+                        MERGE (tweet)-[:RETWEETED]->(retweet)
+                    )
+"""
+
+
+####
+
+def db_hits(profile):
+    return profile.get('dbHits', 0) + sum(db_hits(c) for c in profile.get('children', []))
+
+
+def profiled(session, name, cypher, **params):
+    tic = time.perf_counter()
+    summary = session.run('PROFILE ' + cypher, **params).consume()
+    return name, db_hits(summary.profile), time.perf_counter() - tic
+
+
+def legacy_statements(da, params):
+    tweets_and_accounts = da.tweetsandaccounts.replace('MERGE (user)-[:TWEETED]->(tweet)', LEGACY_FOREACH)
+    assert tweets_and_accounts != da.tweetsandaccounts
+    return [
+        ('tweets+accounts+referenced', tweets_and_accounts, {'tweets': params['tweets']}),
+        ('tweeted_rel', LEGACY_TWEETED_REL, {'tweets': params['tweets']})
+    ]
+
+
+def typed_statements(da, params):
+    return [('tweets+accounts+TWEETED', da.tweetsandaccounts, {'tweets': params['tweets']})] + [
+        ('referenced %s' % tweet_type, da.referenced_tweets[tweet_type], {'tweets': type_params})
+        for tweet_type, type_params in params['referenced'].items() if len(type_params) > 0
+    ]
+
+
+def run_variant(graph, da, statements, params, job_name):
+    out = []
+    with graph.session() as session:
+        for name, cypher, statement_params in statements:
+            out.append(profiled(session, name, cypher, **statement_params))
+        out.append(profiled(session, 'mentions', da.mentions, mentions=params['mentions']))
+        out.append(profiled(session, 'urls', da.urls, urls=params['urls']))
+        session.run('MATCH (n) WHERE n.job_name = $job_name DETACH DELETE n', job_name=job_name).consume()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--creds', default=Neo4jDriverPool.DEFAULT_CREDS_FILE)
+    args = parser.parse_args()
+
+    graph = Neo4jDriverPool.get_driver('writer', Neo4jDriverPool.load_creds(args.creds))
+    da = Neo4jDataAccess()
+    job_name = 'profile_%s' % uuid.uuid4()
+    params = da.df_to_graph_params(synthetic_normalized_df(args.rows), job_name)
+
+    totals = {}
+    for variant, statements in [('legacy', legacy_statements), ('typed', typed_statements)]:
+        rows = run_variant(graph, da, statements(da, params), params, job_name)
+        for name, hits, seconds in rows:
+            print('%-7s %-28s %12s db hits %8.3fs' % (variant, name, hits, seconds))
+        totals[variant] = (sum(r[1] for r in rows), sum(r[2] for r in rows))
+    for variant, (hits, seconds) in totals.items():
+        print('%-7s %-28s %12s db hits %8.3fs' % (variant, 'TOTAL', hits, seconds))
+    print('db hits: %.2fx fewer' % (totals['legacy'][0] / max(totals['typed'][0], 1)))
+    Neo4jDriverPool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+###
+# Peak memory of normalizing one parquet file: whole-file read + normalize_parquet_dataframe
+# vs DfHelper.iter_normalized_parquet chunks (Neo4j params built per chunk in both, not written)
+#
+#   python -m benchmarks.normalize_streaming [--tweets 100000] [--batch-rows 10000] [--parquet file.parquet]
+#
+# The synthetic file has FirehoseJob's row groups (TWEETS_PER_ROWGROUP rows); each mode runs
+# in a fresh child process and reports its peak RSS.
+
+import argparse, os, resource, subprocess, sys, tempfile, time
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from modules.DfHelper import DfHelper
+from modules.FirehoseJob import FirehoseJob
+from modules.Neo4jDataAccess import Neo4jDataAccess
+
+
+def run_child(mode, path, batch_rows):
+    da = Neo4jDataAccess()
+    tic = time.perf_counter()
+    rows = 0
+    if mode == 'whole':
+        pdf = DfHelper().normalize_parquet_dataframe(DfHelper.table_to_pandas(pq.read_table(path)))
+        rows = len(da.build_param_frames(pdf, 'bench')[0])
+    else:
+        for pdf in DfHelper().iter_normalized_parquet(path, batch_rows):
+            rows += len(da.build_param_frames(pdf, 'bench')[0])
+    elapsed = time.perf_counter() - tic
+    print('%s %s %s' % (rows, elapsed, peak_rss_kb()))
+
+
+#VmHWM restarts at exec, unlike ru_maxrss, which a child can inherit from its (bigger) parent on linux
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+#row groups of TWEETS_PER_ROWGROUP, as FirehoseJob writes them
+def write_synthetic(path, n, chunk=10000):
+    from benchmarks.synthetic import synthetic_tweets
+    fh = FirehoseJob(writers={})
+    writer = None
+    for start in range(0, n, chunk):
+        tweets = synthetic_tweets(min(chunk, n - start), seed=start, start_ms=1584500000000 + start * 10)
+        table = pa.Table.from_batches([fh.tweets_to_arrow(tweets)])
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema, compression='snappy')
+        writer.write_table(table, row_group_size=fh.TWEETS_PER_ROWGROUP)
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=100000)
+    parser.add_argument('--batch-rows', type=int, default=10000)
+    parser.add_argument('--parquet', default=None, help='raw tweet parquet file (default: synthetic)')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not (args.child is None):
+        return run_child(args.child, args.parquet, args.batch_rows)
+
+    path = args.parquet
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'tweets.parquet')
+        write_synthetic(path, args.tweets)
+    print('file        : %s (%.1f MB, %s rows)' % (path, os.path.getsize(path) / 1e6, pq.ParquetFile(path).metadata.num_rows))
+
+    for mode in ['whole', 'chunked']:
+        out = subprocess.run(
+            [sys.executable, '-W', 'ignore', '-m', 'benchmarks.normalize_streaming',
+             '--child', mode, '--parquet', path, '--batch-rows', str(args.batch_rows)],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+        rows, elapsed, max_rss_kb = int(out[-3]), float(out[-2]), int(out[-1])
+        print('%-11s : %s rows in %6.2fs, peak RSS %7.1f MB' % (mode, rows, elapsed, max_rss_kb / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+###
+# ParallelNormalizer scaling: normalize a synthetic backlog with 1, 2, 4, ... workers
+#
+#   python -m benchmarks.parallel_normalize [--files 8] [--tweets-per-file 20000] [--max-workers N]
+#
+# Files have FirehoseJob's row groups; units are --batch-rows rows. Each run's output is
+# checked identical (same order) to the 1-worker run.
+
+import argparse, os, tempfile, time
+
+from benchmarks.normalize_streaming import write_synthetic
+from modules.ParallelNormalizer import ParallelNormalizer
+
+
+def timed_run(folder, workers, batch_rows):
+    tic = time.perf_counter()
+    tables = [table for unit, table in ParallelNormalizer(workers=workers, batch_rows=batch_rows).iter_tables(folder)]
+    return tables, time.perf_counter() - tic
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--tweets-per-file', type=int, default=20000)
+    parser.add_argument('--batch-rows', type=int, default=10000)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    for i in range(args.files):
+        write_synthetic(os.path.join(folder, 'f%03d.parquet' % i), args.tweets_per_file)
+    rows = args.files * args.tweets_per_file
+    print('backlog     : %s files x %s tweets, %s cores' % (args.files, args.tweets_per_file, os.cpu_count()))
+
+    workers = 1
+    base, base_s = timed_run(folder, 1, args.batch_rows)
+    while True:
+        if workers == 1:
+            tables, seconds = base, base_s
+        else:
+            tables, seconds = timed_run(folder, workers, args.batch_rows)
+            assert len(tables) == len(base) and all(a.equals(b) for a, b in zip(tables, base)), 'outputs differ'
+        print('%2s workers : %10.0f tweets/s (%.2fs), %.2fx' % (workers, rows / seconds, seconds, base_s / seconds))
+        if workers >= args.max_workers:
+            break
+        workers = min(workers * 2, args.max_workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+###
+# Parquet writer profiles on the same tweet batch: file size, write throughput, read latency
+#
+#   python -m benchmarks.parquet_profiles [--tweets 50000] [--schema-version 1] [--repeat 3]
+#
+# Reads: the full table, a projection (id, lang, created_at), and a point lookup by id,
+# which only row-group statistics on id can prune. Times are the best of --repeat runs.
+
+import argparse, os, tempfile, time
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from modules.FirehoseJob import FirehoseJob
+from modules.ParquetWriterProfile import WRITER_PROFILES
+from benchmarks.synthetic import synthetic_tweets
+
+
+def best_of(repeat, fn, *args):
+    best = None
+    out = None
+    for i in range(repeat):
+        tic = time.perf_counter()
+        out = fn(*args)
+        elapsed = time.perf_counter() - tic
+        best = elapsed if best is None else min(best, elapsed)
+    return out, best
+
+
+def write(profile, table, path):
+    writer = profile.open_writer(path, table.schema)
+    profile.write(writer, table)
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=50000)
+    parser.add_argument('--schema-version', type=int, default=1, choices=[1, 2])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--profiles', nargs='+', default=list(WRITER_PROFILES.keys()))
+    args = parser.parse_args()
+
+    fh = FirehoseJob(writers={}, schema_version=args.schema_version)
+    tweets = synthetic_tweets(args.tweets)
+    table = pa.Table.from_batches([
+        fh.tweets_to_arrow(tweets[i:i + 1000]) for i in range(0, len(tweets), 1000)
+    ]).combine_chunks()
+    probe_id = table.column('id')[len(table) // 2].as_py()
+
+    folder = tempfile.mkdtemp()
+    print('%s tweets, schema v%s, %.1f MB in arrow' % (args.tweets, args.schema_version, table.nbytes / 1e6))
+    print('%-8s %9s %14s %10s %10s %10s' % ('profile', 'size MB', 'write rows/s', 'full ms', 'proj ms', 'lookup ms'))
+    for name in args.profiles:
+        profile = WRITER_PROFILES[name]
+        path = os.path.join(folder, 'tweets.' + profile.file_suffix)
+        _, write_s = best_of(args.repeat, write, profile, table, path)
+        full, full_s = best_of(args.repeat, pq.read_table, path)
+        assert full.num_rows == table.num_rows
+        _, proj_s = best_of(args.repeat, lambda: pq.read_table(path, columns=['id', 'lang', 'created_at']))
+        hit, lookup_s = best_of(args.repeat, lambda: pq.read_table(path, filters=[('id', '=', probe_id)]))
+        assert hit.num_rows == 1
+        print('%-8s %9.2f %14.0f %10.1f %10.1f %10.1f' % (
+            name, os.path.getsize(path) / 1e6, table.num_rows / write_s,
+            full_s * 1000, proj_s * 1000, lookup_s * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+###
+# Parquet schema v1 (nested objects as JSON strings) vs v2 (arrow structs)
+#
+#   python -m benchmarks.schema_v2 [--tweets 50000]
+#
+# Writes the same synthetic tweets under both schemas, then times what a reader
+# needs to get user ids + hashtag texts: v1 reads and json-decodes the whole
+# user/entities strings, v2 prunes parquet to the user.id / entities.hashtags leaves.
+
+import argparse, os, tempfile, time
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from modules.DfHelper import DfHelper
+from modules.FirehoseJob import FirehoseJob
+from benchmarks.synthetic import synthetic_tweets
+
+
+def write(tweets, schema_version, path, batch=1000):
+    fh = FirehoseJob(writers={}, schema_version=schema_version)
+    batches = [fh.tweets_to_arrow(tweets[i:i + batch]) for i in range(0, len(tweets), batch)]
+    pq.write_table(pa.Table.from_batches(batches), path, compression='snappy')
+
+
+def read_v1(path):
+    table = pq.read_table(path, columns=['user', 'entities'])
+    users = DfHelper.parse_nested(table.column('user').to_pandas())
+    entities = DfHelper.parse_nested(table.column('entities').to_pandas())
+    return [u.get('id') for u in users], [[h['text'] for h in e.get('hashtags', [])] for e in entities]
+
+
+def read_v2(path):
+    table = pq.read_table(path, columns=['user.id', 'entities.hashtags'])
+    hashtags = table.column('hashtags').combine_chunks()
+    texts = pa.ListArray.from_arrays(hashtags.offsets, hashtags.flatten().field('text'))
+    return table.column('id').to_pylist(), texts.to_pylist()
+
+
+def timed(fn, *args):
+    tic = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - tic
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=50000)
+    args = parser.parse_args()
+
+    tweets = synthetic_tweets(args.tweets)
+    folder = tempfile.mkdtemp()
+    paths = {v: os.path.join(folder, 'v%s.parquet' % v) for v in [1, 2]}
+    for v, path in paths.items():
+        write(tweets, v, path)
+
+    (ids1, tags1), v1_s = timed(read_v1, paths[1])
+    (ids2, tags2), v2_s = timed(read_v2, paths[2])
+    assert ids1 == ids2 and tags1 == tags2, 'readers disagree'
+
+    print('%s tweets' % args.tweets)
+    for v, s in [(1, v1_s), (2, v2_s)]:
+        print('v%s: %6.1f MB on disk, user.id + hashtag texts in %6.3fs (%9.0f tweets/s)' % (
+            v, os.path.getsize(paths[v]) / 1e6, s, args.tweets / s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+###
+# Candidate snowflake id enumeration: ingest_range's former nested loops vs Snowflake.id_blocks
+#
+#   python -m benchmarks.snowflake_ids [--legacy-seconds 60] [--hours 24]
+#
+# The legacy loop runs over --legacy-seconds of ids and is extrapolated to --hours;
+# the vectorized path enumerates all of --hours, and both are checked equal on the overlap.
+
+import argparse, time
+from collections import deque
+import numpy as np
+
+from modules.FirehoseJob import FirehoseJob
+from modules.Snowflake import Snowflake
+
+BEGIN_MS = 1584500000000
+
+
+#### Reference: the id generation formerly in FirehoseJob.ingest_range, minus hydration
+def legacy_ids(begin, end):
+    queue = deque()
+    out = []
+    for epoch in range(begin, end):
+        time_component = (epoch - FirehoseJob.SNOWFLAKE_EPOCH) << 22
+        for machine_id in FirehoseJob.MACHINE_IDS:
+            for sequence_id in [0]:
+                twitter_id = time_component + (machine_id << 12) + sequence_id
+                queue.append(twitter_id)
+                if len(queue) >= 100:
+                    out.extend([queue.popleft() for i in range(0, 100)])
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--legacy-seconds', type=int, default=60)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--block-size', type=int, default=FirehoseJob.IDS_PER_CHUNK)
+    args = parser.parse_args()
+
+    legacy_end = BEGIN_MS + args.legacy_seconds * 1000
+    tic = time.perf_counter()
+    old = legacy_ids(BEGIN_MS, legacy_end)
+    legacy_s = time.perf_counter() - tic
+    new = Snowflake.ids(BEGIN_MS, legacy_end, FirehoseJob.MACHINE_IDS)
+    assert np.array_equal(np.array(old, dtype=np.int64), new), 'id streams differ'
+
+    end = BEGIN_MS + args.hours * 3600 * 1000
+    tic = time.perf_counter()
+    n = 0
+    checksum = 0
+    for block in Snowflake.id_blocks(BEGIN_MS, end, FirehoseJob.MACHINE_IDS, block_size=args.block_size):
+        n += len(block)
+        checksum ^= int(np.bitwise_xor.reduce(block))
+    vectorized_s = time.perf_counter() - tic
+
+    decoded = Snowflake.decode(new[:1000])
+    assert (decoded['created_at_ms'].values == np.repeat(np.arange(BEGIN_MS, BEGIN_MS + 50), 20)).all()
+    assert set(decoded['machine_id']) == set(FirehoseJob.MACHINE_IDS)
+
+    scale = args.hours * 3600 / args.legacy_seconds
+    print('legacy loop : %9s ids in %7.2fs (%10.0f ids/s), ~%8.0fs for %sh' % (
+        len(old), legacy_s, len(old) / legacy_s, legacy_s * scale, args.hours))
+    print('id_blocks   : %9s ids in %7.2fs (%10.0f ids/s) for %sh, blocks of %s' % (
+        n, vectorized_s, n / vectorized_s, args.hours, args.block_size))
+
+
+if __name__ == '__main__':
+    main()
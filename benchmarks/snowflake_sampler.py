@@ -0,0 +1,79 @@
+###
+# Fixed snowflake scan (every MACHINE_ID at sequence 0) vs SnowflakeSampler, on a simulated id space
+#
+#   python -m benchmarks.snowflake_sampler [--hours 2] [--block 100000]
+#
+# Each machine id issues Poisson(rate) tweets per ms, numbered from sequence 0, so an id exists
+# iff its sequence < that ms's count. Rates are skewed (some machines idle, a few busy, some
+# with more than one tweet per ms), and the busiest machines swap halfway through to exercise
+# the hourly decay. Both strategies spend the same probes (lookups) per ms.
+
+import argparse
+import numpy as np
+
+from modules.FirehoseJob import FirehoseJob
+from modules.Snowflake import Snowflake
+from modules.SnowflakeSampler import SnowflakeSampler
+
+BEGIN_MS = 1584500400000
+
+
+class SimulatedIdSpace:
+
+    def __init__(self, machine_ids, seed=0):
+        self.machine_ids = np.asarray(machine_ids, dtype=np.int64)
+        rng = np.random.default_rng(seed)
+        self.rates = np.sort(rng.choice([0.0, 0.01, 0.05, 0.3, 1.5, 3.0], size=len(machine_ids)))
+        self.rng = np.random.default_rng(seed + 1)
+        self.swap_ms = None
+
+    def existing(self, ids):
+        ms = Snowflake.creation_time(ids)
+        rates = self.rates if ms[0] < self.swap_ms else self.rates[::-1]
+        ms_index = ms - ms.min()
+        machine_index = np.searchsorted(self.machine_ids, Snowflake.machine_id(ids))
+        counts = self.rng.poisson(rates[None, :], size=(ms_index.max() + 1, len(self.machine_ids)))
+        return ids[Snowflake.sequence_id(ids) < counts[ms_index, machine_index]]
+
+
+def run(blocks, space, sampler=None):
+    probes = 0
+    hits = 0
+    for ids in blocks:
+        found = space.existing(ids)
+        if not (sampler is None):
+            sampler.record(ids, found)
+        probes += len(ids)
+        hits += len(found)
+    return probes, hits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=float, default=2)
+    parser.add_argument('--block', type=int, default=FirehoseJob.IDS_PER_CHUNK)
+    args = parser.parse_args()
+
+    machine_ids = np.sort(np.asarray(FirehoseJob.MACHINE_IDS, dtype=np.int64))
+    end = BEGIN_MS + int(args.hours * 3600 * 1000)
+
+    space = SimulatedIdSpace(machine_ids)
+    space.swap_ms = (BEGIN_MS + end) // 2
+    fixed = run(Snowflake.id_blocks(BEGIN_MS, end, machine_ids, block_size=args.block), space)
+
+    space = SimulatedIdSpace(machine_ids)
+    space.swap_ms = (BEGIN_MS + end) // 2
+    sampler = SnowflakeSampler(machine_ids)
+    adaptive = run(sampler.id_blocks(BEGIN_MS, end, block_size=args.block), space, sampler)
+
+    for name, (probes, hits) in [('fixed', fixed), ('adaptive', adaptive)]:
+        print('%-9s: %11s probes, %10s hits, %.4f hits/probe, %7.1f tweets per 100-id lookup' % (
+            name, probes, hits, hits / probes, 100 * hits / probes))
+    print('adaptive recovered %.2fx the tweets for the same quota; probing sequences 0-%s' % (
+        adaptive[1] / fixed[1], sampler.max_sequence))
+    stats = sampler.hourly_stats()
+    print(stats.groupby('hour')[['probes', 'hits']].sum().assign(hit_rate=lambda df: df['hits'] / df['probes']))
+
+
+if __name__ == '__main__':
+    main()
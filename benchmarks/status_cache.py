@@ -0,0 +1,53 @@
+###
+# DfHelper.normalize_parquet_dataframe across many flushes, with and without a shared StatusCache
+#
+#   python -m benchmarks.status_cache [--tweets 50000] [--flush 1000] [--originals 200] [--schema-version 1]
+#
+# Synthetic tweets retweet/quote a small pool of originals (a viral event), split into
+# flush-sized batches as FirehoseJob hands them to Neo4j; outputs are checked equal.
+
+import argparse, time
+import pandas as pd
+import pyarrow as pa
+
+from benchmarks.synthetic import synthetic_tweets
+from modules.DfHelper import DfHelper
+from modules.FirehoseJob import FirehoseJob
+from modules.StatusCache import StatusCache
+
+
+def normalize_all(batches, status_cache=None):
+    tic = time.perf_counter()
+    out = [DfHelper(status_cache).normalize_parquet_dataframe(df) for df in batches]
+    return out, time.perf_counter() - tic
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=50000)
+    parser.add_argument('--flush', type=int, default=1000)
+    parser.add_argument('--originals', type=int, default=200)
+    parser.add_argument('--schema-version', type=int, default=1)
+    args = parser.parse_args()
+
+    tweets = synthetic_tweets(args.tweets, n_originals=args.originals)
+    fh = FirehoseJob(writers={}, schema_version=args.schema_version)
+    batches = [
+        DfHelper.table_to_pandas(pa.Table.from_batches([fh.tweets_to_arrow(tweets[i:i + args.flush])]))
+        for i in range(0, len(tweets), args.flush)]
+
+    plain, plain_s = normalize_all(batches)
+    cache = StatusCache()
+    cached, cached_s = normalize_all(batches, cache)
+    for a, b in zip(plain, cached):
+        pd.testing.assert_frame_equal(a, b)
+
+    print('batches     : %s x %s tweets, %s originals, schema v%s' % (
+        len(batches), args.flush, args.originals, args.schema_version))
+    print('no cache    : %10.0f tweets/s (%.2fs)' % (args.tweets / plain_s, plain_s))
+    print('StatusCache : %10.0f tweets/s (%.2fs) %s' % (args.tweets / cached_s, cached_s, cache.stats()))
+    print('speedup     : %.2fx' % (plain_s / cached_s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+###
+# Synthetic twarc (v1.1 extended mode) tweet dicts for benchmarks
+
+import datetime
+import numpy as np
+
+SNOWFLAKE_EPOCH = 1288834974657
+
+
+def snowflake(epoch_ms, machine_id=375, sequence_id=0):
+    return ((int(epoch_ms) - SNOWFLAKE_EPOCH) << 22) + (machine_id << 12) + sequence_id
+
+
+def twitter_time(epoch_ms):
+    return datetime.datetime.utcfromtimestamp(epoch_ms / 1000).strftime('%a %b %d %H:%M:%S +0000 %Y')
+
+
+def synthetic_user(uid):
+    return {
+        'id': uid,
+        'id_str': str(uid),
+        'name': 'User %s' % uid,
+        'screen_name': 'user%s' % uid,
+        'location': 'Earth',
+        'description': 'Synthetic account %s' % uid,
+        'url': None,
+        'entities': {'description': {'urls': []}},
+        'protected': False,
+        'followers_count': uid % 5000,
+        'friends_count': uid % 700,
+        'listed_count': 0,
+        'created_at': twitter_time(1300000000000 + uid * 1000),
+        'favourites_count': uid % 300,
+        'utc_offset': None,
+        'time_zone': None,
+        'geo_enabled': False,
+        'verified': uid % 97 == 0,
+        'statuses_count': uid % 10000,
+        'lang': None,
+        'profile_image_url': 'http://pbs.twimg.com/profile_images/%s/a_normal.jpg' % uid,
+        'profile_image_url_https': 'https://pbs.twimg.com/profile_images/%s/a_normal.jpg' % uid,
+        'default_profile': True,
+    }
+
+
+def synthetic_entities(i, users):
+    hashtags = [{'text': 'covid19', 'indices': [0, 8]}, {'text': 'tag%s' % (i % 50), 'indices': [9, 15]}][:i % 3]
+    urls = [{
+        'url': 'https://t.co/x%s' % i,
+        'expanded_url': 'https://example.com/p/%s?q=1' % (i % 1000),
+        'display_url': 'example.com/p/%s' % (i % 1000),
+        'indices': [20, 43]
+    }][:(i % 4) // 2]
+    mentions = [{
+        'screen_name': 'user%s' % users[i % len(users)],
+        'name': 'User %s' % users[i % len(users)],
+        'id': int(users[i % len(users)]),
+        'id_str': str(users[i % len(users)]),
+        'indices': [44, 50]
+    }][:i % 2]
+    return {'hashtags': hashtags, 'symbols': [], 'user_mentions': mentions, 'urls': urls}
+
+
+def synthetic_tweet(i, epoch_ms, users, embedded=None):
+    tid = snowflake(epoch_ms, sequence_id=i % 4096)
+    uid = int(users[i % len(users)])
+    tweet = {
+        'created_at': twitter_time(epoch_ms),
+        'id': tid,
+        'id_str': str(tid),
+        'full_text': 'Synthetic tweet %s #covid19 https://t.co/x%s' % (i, i),
+        'truncated': False,
+        'display_text_range': [0, 60],
+        'entities': synthetic_entities(i, users),
+        'source': '<a href="http://twitter.com/download/iphone" rel="nofollow">Twitter for iPhone</a>',
+        'in_reply_to_status_id': None,
+        'in_reply_to_status_id_str': None,
+        'in_reply_to_user_id': None,
+        'in_reply_to_user_id_str': None,
+        'in_reply_to_screen_name': None,
+        'user': synthetic_user(uid),
+        'geo': None,
+        'coordinates': None,
+        'place': None,
+        'contributors': None,
+        'is_quote_status': False,
+        'retweet_count': i % 100,
+        'favorite_count': i % 37,
+        'favorited': False,
+        'retweeted': False,
+        'lang': ['en', 'es', 'und'][i % 3],
+    }
+    if i % 5 == 1:
+        tweet['in_reply_to_status_id'] = tid - 4096
+        tweet['in_reply_to_status_id_str'] = str(tid - 4096)
+        tweet['in_reply_to_user_id'] = uid + 1
+        tweet['in_reply_to_user_id_str'] = str(uid + 1)
+        tweet['in_reply_to_screen_name'] = 'user%s' % (uid + 1)
+    if i % 5 == 2 and not (embedded is None):
+        tweet['retweeted_status'] = embedded
+        tweet['full_text'] = 'RT @%s: %s' % (embedded['user']['screen_name'], embedded['full_text'])
+    if i % 5 == 3 and not (embedded is None):
+        tweet['is_quote_status'] = True
+        tweet['quoted_status_id'] = embedded['id']
+        tweet['quoted_status_id_str'] = embedded['id_str']
+        tweet['quoted_status'] = embedded
+        tweet['quoted_status_permalink'] = {'url': 'https://t.co/q', 'expanded': 'https://twitter.com/x/status/%s' % embedded['id']}
+    if i % 11 == 0:
+        tweet['possibly_sensitive'] = False
+    return tweet
+
+
+def synthetic_tweets(n, seed=0, start_ms=1584500000000, n_originals=200):
+    rng = np.random.default_rng(seed)
+    users = rng.integers(1, max(n // 10, 2) + 1, max(n // 10, 2))
+    originals = [synthetic_tweet(j * 5, start_ms - 60000 - j, users) for j in range(n_originals)]
+    return [
+        synthetic_tweet(i, start_ms + i * 10, users, embedded=originals[i % len(originals)])
+        for i in range(n)
+    ]
@@ -1,12 +1,34 @@
-CREATE CONSTRAINT tweet_unique_id
-ON (n:Tweet) ASSERT n.id IS UNIQUE
+// Safe to re-run (cypher-shell -f neo4j-indexes.cypher); IF [NOT] EXISTS needs Neo4j 4.1+ (docker-compose.yml runs 4.4)
 
-CREATE CONSTRAINT account_unique_id
-ON (n:Account) ASSERT n.id IS UNIQUE
+CREATE CONSTRAINT tweet_unique_id IF NOT EXISTS
+ON (n:Tweet) ASSERT n.id IS UNIQUE;
 
-CREATE CONSTRAINT url_unique_full_url
-ON (n:Url) ASSERT n.full_url IS UNIQUE
+CREATE CONSTRAINT account_unique_id IF NOT EXISTS
+ON (n:Account) ASSERT n.id IS UNIQUE;
 
-CREATE INDEX tweet_by_type
+CREATE CONSTRAINT url_unique_full_url IF NOT EXISTS
+ON (n:Url) ASSERT n.full_url IS UNIQUE;
+
+// tweet_by_type indexed n.tweet_type, which the graph never stores; n.type is indexed under a new
+// name so re-runs do not drop and rebuild it
+DROP INDEX tweet_by_type IF EXISTS;
+
+CREATE INDEX tweet_by_type_v2 IF NOT EXISTS
 FOR (n:Tweet)
-ON (n.tweet_type)
\ No newline at end of file
+ON (n.type);
+
+CREATE INDEX tweet_by_type_created_at IF NOT EXISTS
+FOR (n:Tweet)
+ON (n.type, n.created_at);
+
+CREATE INDEX tweet_by_job_name_created_at IF NOT EXISTS
+FOR (n:Tweet)
+ON (n.job_name, n.created_at);
+
+CREATE INDEX tweet_by_hydrated_record_created_at IF NOT EXISTS
+FOR (n:Tweet)
+ON (n.hydrated, n.record_created_at);
+
+CREATE INDEX account_by_screen_name IF NOT EXISTS
+FOR (n:Account)
+ON (n.screen_name);
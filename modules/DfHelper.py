@@ -1,15 +1,188 @@
 import ast
+import json
+import re
+import numpy as np
 import pandas as pd
-from datetime import datetime
-import time
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .FieldExtractor import FieldExtractor
+from .ParquetWriterProfile import WRITER_PROFILES
 
 import logging
 logger = logging.getLogger('DfHelper')
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+    logger.debug('orjson not found, falling back to json')
+
 
 class DfHelper:
-    def __init__(self):
-        pass
+
+    TWITTER_DATETIME_FORMAT = '%a %b %d %H:%M:%S %z %Y'
+
+    # How an absent nested status reads back: null from current writers,
+    # 'None' / 'nan' / '0.0' from repr-era files
+    NULL_STRINGS = {'', 'None', 'nan', 'null', '0.0'}
+
+    # Leading '{"created_at": "...", "id": 123' of a JSON / repr status string, in Twitter's key order
+    EMBEDDED_ID_RE = re.compile(r'''^\{\s*["']created_at["']\s*:\s*["'][^"']*["']\s*,\s*["']id["']\s*:\s*(\d+)''')
+
+    # <stem>.<profile>2.parquet: FirehoseJob writes one such copy of each flush per writer
+    WRITER_FILE_RE = re.compile(r'^(?P<stem>.+)\.(?P<profile>\w+)2\.parquet$')
+
+    # Raw columns normalize_parquet_dataframe and Neo4jDataAccess.build_param_frames read
+    NORMALIZE_COLUMNS = [
+        'id', 'created_at', 'full_text', 'favorite_count', 'retweet_count', 'in_reply_to_status_id',
+        'quoted_status_id', 'is_quote_status', 'retweeted_status', 'quoted_status', 'user', 'entities',
+        'malformed']
+    # Raw nested columns, dead weight once flattened
+    NESTED_COLUMNS = ['retweeted_status', 'quoted_status', 'user', 'entities']
+    PARQUET_BATCH_ROWS = 50000
+
+    # The only nested fields normalization reads
+    # (ids as nullable Int64: float64 NaN padding rounds snowflakes above 2^53)
+    STATUS_FIELDS = FieldExtractor(['id', 'created_at', 'user.id'], dtypes={'id': 'Int64', 'user.id': 'Int64'})
+    USER_FIELDS = FieldExtractor([
+        'id', 'screen_name', 'created_at', 'followers_count', 'friends_count', 'favourites_count',
+        'utc_offset', 'time_zone', 'verified', 'statuses_count', 'profile_image_url', 'location',
+        'name', 'description'], dtypes={'id': 'Int64'})
+    STATUS_ID_COLUMNS = ['id', 'user_id']
+    ENTITY_FIELDS = FieldExtractor(['urls', 'hashtags', 'user_mentions'], keep_missing=True)
+
+    #status_cache: optional StatusCache of flattened retweeted/quoted statuses, shared across calls
+    def __init__(self, status_cache=None):
+        self.status_cache = status_cache
+
+    # Twitter 'Wed Mar 18 02:53:20 +0000 2020' strings -> datetimes; an explicit format
+    # skips per-row dateutil inference, which is kept as the fallback for anything else
+    @staticmethod
+    def to_datetime(series):
+        try:
+            if (series.str.slice(19, 26) == ' +0000 ').all():
+                # always UTC in practice: drop weekday/offset so parsing stays on the fast path
+                return pd.to_datetime(
+                    series.str.slice(4, 19) + series.str.slice(25, 30), format='%b %d %H:%M:%S %Y', utc=True)
+            return pd.to_datetime(series, format=DfHelper.TWITTER_DATETIME_FORMAT)
+        except (ValueError, TypeError, AttributeError):
+            return pd.to_datetime(series)
+
+    # Same as .apply(lambda dt: dt.timestamp()) via int64 arithmetic; NaT -> NaN
+    @staticmethod
+    def to_epoch_seconds(series):
+        if not pd.api.types.is_datetime64_any_dtype(series):
+            series = pd.to_datetime(series)
+        ns = np.asarray(series.values).astype('datetime64[ns]').view(np.int64)
+        return pd.Series(np.where(series.isnull().values, np.nan, ns / 1e9), index=series.index)
+
+    # 'retweet_quote' > 'retweet' > 'reply' > 'original', as __update_to_type did per row
+    @staticmethod
+    def status_type(pdf):
+        is_quote = pdf['is_quote_status'].fillna(False).astype(bool).values
+        is_retweet = pdf['retweeted'].fillna(False).astype(bool).values
+        is_reply = (pd.to_numeric(pdf['in_reply_to_status_id'], errors='coerce') > 0).fillna(False).to_numpy(dtype=bool)
+        return pd.Series(
+            np.select([is_quote, is_retweet, is_reply], ['retweet_quote', 'retweet', 'reply'], default='original'),
+            index=pdf.index)
+
+    # Decode a column of nested objects to dicts: arrow structs (schema v2) arrive as dicts,
+    # JSON strings (v1) are decoded, with a literal_eval fallback for python repr strings
+    # (older parquet files). Each distinct string is parsed once; null / unparseable -> {}
+    @staticmethod
+    def parse_nested(series):
+        if series.map(type).eq(dict).any():
+            return [DfHelper.__parse_nested_value(v) for v in series.values]
+        codes, uniques = pd.factorize(series.values)
+        #code -1 (null) indexes the trailing {}
+        parsed = [DfHelper.__parse_nested_value(v) for v in uniques] + [{}]
+        return [parsed[c] for c in codes]
+
+    @staticmethod
+    def is_null_nested(series):
+        return pd.Series(
+            [v is None or (isinstance(v, str) and v in DfHelper.NULL_STRINGS) or (type(v) == float and v != v)
+             for v in series.values],
+            index=series.index)
+
+    # Stable dedupe key per nested status: its id when decoded (dicts are unhashable), else its hash
+    @staticmethod
+    def nested_key(series):
+        return pd.Series(
+            [v.get('id') if isinstance(v, dict) else hash(v) for v in series.values],
+            index=series.index)
+
+    # table.to_pandas(), except struct columns (schema v2) become plain dicts: arrow's own
+    # conversion turns int children into floats once any row of the struct is null.
+    # Likewise int64 columns with nulls (e.g. normalized retweet_id) become nullable Int64, not float64
+    @staticmethod
+    def table_to_pandas(table):
+        structs = [field.name for field in table.schema if pa.types.is_struct(field.type)]
+        nullable_ints = [
+            field.name for field in table.schema
+            if pa.types.is_int64(field.type) and table.column(field.name).null_count > 0]
+        if len(structs) == 0 and len(nullable_ints) == 0:
+            return table.to_pandas()
+        pdf = table.drop(structs + nullable_ints).to_pandas()
+        return pdf.assign(
+            **{c: table.column(c).to_pylist() for c in structs},
+            **{c: DfHelper.to_nullable_ints(table.column(c)) for c in nullable_ints}
+        )[table.column_names]
+
+    # Arrow int64 column -> pandas Int64 with the exact values (arrow's types_mapper goes via float64)
+    @staticmethod
+    def to_nullable_ints(column):
+        return pd.arrays.IntegerArray(
+            pc.fill_null(column, 0).to_numpy(), column.is_null().to_numpy())
+
+    # Schema v2 nulls a struct that did not fit and keeps it in 'malformed' as JSON {col: raw}
+    @staticmethod
+    def restore_malformed(pdf):
+        if not ('malformed' in pdf) or pdf['malformed'].isnull().all():
+            return pdf
+        pdf = pdf.copy()
+        for idx, raw in pdf['malformed'].dropna().items():
+            for col, v in json_loads(raw).items():
+                if col in pdf:
+                    pdf.at[idx, col] = v
+        return pdf
+
+    # Embedded status id without a full parse: dicts (schema v2) directly, strings via
+    # EMBEDDED_ID_RE; None when not found
+    @staticmethod
+    def embedded_status_id(v):
+        if isinstance(v, dict):
+            return v.get('id')
+        if isinstance(v, str):
+            m = DfHelper.EMBEDDED_ID_RE.match(v)
+            if not (m is None):
+                return int(m.group(1))
+        return None
+
+    @staticmethod
+    def __parse_nested_value(v):
+        if isinstance(v, dict):
+            return v
+        if v is None or not isinstance(v, (str, bytes)) or v in DfHelper.NULL_STRINGS:
+            return {}
+        try:
+            out = json_loads(v)
+        except ValueError:
+            try:
+                out = ast.literal_eval(v)
+            except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+                logger.debug('bad nested value: %s', v[:100])
+                return {}
+        if not isinstance(out, dict):
+            return {}
+        return {
+            k if type(k) == str else str(k): out[k]
+            for k in out.keys()
+        }
 
     def __clean_timeline_tweets(self, pdf):
         #response_gdf = gdf[ (gdf['in_reply_to_status_id'] > 0) | (gdf['quoted_status_id'] > 0) ].drop_duplicates(['id'])
@@ -20,6 +193,7 @@ class DfHelper:
 
     def normalize_parquet_dataframe(self, df):
         pdf = df\
+            .pipe(self.restore_malformed)\
             .pipe(self.__clean_timeline_tweets)\
             .pipe(self.__clean_datetimes)\
             .pipe(self.__clean_retweeted)\
@@ -30,12 +204,62 @@ class DfHelper:
             .pipe(self.__flatten_entities)
         return pdf
 
+    # Parquet files (or every *.parquet under folders) -> normalized chunks of at most batch_rows rows.
+    # Each file is read a batch at a time with only `columns`, so peak memory follows batch_rows,
+    # not file size; the raw nested columns are dropped from each chunk unless keep_nested
+    def iter_normalized_parquet(self, paths, batch_rows=None, columns=None, keep_nested=False, input_profile=None):
+        batch_rows = DfHelper.PARQUET_BATCH_ROWS if batch_rows is None else batch_rows
+        columns = DfHelper.NORMALIZE_COLUMNS if columns is None else columns
+        for path in self.parquet_files(paths, input_profile):
+            logger.debug('normalizing %s', path)
+            parquet_file = pq.ParquetFile(path)
+            present = [c for c in columns if c in parquet_file.schema_arrow.names]
+            for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=present):
+                if batch.num_rows == 0:
+                    continue
+                pdf = self.normalize_parquet_dataframe(self.table_to_pandas(pa.Table.from_batches([batch])))
+                if not keep_nested:
+                    pdf = pdf.drop(columns=[c for c in DfHelper.NESTED_COLUMNS if c in pdf])
+                yield pdf
+
+    # Files listed in paths, plus every *.parquet under the folders in it. A folder flush written by
+    # several writers (<stem>.vanilla2.parquet, <stem>.snappy2.parquet) holds the same rows in each
+    # copy, so only one copy per stem is read: the input_profile one if given (stems without it are
+    # skipped), else the first by WRITER_PROFILES order
+    @staticmethod
+    def parquet_files(paths, input_profile=None):
+        files = []
+        for path in [paths] if isinstance(paths, str) else paths:
+            if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                    dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                    names = [n for n in names if n.endswith('.parquet') and not n.startswith('.')]
+                    files.extend(os.path.join(root, n) for n in DfHelper.one_copy_per_flush(names, input_profile))
+            else:
+                files.append(path)
+        return files
+
+    @staticmethod
+    def one_copy_per_flush(names, input_profile=None):
+        rank = {name: i for i, name in enumerate(WRITER_PROFILES.keys())}
+        out = []
+        copies = {}
+        for name in names:
+            m = DfHelper.WRITER_FILE_RE.match(name)
+            if m is None:
+                out.append(name)
+            elif input_profile is None:
+                copies.setdefault(m.group('stem'), []).append((rank.get(m.group('profile'), len(rank)), name))
+            elif m.group('profile') == input_profile:
+                out.append(name)
+        out.extend(min(stem_copies)[1] for stem_copies in copies.values())
+        return sorted(out)
+
     def __clean_datetimes(self, pdf):
         logger.debug('cleaning datetimes...')
         try:
-            pdf = pdf.assign(created_at=pd.to_datetime(pdf['created_at']))
-            pdf = pdf.assign(created_date=pdf['created_at'].apply(
-                lambda dt: dt.timestamp()))
+            pdf = pdf.assign(created_at=self.to_datetime(pdf['created_at']))
+            pdf = pdf.assign(created_date=self.to_epoch_seconds(pdf['created_at']))
         except Exception as e:
             logger.error('Error __clean_datetimes', e)
             logger.error(pdf)
@@ -46,22 +270,13 @@ class DfHelper:
     # some reason always False
     # this seems to match full_text[:2] == 'RT'
     def __clean_retweeted(self, pdf):
-        return pdf.assign(retweeted=pdf['retweeted_status'] != 'None')
-
-    def __update_to_type(self, row):
-        if row['is_quote_status']:
-            return 'retweet_quote'
-        if row['retweeted']:
-            return 'retweet'
-        if row['in_reply_to_status_id'] > 0:
-            return 'reply'
-        return 'original'
+        return pdf.assign(retweeted=~self.is_null_nested(pdf['retweeted_status']))
 
     def __tag_status_type(self, pdf):
         # only materialize required fields..
         logger.debug('tagging status...')
         pdf2 = pdf\
-            .assign(status_type=pdf[['is_quote_status', 'retweeted', 'in_reply_to_status_id']].apply(self.__update_to_type, axis=1))
+            .assign(status_type=self.status_type(pdf))
         logger.debug('   ...tagged')
         return pdf2
 
@@ -77,7 +292,7 @@ class DfHelper:
                     'Warning: did not add mt case col output addition - pdf')
                 return pdf
             # retweet_status -> hash -> lookup json for hash -> pull out id/created_at/user_id
-            pdf_hashed = pdf.assign(hashed=pdf[col].apply(hash))
+            pdf_hashed = pdf.assign(hashed=self.nested_key(pdf[col]))
             retweets = pdf_hashed[pdf_hashed['status_type'] == status_type][['hashed', col]]\
                 .drop_duplicates('hashed').reset_index(drop=True)
             if len(retweets) == 0:
@@ -85,25 +300,15 @@ class DfHelper:
                     'Warning: did not add mt case col output addition - retweets')
                 return pdf
             #print('sample', retweets[col].head(10), retweets[col].apply(type))
-            retweets_flattened = pd.io.json.json_normalize(
-                retweets[col].replace("(").replace(")")
-                .apply(self.__try_load))
+            debug_retweets = retweets
+            retweets_flattened = self.__flatten_statuses(retweets[col])
             if len(retweets_flattened.columns) == 0:
                 logger.debug('No tweets of type %s, early exit', status_type)
                 return pdf
             debug_retweets_flattened = retweets_flattened
-            debug_retweets = retweets
-            logger.debug('   ... fixing dates')
             logger.debug('avail cols of %s x %s: %s', len(retweets_flattened), len(
                 retweets_flattened.columns), retweets_flattened.columns)
             logger.debug(retweets_flattened)
-            if 'created_at' in retweets_flattened:
-                retweets_flattened = retweets_flattened.assign(
-                    created_at=pd.to_datetime(retweets_flattened['created_at']).apply(lambda dt: dt.timestamp))
-            if 'user.id' in retweets_flattened:
-                retweets_flattened = retweets_flattened.assign(
-                    user_id=retweets_flattened['user.id'])
-            logger.debug('   ... fixing dates')
             retweets = retweets[['hashed']]\
                 .assign(**{
                     prefix + c: retweets_flattened[c]
@@ -132,6 +337,48 @@ class DfHelper:
             logger.error('--------')
             raise e
 
+    # id / created_at (epoch s) / user_id of each embedded status, aligned with values
+    def __parse_statuses(self, values):
+        flat = DfHelper.STATUS_FIELDS.extract(self.parse_nested(values))
+        if 'created_at' in flat:
+            flat = flat.assign(created_at=self.to_epoch_seconds(self.to_datetime(flat['created_at'])))
+        if 'user.id' in flat:
+            flat = flat.assign(user_id=flat['user.id'])
+        return flat[[c for c in flat if c in ['id', 'created_at', 'user_id']]]
+
+    # __parse_statuses, except with a status_cache only the first row of each embedded id
+    # not already cached is parsed (and then cached); rows without a readable id always are
+    def __flatten_statuses(self, values):
+        if self.status_cache is None:
+            return self.__parse_statuses(values)
+        keys = [self.embedded_status_id(v) for v in values.values]
+        found = self.status_cache.get_many(
+            list(dict.fromkeys(k for k in keys if not (k is None))) + [k for k in keys if k is None])
+        parse_rows = []
+        pending = set()
+        for i, k in enumerate(keys):
+            if k is None:
+                parse_rows.append(i)
+            elif not (k in found) and not (k in pending):
+                pending.add(k)
+                parse_rows.append(i)
+        parsed_by_row = {}
+        if len(parse_rows) > 0:
+            parsed = self.__parse_statuses(values.iloc[parse_rows]).to_dict('records')
+            for i, record in zip(parse_rows, parsed):
+                parsed_by_row[i] = {
+                    c: v for c, v in record.items() if not (v is None or v is pd.NA or (type(v) == float and v != v))}
+            self.status_cache.put_many(
+                (record.get('id', keys[i]), record) for i, record in parsed_by_row.items())
+            found.update({keys[i]: record for i, record in parsed_by_row.items() if not (keys[i] is None)})
+        records = [parsed_by_row[i] if k is None else found[k] for i, k in enumerate(keys)]
+        columns = list(dict.fromkeys(c for record in records for c in record))
+        return pd.DataFrame({
+            c: pd.Series([record.get(c) for record in records], index=values.index,
+                         dtype='Int64' if c in DfHelper.STATUS_ID_COLUMNS else None)
+            for c in columns
+        }, index=values.index)
+
     def __flatten_retweets(self, pdf):
         logger.debug('flattening retweets...')
         pdf2 = self.__flatten_status_col(
@@ -148,38 +395,18 @@ class DfHelper:
 
     def __flatten_users(self, pdf):
         logger.debug('flattening users')
-        pdf_user_cols = pd.io.json.json_normalize(
-            pdf['user'].replace("(").replace(")").apply(ast.literal_eval))
-        pdf2 = pdf.assign(**{
-            'user_' + c: pdf_user_cols[c]
-            for c in pdf_user_cols if c in [
-                'id', 'screen_name', 'created_at', 'followers_count', 'friends_count', 'favourites_count',
-                'utc_offset', 'time_zone', 'verified', 'statuses_count', 'profile_image_url', 'location',
-                'name', 'description'
-            ]})
+        pdf_user_cols = DfHelper.USER_FIELDS.extract(self.parse_nested(pdf['user']), index=pdf.index)
+        pdf2 = pdf.assign(**{'user_' + c: pdf_user_cols[c] for c in pdf_user_cols})
         logger.debug('   ... fixing dates')
-        pdf2 = pdf2.assign(user_created_at=pd.to_datetime(
-            pdf2['user_created_at']).apply(lambda dt: dt.timestamp()))
+        pdf2 = pdf2.assign(user_created_at=self.to_epoch_seconds(
+            self.to_datetime(pdf2['user_created_at'])))
         logger.debug('   ...flattened')
         return pdf2
 
     def __flatten_entities(self, pdf):
         logger.debug('flattening urls')
-        pdf_entities = pd.io.json.json_normalize(
-            pdf['entities'].replace("(").replace(")").apply(ast.literal_eval))
+        pdf_entities = DfHelper.ENTITY_FIELDS.extract(self.parse_nested(pdf['entities']), index=pdf.index)
         pdf['urls'] = pdf_entities['urls']
         pdf['hashtags'] = pdf_entities['hashtags']
         pdf['user_mentions'] = pdf_entities['user_mentions']
         return pdf
-
-    def __try_load(self, s):
-        try:
-            out = ast.literal_eval(s)
-            return {
-                k if type(k) == str else str(k): out[k]
-                for k in out.keys()
-            }
-        except:
-            if s != 0.0:
-                logger.debug('bad s', s)
-            return {}
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+import logging
+logger = logging.getLogger('FieldExtractor')
+
+
+# Pulls a fixed list of dotted paths ('id', 'user.id', ...) out of nested dicts, one column
+# per path, in a single pass over the records: the projection of json_normalize's output onto
+# those paths, without first building a column for every other field.
+#  - a missing key, or a parent that is not a dict, reads as NaN
+#  - columns are inferred from their values like json_normalize's, or built with dtypes[path]:
+#    'Int64' keeps 64-bit ids exact where inference would pad missing values into float64
+#  - paths found in no record are left out, like json_normalize, unless keep_missing
+class FieldExtractor:
+
+    def __init__(self, paths, dtypes=None, keep_missing=False):
+        self.paths = list(paths)
+        self.keys = [tuple(path.split('.')) for path in self.paths]
+        self.dtypes = {} if dtypes is None else dtypes
+        self.keep_missing = keep_missing
+
+    # records: iterable of dicts (non-dicts count as empty); index: optional index for the result
+    def extract(self, records, index=None):
+        columns = [[] for path in self.paths]
+        found = [False] * len(self.paths)
+        for record in records:
+            for j, keys in enumerate(self.keys):
+                v = record
+                for k in keys:
+                    if isinstance(v, dict) and k in v:
+                        v = v[k]
+                    else:
+                        v = np.nan
+                        break
+                else:
+                    found[j] = True
+                columns[j].append(v)
+        df = pd.DataFrame({
+            #via object: pd.Series(values, dtype='Int64') routes NaN-padded ints through float64
+            path: columns[j] if not (path in self.dtypes) else pd.Series(columns[j], dtype='object').astype(self.dtypes[path])
+            for j, path in enumerate(self.paths) if found[j] or self.keep_missing
+        })
+        if not (index is None):
+            df.index = index
+        return df
@@ -1,17 +1,26 @@
 ###
 
-from collections import deque, defaultdict
-import datetime, gc, os, string, sys, time, uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import datetime, functools, gc, os, string, time, uuid
 import numpy as np
 import pandas as pd
 import pyarrow as pa
-import pyarrow.parquet as pq
 import simplejson as json #nan serialization
 from twarc import Twarc
 
 from .Timer import Timer
 from .TwarcPool import TwarcPool
 from .Neo4jDataAccess import Neo4jDataAccess
+from .DfHelper import DfHelper
+from .RecordBatchBuffer import RecordBatchBuffer
+from .FlushPipeline import FlushPipeline
+from .HydratedIdCache import HydratedIdCache
+from .PartitionedParquetWriter import PartitionedParquetWriter
+from .ParquetWriterProfile import WRITER_PROFILES
+from .Snowflake import Snowflake
+from .IngestCheckpoint import IngestCheckpoint
+from .StatusCache import StatusCache
 
 import logging
 logger = logging.getLogger('fh')
@@ -53,7 +62,7 @@ EXPECTED_COLS = [
     ('lang', string_dtype, None),
     ('place', string_dtype, None),
     ('possibly_sensitive', np.bool_, False),
-    ('quoted_status', string_dtype, 0.0),
+    ('quoted_status', string_dtype, None),
     ('quoted_status_id', id_type, 0),
     ('quoted_status_id_str', string_dtype, None),
     ('quoted_status_permalink', string_dtype, None),
@@ -71,37 +80,131 @@ EXPECTED_COLS = [
 
 DROP_COLS = [ 'withheld_in_countries' ]
 
-
-#### PARQUET WRITER BARFS
-#sizes_t = pa.struct({
-#                'h': pa.int64(),
-#                'resize': pa.string(),
-#                'w': pa.int64()
-#            })
-#
-#extended_entities_t = pa.struct({
-#    'media': pa.list_(pa.struct({
-#        'display_url': pa.string(),
-#        'expanded_url': pa.string(),
-#        'ext_alt_text': pa.string(),
-#        'id': pa.int64(),
-#        'id_str': pa.string(),
-#        'indices': pa.list_(pa.int64()),
-#        'media_url': pa.string(),
-#        'media_url_https': pa.string(),
-#        'sizes': pa.struct({
-#            'large': sizes_t,
-#            'medium': sizes_t,
-#            'small': sizes_t,
-#            'thumb': sizes_t
-#        }),
-#        'source_status_id': pa.int64(),
-#        'source_status_id_str': pa.string(),
-#        'source_user_id': pa.int64(),
-#        'source_user_id_str': pa.string(),
-#        'type': pa.string(),
-#        'url': pa.string()
-#    }))})
+### Nested tweet objects stored as JSON text (null when absent) for DfHelper to json-decode;
+### files written before this used python repr strings, which DfHelper still reads
+NESTED_JSON_COLS = [ 'entities', 'quoted_status', 'retweeted_status', 'user' ]
+
+
+### Schema v2: nested tweet objects as arrow structs/lists instead of strings,
+### so readers can prune to e.g. user.id or entities.hashtags.text
+### Keys not listed are dropped; retweeted/quoted statuses keep quoted_status_id, not the nested status
+
+sizes_t = pa.struct([
+    ('h', pa.int64()),
+    ('resize', pa.string()),
+    ('w', pa.int64())
+])
+
+media_t = pa.struct([
+    ('display_url', pa.string()),
+    ('expanded_url', pa.string()),
+    ('ext_alt_text', pa.string()),
+    ('id', pa.int64()),
+    ('id_str', pa.string()),
+    ('indices', pa.list_(pa.int64())),
+    ('media_url', pa.string()),
+    ('media_url_https', pa.string()),
+    ('sizes', pa.struct([
+        ('large', sizes_t),
+        ('medium', sizes_t),
+        ('small', sizes_t),
+        ('thumb', sizes_t)
+    ])),
+    ('source_status_id', pa.int64()),
+    ('source_status_id_str', pa.string()),
+    ('source_user_id', pa.int64()),
+    ('source_user_id_str', pa.string()),
+    ('type', pa.string()),
+    ('url', pa.string())
+])
+
+hashtag_t = pa.struct([
+    ('text', pa.string()),
+    ('indices', pa.list_(pa.int64()))
+])
+
+entities_t = pa.struct([
+    ('hashtags', pa.list_(hashtag_t)),
+    ('symbols', pa.list_(hashtag_t)),
+    ('user_mentions', pa.list_(pa.struct([
+        ('id', pa.int64()),
+        ('id_str', pa.string()),
+        ('indices', pa.list_(pa.int64())),
+        ('name', pa.string()),
+        ('screen_name', pa.string())
+    ]))),
+    ('urls', pa.list_(pa.struct([
+        ('display_url', pa.string()),
+        ('expanded_url', pa.string()),
+        ('indices', pa.list_(pa.int64())),
+        ('url', pa.string())
+    ]))),
+    ('media', pa.list_(media_t))
+])
+
+extended_entities_t = pa.struct([
+    ('media', pa.list_(media_t))
+])
+
+user_t = pa.struct([
+    ('id', pa.int64()),
+    ('id_str', pa.string()),
+    ('name', pa.string()),
+    ('screen_name', pa.string()),
+    ('location', pa.string()),
+    ('description', pa.string()),
+    ('url', pa.string()),
+    ('protected', pa.bool_()),
+    ('followers_count', pa.int64()),
+    ('friends_count', pa.int64()),
+    ('listed_count', pa.int64()),
+    ('created_at', pa.string()),
+    ('favourites_count', pa.int64()),
+    ('utc_offset', pa.int64()),
+    ('time_zone', pa.string()),
+    ('geo_enabled', pa.bool_()),
+    ('verified', pa.bool_()),
+    ('statuses_count', pa.int64()),
+    ('lang', pa.string()),
+    ('profile_image_url', pa.string()),
+    ('profile_image_url_https', pa.string()),
+    ('default_profile', pa.bool_())
+])
+
+status_t = pa.struct([
+    ('created_at', pa.string()),
+    ('id', pa.int64()),
+    ('id_str', pa.string()),
+    ('full_text', pa.string()),
+    ('truncated', pa.bool_()),
+    ('display_text_range', pa.list_(pa.int64())),
+    ('entities', entities_t),
+    ('extended_entities', extended_entities_t),
+    ('source', pa.string()),
+    ('in_reply_to_status_id', pa.int64()),
+    ('in_reply_to_status_id_str', pa.string()),
+    ('in_reply_to_user_id', pa.int64()),
+    ('in_reply_to_user_id_str', pa.string()),
+    ('in_reply_to_screen_name', pa.string()),
+    ('user', user_t),
+    ('is_quote_status', pa.bool_()),
+    ('quoted_status_id', pa.int64()),
+    ('quoted_status_id_str', pa.string()),
+    ('retweet_count', pa.int64()),
+    ('favorite_count', pa.int64()),
+    ('favorited', pa.bool_()),
+    ('retweeted', pa.bool_()),
+    ('possibly_sensitive', pa.bool_()),
+    ('lang', pa.string())
+])
+
+STRUCT_FIELDS = {
+    'entities': entities_t,
+    'extended_entities': extended_entities_t,
+    'quoted_status': status_t,
+    'retweeted_status': status_t,
+    'user': user_t
+}
 
 ### When dtype -> arrow ambiguious, override
 KNOWN_FIELDS = [
@@ -148,6 +251,22 @@ KNOWN_FIELDS = [
     [34, 'followers', pa.string()]
 ]
 
+### v1: nested objects as JSON strings; v2: as STRUCT_FIELDS, plus 'malformed': JSON {col: raw value}
+### for any row whose nested object did not fit its struct (that struct is then null)
+KNOWN_FIELDS_V2 = [
+    [i, name, STRUCT_FIELDS.get(name, t)]
+    for (i, name, t) in KNOWN_FIELDS
+] + [
+    [35, 'malformed', pa.string()]
+]
+
+SCHEMA_VERSIONS = {
+    1: KNOWN_FIELDS,
+    2: KNOWN_FIELDS_V2
+}
+
+SCHEMA_VERSION_KEY = b'domino.schema_version'
+
 #############################
 
 
@@ -156,24 +275,47 @@ class FirehoseJob:
     ###################
 
     MACHINE_IDS = (375, 382, 361, 372, 364, 381, 376, 365, 363, 362, 350, 325, 335, 333, 342, 326, 327, 336, 347, 332)
-    SNOWFLAKE_EPOCH = 1288834974657
+    SNOWFLAKE_EPOCH = Snowflake.EPOCH
+
+    #ids handed to process_ids per ingest_range chunk
+    IDS_PER_CHUNK = 100000
 
     EXPECTED_COLS = EXPECTED_COLS
     KNOWN_FIELDS = KNOWN_FIELDS
+    KNOWN_FIELDS_V2 = KNOWN_FIELDS_V2
+    SCHEMA_VERSIONS = SCHEMA_VERSIONS
+    STRUCT_FIELDS = STRUCT_FIELDS
     DROP_COLS = DROP_COLS
+    NULLABLE_ID_COLS = ['in_reply_to_status_id', 'in_reply_to_user_id', 'quoted_status_id']
+    NESTED_JSON_COLS = NESTED_JSON_COLS
 
 
-    def __init__(self, creds = [], neo4j_creds = None, TWEETS_PER_PROCESS=100, TWEETS_PER_ROWGROUP=5000, save_to_neo=False, PARQUET_SAMPLE_RATE_TIME_S=None, debug=False, BATCH_LEN=100, writers = {'snappy': None}):
+    def __init__(self, creds = [], neo4j_creds = None, TWEETS_PER_PROCESS=100, TWEETS_PER_ROWGROUP=5000, save_to_neo=False, PARQUET_SAMPLE_RATE_TIME_S=None, debug=False, BATCH_LEN=100, writers = {'snappy': None}, neo4j_pool_size=None, neo4j_writer_threads=1, arrow_native=False,
+                 BYTES_PER_ROWGROUP=None, DEBUG_WRITES_RETAINED=10, async_flush=False, FLUSH_QUEUE_SIZE=2,
+                 parallel_hydrate=False, hydrated_cache_path=None, schema_version=1, partitioned=False,
+                 writer_profiles=None, status_cache_items=None, status_cache_bytes=None):
         self.queue = deque()
+        #writers: {profile name: None}, one output file per name; writer_profiles adds/overrides WRITER_PROFILES
         self.writers = writers
+        self.writer_profiles = {**WRITER_PROFILES, **({} if writer_profiles is None else writer_profiles)}
+        missing_profiles = [k for k in writers.keys() if not (k in self.writer_profiles)]
+        if len(missing_profiles) > 0:
+            raise ValueError('No writer profile for %s, known: %s' % (missing_profiles, list(self.writer_profiles.keys())))
         self.last_write_epoch = ''
-        self.current_table = None
+        #schema_version: 1 (nested objects as JSON strings) or 2 (arrow structs), see SCHEMA_VERSIONS
+        self.schema_version = schema_version
         self.schema = pa.schema([
             (name, t)
-            for (i, name, t) in KNOWN_FIELDS
-        ])
+            for (i, name, t) in FirehoseJob.SCHEMA_VERSIONS[schema_version]
+        ], metadata={SCHEMA_VERSION_KEY: str(schema_version).encode()})
+        self.struct_fields = {
+            field.name: field.type
+            for field in self.schema if pa.types.is_struct(field.type)
+        }
+        self.buffer = RecordBatchBuffer()
         self.timer = Timer()
         self.debug = debug
+        self.arrow_native = arrow_native
 
         self.twarc_pool = TwarcPool([
             Twarc(o['consumer_key'], o['consumer_secret'], o['access_token'], o['access_token_secret'])
@@ -182,17 +324,44 @@ class FirehoseJob:
         self.save_to_neo = save_to_neo
         self.TWEETS_PER_PROCESS = TWEETS_PER_PROCESS #100
         self.TWEETS_PER_ROWGROUP = TWEETS_PER_ROWGROUP #100 1KB x 1000 = 1MB uncompressed parquet
+        self.BYTES_PER_ROWGROUP = BYTES_PER_ROWGROUP #optional: also flush once buffered arrow bytes exceed this
         self.PARQUET_SAMPLE_RATE_TIME_S = PARQUET_SAMPLE_RATE_TIME_S
         self.last_df = None
         self.last_arr = None
         self.last_write_arr = None
-        self.last_writes_arr = []
+        self.last_writes_arr = deque(maxlen=DEBUG_WRITES_RETAINED)
 
         self.neo4j_creds = neo4j_creds
+        self.neo4j_pool_size = neo4j_pool_size
+        self.neo4j_writer_threads = neo4j_writer_threads
+        self.__neo4j_data_access = None
+        #status_cache_items / _bytes: bounds of the flattened retweeted/quoted status LRU kept across flushes
+        #  (None: StatusCache defaults, 0 items: off)
+        self.status_cache = None if status_cache_items == 0 else StatusCache(status_cache_items, status_cache_bytes)
 
         self.BATCH_LEN = BATCH_LEN
+        #parallel_hydrate: process_ids hydrates batches on every pooled credential at once
+        self.parallel_hydrate = parallel_hydrate
+        #hydrated_cache_path: on-disk set of already-hydrated ids, checked before asking Neo4j
+        self.hydrated_cache = None if hydrated_cache_path is None else HydratedIdCache(hydrated_cache_path)
 
         self.needs_to_flush = False
+        #tables handed to the writers so far
+        self.flush_count = 0
+        #tables every flush stage has finished writing, once their pipeline is drained (see written_flush_count)
+        self.__written_flushes = 0
+
+        #async_flush: parquet + neo4j writes run on background threads, fed by a bounded queue of flushed tables
+        self.async_flush = async_flush
+        self.FLUSH_QUEUE_SIZE = FLUSH_QUEUE_SIZE
+        self.__flush_pipeline = None
+
+        #partitioned: write firehose_data/job=<job>/date=<d>/hour=<h>/ by tweet creation time instead of flat files
+        #  a single copy, using the first writers profile
+        self.partitioned_writer = None
+        if partitioned:
+            profile = self.writer_profiles[next(iter(writers.keys()), 'snappy')]
+            self.partitioned_writer = PartitionedParquetWriter(profile=profile)
 
         self.__file_names = []
 
@@ -204,7 +373,10 @@ class FirehoseJob:
 
     def destroy(self, job_name='generic_job'):
         logger.debug('flush before destroying..')
-        self.flush(job_name)
+        try:
+            self.flush(job_name)
+        finally:
+            self.drain_flushes()
 
         logger.debug('destroy', self.writers.keys())        
 
@@ -226,14 +398,25 @@ class FirehoseJob:
 
     ###################
 
+    # One Neo4jDataAccess per job; its drivers come from the shared Neo4jDriverPool
+    def neo4j_data_access(self):
+        if self.__neo4j_data_access is None:
+            self.__neo4j_data_access = Neo4jDataAccess(
+                self.debug, self.neo4j_creds, max_connection_pool_size=self.neo4j_pool_size,
+                writer_threads=self.neo4j_writer_threads, status_cache=self.status_cache)
+        return self.__neo4j_data_access
+
+    ###################
+
+    #id may be an int or an int64 array
     def get_creation_time(self, id):
-        return ((id >> 22) + 1288834974657)
+        return Snowflake.creation_time(id)
 
     def machine_id(self, id):
-        return (id >> 12) & 0b1111111111
+        return Snowflake.machine_id(id)
 
     def sequence_id(self, id):
-        return id & 0b111111111111
+        return Snowflake.sequence_id(id)
 
 
     ###################
@@ -249,6 +432,8 @@ class FirehoseJob:
             identity = lambda x: x
 
             series_to_json_string = (lambda series: series.apply(lambda x: json.dumps(x, ignore_nan=True)))
+            series_to_json_or_null = (lambda series: series.apply(
+                lambda x: None if FirehoseJob.__is_missing(x) else json.dumps(x, ignore_nan=True)))
 
             ##objects: put here to skip str coercion
             coercions = {
@@ -262,7 +447,9 @@ class FirehoseJob:
                 'in_reply_to_user_id': (lambda series: series.fillna(0).astype('int64')),
                 'scopes': series_to_json_string,
                 'followers': series_to_json_string,
-                'withheld_in_countries': series_to_json_string
+                'withheld_in_countries': series_to_json_string,
+                **{c: series_to_json_or_null for c in FirehoseJob.NESTED_JSON_COLS},
+                **{c: identity for c in self.struct_fields.keys()}
             }
             if series.name in coercions.keys():
                 return coercions[series.name](series)
@@ -287,7 +474,11 @@ class FirehoseJob:
             }
             all_cols_df = raw_df.assign(**new_cols)
             sorted_df = all_cols_df.reindex(sorted(all_cols_df.columns), axis=1)
-            return pd.DataFrame({c: self.clean_series(sorted_df[c]) for c in sorted_df.columns})
+            df = pd.DataFrame({c: self.clean_series(sorted_df[c]) for c in sorted_df.columns})
+            if len(self.struct_fields) > 0:
+                fitted, malformed = self.fit_structs({c: df[c].tolist() for c in self.struct_fields.keys()})
+                df = df.assign(**{c: vals for c, (arr, vals) in fitted.items()}, malformed=malformed)
+            return df
         except Exception as exn:
             logger.error('failed clean')
             logger.error(exn)
@@ -303,7 +494,7 @@ class FirehoseJob:
         return self.__file_names.copy()
 
 
-    #TODO <topic>/<year>/<mo>/<day>/<24hour_utc>_<nth>.parquet (don't clobber..)
+    #Flat per-job files; FirehoseJob(partitioned=True) writes the hive-partitioned layout instead
     def pq_writer(self, table, job_name='generic_job'):
         try:
             self.timer.tic('write', 1000)
@@ -315,54 +506,27 @@ class FirehoseJob:
             os.makedirs(folder, exist_ok=True)
             self.__folder_last = folder
 
-            vanilla_file_suffix = 'vanilla2.parquet'
-            snappy_file_suffix = 'snappy2.parquet'
+            suffixes = [self.writer_profiles[name].file_suffix for name in self.writers.keys()]
             time_prefix = datetime.datetime.now().strftime("%Y_%m_%d_%H")
             run = 0
             file_prefix = ""
             while (file_prefix == "") \
-                or os.path.exists(file_prefix + vanilla_file_suffix) \
-                or os.path.exists(file_prefix + snappy_file_suffix):
+                or any([os.path.exists(file_prefix + suffix) for suffix in suffixes]):
                 run = run + 1
                 file_prefix = "%s/%s_b%s." % ( folder, time_prefix, run )
             if run > 1:
                 logger.debug('Starting new batch for existing hour')
-            vanilla_file_name = file_prefix + vanilla_file_suffix
-            snappy_file_name = file_prefix + snappy_file_suffix
-
-            #########################################################
-
 
             #########################################################
-            if ('vanilla' in self.writers) and ( (self.writers['vanilla'] is None) or self.last_write_epoch != file_prefix ):
-                logger.debug('Creating vanilla writer: %s', vanilla_file_name)
-                try:
-                    #first write
-                    #os.remove(vanilla_file_name)
-                    1
-                except Exception as exn:
-                    logger.debug(('Could not rm vanilla parquet', exn))
-                self.writers['vanilla'] = pq.ParquetWriter(
-                    vanilla_file_name,
-                    schema=table.schema,
-                compression='NONE')
-                self.__file_names.append(vanilla_file_name)
-
-            if ('snappy' in self.writers) and ( (self.writers['snappy'] is None) or self.last_write_epoch != file_prefix ):
-                logger.debug('Creating snappy writer: %s', snappy_file_name)
-                try:
-                    #os.remove(snappy_file_name)
-                    1
-                except Exception as exn:
-                    logger.error(('Could not rm snappy parquet', exn))
-                self.writers['snappy'] = pq.ParquetWriter(
-                    snappy_file_name,
-                    schema=table.schema,
-                    compression={
-                        field.name.encode(): 'SNAPPY'
-                        for field in table.schema
-                    })
-                self.__file_names.append(snappy_file_name)
+            for name in self.writers.keys():
+                if (self.writers[name] is None) or self.last_write_epoch != file_prefix:
+                    profile = self.writer_profiles[name]
+                    file_name = file_prefix + profile.file_suffix
+                    logger.debug('Creating %s writer: %s', name, file_name)
+                    if not (self.writers[name] is None):
+                        self.writers[name].close()
+                    self.writers[name] = profile.open_writer(file_name, table.schema)
+                    self.__file_names.append(file_name)
 
             self.last_write_epoch = file_prefix
             ######################################################
@@ -373,7 +537,7 @@ class FirehoseJob:
                         name, table.num_rows, table.num_columns))
                     self.timer.tic('writing_%s' % name, 20, 1)
                     writer = self.writers[name]
-                    writer.write_table(table)
+                    self.writer_profiles[name].write(writer, table)
                     logger.debug('========')
                     logger.debug(table.schema)
                     logger.debug('--------')
@@ -394,36 +558,131 @@ class FirehoseJob:
         finally:
             self.timer.toc('write')
 
+    #Rows buffered since the last flush, combined into one table (None when empty)
+    @property
+    def current_table(self):
+        return self.buffer.to_table()
+
+    def needs_flush(self):
+        return (self.buffer.num_rows > self.TWEETS_PER_ROWGROUP) \
+            or (not (self.BYTES_PER_ROWGROUP is None) and self.buffer.nbytes > self.BYTES_PER_ROWGROUP)
+
+    #job=<job>/date=<d>/hour=<h>/ partitions from each tweet's snowflake creation time
+    def partitioned_pq_writer(self, table, job_name='generic_job'):
+        try:
+            self.timer.tic('write', 1000)
+            job_name = self.clean_file_name(job_name)
+            paths = self.partitioned_writer.write(table, job_name)
+            self.__folder_last = self.partitioned_writer.job_folder(job_name)
+            self.__file_names.extend(paths)
+            self.last_write_arr = table
+            self.last_writes_arr.append(table)
+        finally:
+            self.timer.toc('write')
+
+    def flush_parquet(self, table, job_name):
+        if self.partitioned_writer is None:
+            self.pq_writer(table, job_name)
+        else:
+            self.partitioned_pq_writer(table, job_name)
+
+    def flush_neo4j(self, table, job_name):
+        try:
+            logger.debug('Writing to Neo4j')
+            self.neo4j_data_access().save_parquet_df_to_graph(DfHelper.table_to_pandas(table), job_name)
+            if not (self.status_cache is None):
+                logger.debug('Status cache: %s', self.status_cache.stats())
+        except Exception as e:
+            logger.error('Neo4j write exn', e)
+            raise e
+
+    #Mark the table's ids hydrated once its last configured stage (Neo4j with save_to_neo, else parquet)
+    #succeeded: missing_ids then skips them, so a failed or lost write must not record them
+    def record_hydrated(self, table):
+        if not (self.hydrated_cache is None):
+            self.hydrated_cache.add(table.column('id').to_numpy())
+
+    def flush_and_record(self, flush_fn, table, job_name):
+        flush_fn(table, job_name)
+        self.record_hydrated(table)
+
+    def flush_pipeline(self):
+        if self.__flush_pipeline is None:
+            stages = [('parquet', self.flush_parquet)]
+            if self.save_to_neo:
+                stages.append(('neo4j', self.flush_neo4j))
+            last_name, last_fn = stages[-1]
+            stages[-1] = (last_name, functools.partial(self.flush_and_record, last_fn))
+            self.__flush_pipeline = FlushPipeline(stages, self.FLUSH_QUEUE_SIZE)
+        return self.__flush_pipeline
+
+    #Raise any error from a background flush (async_flush only)
+    def check_flushes(self):
+        if not (self.__flush_pipeline is None):
+            self.__flush_pipeline.check()
+
+    #Block until every table flushed so far is written, re-raising any background error (async_flush only)
+    def wait_for_flushes(self):
+        if not (self.__flush_pipeline is None):
+            self.__flush_pipeline.wait()
+
+    #Wait for queued background flushes to finish, re-raising their first error
+    def drain_flushes(self):
+        if not (self.__flush_pipeline is None):
+            logger.debug('draining background flushes: %s', self.__flush_pipeline.pending())
+            pipeline = self.__flush_pipeline
+            self.__flush_pipeline = None
+            try:
+                pipeline.close()
+            finally:
+                self.__written_flushes += pipeline.completed()
+
+    #Tables every flush stage has finished writing, in flush order: flush_count minus those queued or failed
+    def written_flush_count(self):
+        if self.__flush_pipeline is None:
+            return self.__written_flushes
+        return self.__written_flushes + self.__flush_pipeline.completed()
+
     def flush(self, job_name="generic_job"):
         try:
-            if self.current_table is None or self.current_table.num_rows == 0:
+            if self.buffer.is_empty():
+                return
+            logger.debug('writing to parquet then clearing buffer (%s rows, %s bytes)..',
+                self.buffer.num_rows, self.buffer.nbytes)
+            table = self.buffer.to_table()
+            self.flush_count += 1
+            if self.async_flush:
+                #blocks when the writers fall FLUSH_QUEUE_SIZE tables behind
+                self.flush_pipeline().submit(table, job_name)
                 return
-            logger.debug('writing to parquet then clearing current_table..')
             deferred_pq_exn = None
             try:
-                self.pq_writer(self.current_table, job_name)
+                self.flush_parquet(table, job_name)
             except Exception as e:
                 deferred_pq_exn = e
-            try:
-                if self.save_to_neo:
-                    logger.debug('Writing to Neo4j')
-                    Neo4jDataAccess(self.debug, self.neo4j_creds).save_parquet_df_to_graph(self.current_table.to_pandas(), job_name)
-                else:
-                    logger.debug('Skipping Neo4j write')
-            except Exception as e:
-                logger.error('Neo4j write exn', e)
-                raise e
+            if self.save_to_neo:
+                self.flush_neo4j(table, job_name)
+            else:
+                logger.debug('Skipping Neo4j write')
             if not (deferred_pq_exn is None):
+                #not recorded, so missing_ids re-fetches the batch and fills the parquet gap
                 raise deferred_pq_exn
+            self.record_hydrated(table)
+            self.__written_flushes += 1
         finally:
-            logger.debug('flush clearing self.current_table')
-            self.current_table = None
+            logger.debug('flush clearing self.buffer')
+            self.buffer.clear()
 
     def tweets_to_df(self, tweets):
         try:
             self.timer.tic('to_pandas', 1000)
             df = pd.DataFrame(tweets)
             df = df.drop(columns=FirehoseJob.DROP_COLS, errors='ignore')
+            #pandas pads these with NaN (float64), rounding snowflakes above 2^53: rebuild from the dicts
+            df = df.assign(**{
+                c: pd.Series([t.get(c) for t in tweets], index=df.index, dtype='Int64')
+                for c in FirehoseJob.NULLABLE_ID_COLS if c in df
+            })
             self.last_df = df
             return df
         except Exception as exn:
@@ -472,11 +731,11 @@ class FirehoseJob:
                     logger.error('arrow')
                     logger.error([schema[k] for k in range(0, len(schema))])
                     logger.error('~~~~~~~~')
-                    if not (self.current_table is None):
+                    if not self.buffer.is_empty():
                         try:
-                            logger.error(self.current_table.to_pandas()[:3])
+                            logger.error(self.buffer.batches[0].to_pandas()[:3])
                             logger.error('----')
-                            logger.error([self.current_table.schema[k] for k in range(0, self.current_table.num_columns)])
+                            logger.error(self.buffer.schema)
                         except Exception as exn2:
                             logger.error(('cannot to_pandas print..', exn2))
                 except:
@@ -499,6 +758,104 @@ class FirehoseJob:
             self.timer.toc('df_with_schema_to_arrow')
 
 
+    ###################
+
+    #Same coercions as clean_series, on python lists rather than pandas series
+    def __arrow_coercions(self):
+        to_json_string = lambda vals: [json.dumps(v, ignore_nan=True) for v in vals]
+        to_json_or_null = lambda vals: [None if FirehoseJob.__is_missing(v) else json.dumps(v, ignore_nan=True) for v in vals]
+        to_string = lambda vals: [str(v) for v in vals]
+        fill = lambda default: (lambda vals: [default if FirehoseJob.__is_missing(v) else v for v in vals])
+        return {
+            'display_text_range': to_json_string,
+            'contributors': fill(None),
+            'created_at': to_string,
+            'possibly_sensitive': fill(False),
+            'quoted_status_id': fill(0),
+            'extended_entities': to_json_string,
+            'in_reply_to_status_id': fill(0),
+            'in_reply_to_user_id': fill(0),
+            'scopes': to_json_string,
+            'followers': to_json_string,
+            'withheld_in_countries': to_json_string,
+            **{c: to_json_or_null for c in FirehoseJob.NESTED_JSON_COLS if not (c in self.struct_fields)}
+        }
+
+    #Nested values (col -> list of dicts) -> (col -> (struct array, fitted values), malformed column)
+    #A row that does not fit its struct type is nulled there, and its raw object kept as JSON
+    #in malformed[row] = {col: raw, ...}, so nothing is silently lost
+    def fit_structs(self, columns):
+        n = len(next(iter(columns.values()), []))
+        fitted = {}
+        malformed = None
+        for name, vals in columns.items():
+            struct_t = self.struct_fields[name]
+            vals = [None if FirehoseJob.__is_missing(v) else v for v in vals]
+            try:
+                fitted[name] = (pa.array(vals, type=struct_t), vals)
+                continue
+            except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError, TypeError) as exn:
+                logger.debug('Malformed %s in batch, fitting row by row: %s', name, exn)
+            if malformed is None:
+                malformed = [None] * len(vals)
+            for i, v in enumerate(vals):
+                if v is None:
+                    continue
+                try:
+                    pa.array([v], type=struct_t)
+                except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError, TypeError):
+                    logger.warning('Malformed %s in status, storing as JSON', name)
+                    malformed[i] = {**(malformed[i] or {}), name: v}
+                    vals[i] = None
+            fitted[name] = (pa.array(vals, type=struct_t), vals)
+        if malformed is None:
+            return fitted, [None] * n
+        return fitted, [None if m is None else json.dumps(m, ignore_nan=True) for m in malformed]
+
+    @staticmethod
+    def __is_missing(v):
+        return v is None or (type(v) == float and v != v)
+
+    #tweet dicts -> RecordBatch against self.schema, skipping the pandas intermediate
+    #Matches tweets_to_df -> clean_df -> df_with_schema_to_arrow, including pandas' quirks:
+    #  keys absent from some tweets become NaN ('nan' once stringified), keys absent
+    #  from all tweets take their EXPECTED_COLS default, dropped cols only take defaults
+    def tweets_to_arrow(self, tweets):
+        try:
+            self.timer.tic('to_arrow', 1000)
+            defaults = {c: c_default for (c, c_dtype, c_default) in FirehoseJob.EXPECTED_COLS}
+            coercions = self.__arrow_coercions()
+            nan = float('nan')
+            fitted, malformed = self.fit_structs({
+                name: [t.get(name, nan) for t in tweets]
+                for name in self.struct_fields.keys()
+            })
+            arrays = []
+            for field in self.schema:
+                name = field.name
+                if name in fitted:
+                    arrays.append(fitted[name][0])
+                    continue
+                if name == 'malformed':
+                    arrays.append(pa.array(malformed, type=field.type))
+                    continue
+                if (name not in FirehoseJob.DROP_COLS) and any(name in t for t in tweets):
+                    vals = [t.get(name, nan) for t in tweets]
+                else:
+                    vals = [defaults.get(name)] * len(tweets)
+                if name in coercions:
+                    vals = coercions[name](vals)
+                elif pa.types.is_string(field.type):
+                    vals = [str(v) for v in vals]
+                arrays.append(pa.array(vals, type=field.type, from_pandas=True))
+            return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        except Exception as exn:
+            logger.error('Failed tweets->arrow')
+            logger.error(exn)
+            raise exn
+        finally:
+            self.timer.toc('to_arrow')
+
     def concat_tables(self, table_old, table_new):
         try:
             self.timer.tic('concat_tables', 1000)
@@ -522,8 +879,8 @@ class FirehoseJob:
 
 
     def process_tweets_notify_hydrating(self):
-        if not (self.current_table is None):
-            self.timer.toc('tweet', self.current_table.num_rows)
+        if not self.buffer.is_empty():
+            self.timer.toc('tweet', self.buffer.num_rows)
         self.timer.tic('tweet', 40, 40)
 
         self.timer.tic('hydrate', 40, 40)
@@ -534,14 +891,18 @@ class FirehoseJob:
 
         self.timer.toc('hydrate')
 
-        self.timer.tic('overall_compute', 40, 40)
+        self.check_flushes()
 
-        raw_df = self.tweets_to_df(tweets)
-        df = self.clean_df(raw_df)
+        self.timer.tic('overall_compute', 40, 40)
 
         table = None
         try:
-            table = self.df_with_schema_to_arrow(df, self.schema)
+            if self.arrow_native:
+                table = pa.Table.from_batches([self.tweets_to_arrow(tweets)])
+            else:
+                raw_df = self.tweets_to_df(tweets)
+                df = self.clean_df(raw_df)
+                table = self.df_with_schema_to_arrow(df, self.schema)
         except Exception as e:
             #logger.error('conversion failed, skipping batch...')
             self.timer.toc('overall_compute')
@@ -549,23 +910,13 @@ class FirehoseJob:
 
         self.last_arr = table
 
-        if self.current_table is None:
-            self.current_table = table
-        else:
-            self.current_table = self.concat_tables(self.current_table, table)
+        self.buffer.append(table)
 
-        out = self.current_table #or just table (without intermediate concats since last flush?)
+        out = table #just this batch: combining everything buffered per call is quadratic
 
-        if not (self.current_table is None) \
-            and ((self.current_table.num_rows > self.TWEETS_PER_ROWGROUP) or self.needs_to_flush) \
-            and self.current_table.num_rows > 0:
+        if (self.needs_flush() or self.needs_to_flush) and not self.buffer.is_empty():
             self.flush(job_name)
             self.needs_to_flush = False
-        else:
-            1
-            #print('skipping, has table ? %s, num rows %s' % (
-            #    not (self.current_table is None),
-            #    0 if self.current_table is None else self.current_table.num_rows))
 
         self.timer.toc('overall_compute')
 
@@ -616,42 +967,105 @@ class FirehoseJob:
 
     ################################################################################
 
-    def process_ids(self, ids_to_process, job_name=None):
+    #known_ids: optional list, extended with the ids skipped as already hydrated (cache hit or Neo4j FULL)
+    def missing_ids(self, ids_to_process_batch, known_ids=None):
+        unknown_ids = ids_to_process_batch
+        if not (self.hydrated_cache is None):
+            known = self.hydrated_cache.contains(ids_to_process_batch)
+            unknown_ids = [id for id, k in zip(ids_to_process_batch, known) if not k]
+            if not (known_ids is None):
+                known_ids.extend(id for id, k in zip(ids_to_process_batch, known) if k)
+        if len(unknown_ids) == 0:
+            missing_ids = []
+        else:
+            hydration_statuses_df = self.neo4j_data_access()\
+                .get_tweet_hydrated_status_by_id(pd.DataFrame({'id': unknown_ids}))
+            is_full = hydration_statuses_df['hydrated'] == 'FULL'
+            missing_ids = hydration_statuses_df[ ~is_full ]['id'].tolist()
+            if not (self.hydrated_cache is None):
+                self.hydrated_cache.add(hydration_statuses_df[ is_full ]['id'].to_numpy())
+            if not (known_ids is None):
+                known_ids.extend(hydration_statuses_df[ is_full ]['id'].tolist())
+
+        logger.debug('Skipping cached %s, fetching %s, of requested %s' % (
+            len(ids_to_process_batch) - len(missing_ids),
+            len(missing_ids),
+            len(ids_to_process_batch)))
+
+        return missing_ids
+
+    #Runs on a worker thread: holds one pooled client for the whole batch
+    def hydrate_batch(self, ids_to_process_batch, known_ids=None):
+        missing_ids = self.missing_ids(ids_to_process_batch, known_ids)
+        if len(missing_ids) == 0:
+            return []
+        idx, twarc = self.twarc_pool.acquire('statuses/lookup')
+        try:
+            return list(twarc.hydrate(missing_ids))
+        finally:
+            self.twarc_pool.release(idx)
+
+    #Hydrate BATCH_LEN batches concurrently, one per pooled client, yielding tweets in input order
+    def hydrate_parallel(self, ids_to_process, known_ids=None):
+        n_clients = len(self.twarc_pool.pool)
+        offsets = iter(range(0, len(ids_to_process), self.BATCH_LEN))
+        with ThreadPoolExecutor(max_workers=n_clients, thread_name_prefix='hydrate') as executor:
+
+            def submit_next():
+                i = next(offsets, None)
+                if i is None:
+                    return None
+                logger.info('Starting batch offset %s ( + %s) of %s', i, self.BATCH_LEN, len(ids_to_process))
+                return executor.submit(self.hydrate_batch, ids_to_process[i : (i + self.BATCH_LEN)], known_ids)
+
+            #keep every client busy plus one batch queued each
+            in_flight = deque([f for f in [submit_next() for k in range(2 * n_clients)] if not (f is None)])
+            while len(in_flight) > 0:
+                tweets = in_flight.popleft().result()
+                f = submit_next()
+                if not (f is None):
+                    in_flight.append(f)
+                for tweet in tweets:
+                    yield tweet
+
+    #known_ids: see missing_ids
+    def process_ids(self, ids_to_process, job_name=None, known_ids=None):
 
         self.process_tweets_notify_hydrating()
 
         if job_name is None:
             job_name = "process_ids_%s" % (ids_to_process[0] if len(ids_to_process) > 0 else "none")
 
+        if self.parallel_hydrate and len(self.twarc_pool.pool) > 1:
+            for arr in self.process_tweets_generator(self.hydrate_parallel(ids_to_process, known_ids), job_name):
+                yield arr
+            return
+
         for i in range(0, len(ids_to_process), self.BATCH_LEN):
             ids_to_process_batch = ids_to_process[i : (i + self.BATCH_LEN)]
 
             logger.info('Starting batch offset %s ( + %s) of %s', i, self.BATCH_LEN, len(ids_to_process))
 
-            hydration_statuses_df = Neo4jDataAccess(self.debug, self.neo4j_creds)\
-                .get_tweet_hydrated_status_by_id(pd.DataFrame({'id': ids_to_process_batch}))
-            missing_ids = hydration_statuses_df[ hydration_statuses_df['hydrated'] != 'FULL' ]['id'].tolist()
+            missing_ids = self.missing_ids(ids_to_process_batch, known_ids)
 
-            logger.debug('Skipping cached %s, fetching %s, of requested %s' % (
-                len(ids_to_process_batch) - len(missing_ids),
-                len(missing_ids),
-                len(ids_to_process_batch)))
-
-            tweets = ( tweet for tweet in self.twarc_pool.next_twarc().hydrate(missing_ids) )
+            tweets = ( tweet for tweet in self.twarc_pool.next_twarc('statuses/lookup').hydrate(missing_ids) )
 
             for arr in self.process_tweets_generator(tweets, job_name):
                 yield arr
 
-    def process_id_file(self, path, job_name=None):
-
-        pdf = None
-        lst = None
+    #one tweet id per line, header-less
+    @staticmethod
+    def read_id_file(path):
         try:
             pdf = cudf.read_csv(path, header=None).to_pandas()
-            lst = pdf['0'].to_list()
+            return pdf['0'].to_list()
         except:
             pdf = pd.read_csv(path, header=None)
-            lst = pdf[0].to_list()
+            return pdf[0].to_list()
+
+    def process_id_file(self, path, job_name=None):
+
+        lst = self.read_id_file(path)
 
         if job_name is None:
             job_name = "id_file_%s" % path
@@ -668,7 +1082,7 @@ class FirehoseJob:
         if job_name is None:
             job_name = "search_%s" % input[:20]
 
-        tweets = (tweet for tweet in self.twarc_pool.next_twarc().search(input))
+        tweets = (tweet for tweet in self.twarc_pool.next_twarc('search/tweets').search(input))
 
         self.process_tweets_generator(tweets, job_name)
 
@@ -680,7 +1094,7 @@ class FirehoseJob:
         if job_name is None:
             job_name = "search_stream_by_keyword_%s" % input[:20]
 
-        tweets = [tweet for tweet in self.twarc_pool.next_twarc().filter(track=input)]
+        tweets = [tweet for tweet in self.twarc_pool.next_twarc('statuses/filter').filter(track=input)]
 
         self.process_tweets(tweets, job_name)
 
@@ -692,7 +1106,7 @@ class FirehoseJob:
         if job_name is None:
             job_name = "search_by_location_%s" % input[:20]
 
-        tweets = [tweet for tweet in self.twarc_pool.next_twarc().filter(locations=input)]
+        tweets = [tweet for tweet in self.twarc_pool.next_twarc('statuses/filter').filter(locations=input)]
 
         self.process_tweets(tweets, job_name)
 
@@ -710,7 +1124,7 @@ class FirehoseJob:
             for user in input:
                 logger.debug('starting user %s' % user)
                 tweet_count = 0
-                for tweet in self.twarc_pool.next_twarc().timeline(screen_name=user, **kwargs):
+                for tweet in self.twarc_pool.next_twarc('statuses/user_timeline').timeline(screen_name=user, **kwargs):
                     #logger.debug('got user', user, 'tweet', str(tweet)[:50])
                     self.process_tweets([tweet], job_name)
                     tweet_count = tweet_count + 1
@@ -725,19 +1139,76 @@ class FirehoseJob:
             logger.debug('Safely exited!')
 
 
-    def ingest_range(self, begin, end, job_name=None):  # This method is where the magic happens
+    # Hydrate every candidate id for ms in [begin, end) x MACHINE_IDS x sequence_ids,
+    # handing process_ids IDS_PER_CHUNK ids at a time and yielding its arrow tables
+    # checkpoint_path: once the flush holding a chunk's rows is written (flushes still follow the
+    #   buffer limits), record the chunk there; a later call with the same path, job and range
+    #   resumes after the last recorded chunk. The end of the range is flushed before returning
+    # sampler: a SnowflakeSampler choosing the (machine_id, sequence_id) pairs per chunk instead,
+    #   fed each chunk's hits: hydrated ids plus those skipped as already known (real tweets too);
+    #   with checkpoint_path, its state is checkpointed too and restored on resume
+    def ingest_range(self, begin, end, job_name=None, sequence_ids=(0,), ids_per_chunk=None, checkpoint_path=None, sampler=None):  # This method is where the magic happens
 
         if job_name is None:
             job_name = "ingest_range_%s_to_%s" % (begin, end)
+        ids_per_chunk = FirehoseJob.IDS_PER_CHUNK if ids_per_chunk is None else ids_per_chunk
 
-        for epoch in range(begin, end):  # Move through each millisecond
-            time_component = (epoch - FirehoseJob.SNOWFLAKE_EPOCH) << 22
-            for machine_id in FirehoseJob.MACHINE_IDS:  # Iterate over machine ids
-                for sequence_id in [0]:  # Add more sequence ids as needed
-                    twitter_id = time_component + (machine_id << 12) + sequence_id
-                    self.queue.append(twitter_id)
-                    if len(self.queue) >= self.TWEETS_PER_PROCESS:
-                        ids_to_process = []
-                        for i in range(0, self.TWEETS_PER_PROCESS):
-                            ids_to_process.append(self.queue.popleft())
-                        self.process_ids(ids_to_process, job_name)
+        checkpoint = None
+        if not (checkpoint_path is None):
+            checkpoint = IngestCheckpoint(checkpoint_path, job_name, begin, end, sequence_ids, sampled=not (sampler is None))
+            if checkpoint.is_complete():
+                logger.info('Checkpoint %s: range already ingested', checkpoint_path)
+                return
+            begin = checkpoint.next_ms
+            if not (sampler is None) and not (checkpoint.sampler_state() is None):
+                sampler.set_state(checkpoint.sampler_state())
+
+        if sampler is None:
+            blocks = Snowflake.id_blocks(begin, end, FirehoseJob.MACHINE_IDS, sequence_ids, ids_per_chunk)
+        else:
+            blocks = sampler.id_blocks(begin, end, ids_per_chunk)
+
+        #finished blocks not yet checkpointed, as (flush count that must be written first, block)
+        unflushed = deque()
+        written_before = self.written_flush_count()
+        for ids in blocks:
+            tweets = 0
+            hit_ids = []
+            known_ids = None if sampler is None else []
+            for arr in self.process_ids(ids.tolist(), job_name, known_ids):
+                tweets += 0 if arr is None else arr.num_rows
+                if not (sampler is None) and not (arr is None):
+                    hit_ids.append(arr.column('id').to_numpy())
+                yield arr
+            if not (sampler is None):
+                hit_ids.append(np.asarray(known_ids, dtype=np.int64))
+                sampler.record(ids, np.concatenate(hit_ids))
+            if not (checkpoint is None):
+                #the block's rows are in flushes started so far, or still buffered for the next one
+                last_id = int(ids[-1])
+                unflushed.append((self.flush_count + (0 if self.buffer.is_empty() else 1), {
+                    'next_ms': int(self.get_creation_time(last_id)) + 1,
+                    'last_id': last_id,
+                    'epoch_ms': int(self.get_creation_time(last_id)),
+                    'machine_id': int(self.machine_id(last_id)),
+                    'sequence_id': int(self.sequence_id(last_id)),
+                    'ids': len(ids),
+                    'tweets': tweets,
+                    'sampler_state': None if sampler is None else sampler.state()
+                }))
+                written_before = self.__advance_checkpoint(checkpoint, unflushed, written_before)
+        if not (checkpoint is None):
+            #end of range: write out the rows the buffer limits have not flushed yet
+            self.flush(job_name)
+            self.wait_for_flushes()
+            self.__advance_checkpoint(checkpoint, unflushed, written_before)
+
+    # Checkpoints the leading unflushed blocks whose rows are written, so flushes keep following
+    # the buffer limits instead of one per block; returns the written flush count last advanced at
+    def __advance_checkpoint(self, checkpoint, unflushed, written_before):
+        written = self.written_flush_count()
+        while len(unflushed) > 0 and unflushed[0][0] <= written:
+            needed_flushes, block = unflushed.popleft()
+            checkpoint.advance(flushes=written - written_before, **block)
+            written_before = written
+        return written_before
@@ -0,0 +1,82 @@
+import queue
+import threading
+
+import logging
+logger = logging.getLogger('FlushPipeline')
+
+
+# Fans each submitted item out to named stages, each drained by its own worker thread
+# through a bounded queue:
+#  - backpressure: submit() blocks while a stage is max_queue_size items behind
+#  - errors: the first stage failure is re-raised by the next submit()/check()/close(),
+#    later items are drained without running so producers never deadlock
+#  - wait() blocks until every queued item has finished, close() also stops the workers
+#  - completed() counts the leading items every stage has finished (stages run items in order)
+class FlushPipeline:
+
+    __STOP = object()
+
+    def __init__(self, stages, max_queue_size=2, name='flush'):
+        self.name = name
+        self.errors = []
+        self.__lock = threading.Lock()
+        self.queues = {}
+        self.threads = {}
+        self.done = {}
+        for stage_name, fn in stages:
+            q = queue.Queue(maxsize=max_queue_size)
+            t = threading.Thread(
+                target=self.__run, args=(stage_name, fn, q),
+                name='%s-%s' % (name, stage_name), daemon=True)
+            self.queues[stage_name] = q
+            self.done[stage_name] = 0
+            self.threads[stage_name] = t
+            t.start()
+
+    def __run(self, stage_name, fn, q):
+        while True:
+            item = q.get()
+            try:
+                if item is FlushPipeline.__STOP:
+                    return
+                if len(self.errors) > 0:
+                    logger.debug('%s: skipping item after earlier failure', stage_name)
+                    continue
+                fn(*item)
+                self.done[stage_name] += 1
+            except Exception as e:
+                logger.error('%s stage %s failed', self.name, stage_name)
+                logger.error(e)
+                with self.__lock:
+                    self.errors.append((stage_name, e))
+            finally:
+                q.task_done()
+
+    def check(self):
+        with self.__lock:
+            if len(self.errors) > 0:
+                stage_name, e = self.errors[0]
+                raise e
+
+    def completed(self):
+        return min(self.done.values()) if len(self.done) > 0 else 0
+
+    def pending(self):
+        return {stage_name: q.qsize() for stage_name, q in self.queues.items()}
+
+    def submit(self, *item):
+        self.check()
+        for q in self.queues.values():
+            q.put(item)
+
+    def wait(self):
+        for q in self.queues.values():
+            q.join()
+        self.check()
+
+    def close(self):
+        for q in self.queues.values():
+            q.put(FlushPipeline.__STOP)
+        for t in self.threads.values():
+            t.join()
+        self.check()
@@ -0,0 +1,89 @@
+import os
+import threading
+import numpy as np
+
+import logging
+logger = logging.getLogger('HydratedIdCache')
+
+
+# Persistent set of tweet ids already hydrated, answered locally before asking Neo4j
+#  <path>      sorted unique int64 .npy, memory-mapped read-only
+#  <path>.log  raw int64 ids appended on every add() since the last compaction
+# Once the log holds COMPACT_EVERY ids it is merged into <path> (tmp file + os.replace)
+class HydratedIdCache:
+
+    COMPACT_EVERY = 1000000
+
+    def __init__(self, path, compact_every=None):
+        self.path = path
+        self.log_path = path + '.log'
+        self.compact_every = HydratedIdCache.COMPACT_EVERY if compact_every is None else compact_every
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self.__base = self.__load_base()
+        self.__recent = self.__load_log()
+        logger.debug('Loaded %s hydrated ids (+ %s recent) from %s', len(self.__base), len(self.__recent), path)
+
+    def __load_base(self):
+        if os.path.exists(self.path):
+            return np.load(self.path, mmap_mode='r')
+        return np.array([], dtype=np.int64)
+
+    def __load_log(self):
+        if os.path.exists(self.log_path):
+            return np.unique(np.fromfile(self.log_path, dtype=np.int64))
+        return np.array([], dtype=np.int64)
+
+    @staticmethod
+    def __in_sorted(sorted_ids, ids):
+        if len(sorted_ids) == 0:
+            return np.zeros(len(ids), dtype=bool)
+        pos = np.searchsorted(sorted_ids, ids)
+        pos[pos == len(sorted_ids)] = 0
+        return sorted_ids[pos] == ids
+
+    def __len__(self):
+        return len(self.__base) + len(np.setdiff1d(self.__recent, self.__base, assume_unique=True))
+
+    #bool mask: which ids are known hydrated
+    def contains(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        with self.lock:
+            mask = self.__in_sorted(self.__base, ids) | self.__in_sorted(self.__recent, ids)
+            hits = int(mask.sum())
+            self.hits += hits
+            self.misses += len(ids) - hits
+        return mask
+
+    def add(self, ids):
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        if len(ids) == 0:
+            return
+        with self.lock:
+            new_ids = ids[~(self.__in_sorted(self.__base, ids) | self.__in_sorted(self.__recent, ids))]
+            if len(new_ids) == 0:
+                return
+            with open(self.log_path, 'ab') as f:
+                new_ids.tofile(f)
+            self.__recent = np.union1d(self.__recent, new_ids)
+            if len(self.__recent) >= self.compact_every:
+                self.__compact()
+
+    def compact(self):
+        with self.lock:
+            self.__compact()
+
+    def __compact(self):
+        if len(self.__recent) == 0:
+            return
+        merged = np.union1d(self.__base, self.__recent)
+        tmp_path = self.path + '.tmp.npy'
+        np.save(tmp_path, merged)
+        os.replace(tmp_path, self.path)
+        os.remove(self.log_path)
+        logger.debug('Compacted hydrated id cache to %s ids', len(merged))
+        self.__base = self.__load_base()
+        self.__recent = np.array([], dtype=np.int64)
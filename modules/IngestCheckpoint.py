@@ -0,0 +1,102 @@
+import datetime, json, os
+import numpy as np
+
+import logging
+logger = logging.getLogger('IngestCheckpoint')
+
+
+# Progress of one FirehoseJob.ingest_range scan, kept in a local JSON file so a crashed or
+# retried run resumes after the last id block whose tweets were flushed:
+#   next_ms        first millisecond not yet fully processed
+#   last_id        last candidate id processed, and its epoch_ms / machine_id / sequence_id
+#   blocks, ids, tweets, flushes   running totals across runs
+# Written via tmp file + os.replace, so a crash mid-write keeps the previous checkpoint.
+# A file for a different job/range/sequence_ids is an error, not silently reused.
+# sampled: the scan's ids come from a SnowflakeSampler (sequence_ids unused), whose state is
+# kept at <path>.sampler.npz as of the last recorded block, so a resumed scan keeps its priors
+class IngestCheckpoint:
+
+    RANGE_KEYS = ['job_name', 'begin', 'end', 'sequence_ids', 'sampled']
+
+    def __init__(self, path, job_name, begin, end, sequence_ids=(0,), sampled=False):
+        self.path = path
+        self.sampler_path = path + '.sampler.npz'
+        self.state = {
+            'job_name': job_name,
+            'begin': begin,
+            'end': end,
+            'sequence_ids': None if sampled else list(sequence_ids),
+            'sampled': sampled,
+            'next_ms': begin,
+            'last_id': None,
+            'last_epoch_ms': None,
+            'last_machine_id': None,
+            'last_sequence_id': None,
+            'blocks': 0,
+            'ids': 0,
+            'tweets': 0,
+            'flushes': 0,
+            'updated_at': None
+        }
+        if os.path.exists(path):
+            self.__load()
+
+    def __load(self):
+        with open(self.path) as f:
+            saved = json.load(f)
+        #files from before sampled scans were keyed are unsampled
+        saved.setdefault('sampled', False)
+        mismatched = [k for k in IngestCheckpoint.RANGE_KEYS if saved.get(k) != self.state[k]]
+        if len(mismatched) > 0:
+            raise ValueError('Checkpoint %s is for a different scan (%s: %s, expected %s)' % (
+                self.path, mismatched, [saved.get(k) for k in mismatched], [self.state[k] for k in mismatched]))
+        self.state.update(saved)
+        logger.info('Resuming %s from %s (%s ids, %s tweets so far)',
+            self.state['job_name'], self.state['next_ms'], self.state['ids'], self.state['tweets'])
+
+    @property
+    def next_ms(self):
+        return self.state['next_ms']
+
+    def is_complete(self):
+        return self.state['next_ms'] >= self.state['end']
+
+    def save(self):
+        self.state['updated_at'] = datetime.datetime.utcnow().isoformat()
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    # SnowflakeSampler.state() as of the last recorded block, or None
+    def sampler_state(self):
+        if not os.path.exists(self.sampler_path):
+            return None
+        with np.load(self.sampler_path) as data:
+            return {k: data[k] for k in data.files}
+
+    def save_sampler_state(self, sampler_state):
+        tmp_path = self.sampler_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **sampler_state)
+        os.replace(tmp_path, self.sampler_path)
+
+    # Record a fully processed (and flushed) block of ids ending at the millisecond next_ms - 1,
+    # and for a sampled scan the sampler state right after the block
+    def advance(self, next_ms, last_id, epoch_ms, machine_id, sequence_id, ids, tweets, flushes, sampler_state=None):
+        if not (sampler_state is None):
+            self.save_sampler_state(sampler_state)
+        self.state.update({
+            'next_ms': next_ms,
+            'last_id': last_id,
+            'last_epoch_ms': epoch_ms,
+            'last_machine_id': machine_id,
+            'last_sequence_id': sequence_id,
+            'blocks': self.state['blocks'] + 1,
+            'ids': self.state['ids'] + ids,
+            'tweets': self.state['tweets'] + tweets,
+            'flushes': self.state['flushes'] + flushes
+        })
+        self.save()
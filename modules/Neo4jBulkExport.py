@@ -0,0 +1,300 @@
+import argparse, os, posixpath, sys, time
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+
+from .DfHelper import DfHelper
+from .Neo4jDataAccess import Neo4jDataAccess
+from .StatusCache import StatusCache
+
+import logging
+logger = logging.getLogger('Neo4jBulkExport')
+
+
+# Writes tweets as neo4j-admin import CSVs, to bootstrap an empty graph from parquet
+# instead of pushing every row through Neo4jDataAccess's UNWIND ... MERGE transactions:
+#  <out_dir>/<group>_header.csv, <group>_part-NNNNN.csv  per node label (Tweet, Account, Url) and
+#      relationship type (TWEETED, REPLYED, QUOTED, RETWEETED, MENTIONED, INCLUDES), with the
+#      properties the Cypher path sets (params come from Neo4jDataAccess.build_param_frames)
+#  <out_dir>/import.sh  the matching neo4j-admin import, run inside the infra/neo4j/docker container,
+#      which sees <out_dir> as import_dir (host /datadrive/neo4j/import is mounted at /import)
+# Nodes are deduped across batches: the first full copy of a tweet or account wins, and
+# close() adds PARTIAL stubs for replied/quoted/retweeted tweets and mention-only accounts
+# never seen in full. Relationships are only written for newly seen tweets, so never repeat.
+# Url nodes get sequential integer ids (not stored) so every group fits --id-type=INTEGER.
+class Neo4jBulkExport:
+
+    NODE_HEADERS = {
+        'Tweet': [
+            ('id', 'id:ID(Tweet)'), ('text', 'text'), ('created_at', 'created_at:datetime'),
+            ('favorite_count', 'favorite_count:long'), ('retweet_count', 'retweet_count:long'),
+            ('record_created_at', 'record_created_at:long'), ('job_name', 'job_name'), ('job_id', 'job_id'),
+            ('hashtags', 'hashtags'), ('hydrated', 'hydrated'), ('type', 'type')],
+        'Account': [
+            ('id', 'id:ID(Account)'), ('name', 'name'), ('screen_name', 'screen_name'),
+            ('followers_count', 'followers_count:long'), ('friends_count', 'friends_count:long'),
+            ('location', 'location'), ('user_profile_image_url', 'user_profile_image_url'),
+            ('created_at', 'created_at:localdatetime'),
+            ('mentioned_name', 'mentioned_name'), ('mentioned_screen_name', 'mentioned_screen_name'),
+            ('record_created_at', 'record_created_at:long'), ('job_name', 'job_name'), ('job_id', 'job_id')],
+        'Url': [
+            ('id', ':ID(Url)'), ('full_url', 'full_url'), ('schema', 'schema'), ('netloc', 'netloc'),
+            ('path', 'path'), ('params', 'params'), ('query', 'query'), ('fragment', 'fragment'),
+            ('username', 'username'), ('password', 'password'), ('hostname', 'hostname'), ('port', 'port:long'),
+            ('record_created_at', 'record_created_at:long'), ('job_name', 'job_name'), ('job_id', 'job_id')]
+    }
+
+    REL_TYPES = {
+        'TWEETED': ('Account', 'Tweet'),
+        'REPLYED': ('Tweet', 'Tweet'),
+        'QUOTED': ('Tweet', 'Tweet'),
+        'RETWEETED': ('Tweet', 'Tweet'),
+        'MENTIONED': ('Tweet', 'Account'),
+        'INCLUDES': ('Tweet', 'Url')
+    }
+
+    #docker-compose names the infra/neo4j/docker service container <dir>_<service>_1
+    CONTAINER = 'docker_neo4j_1'
+
+    def __init__(self, out_dir, import_dir=None, database='neo4j', container=None, data_access=None):
+        self.out_dir = out_dir
+        self.import_dir = posixpath.join('/import', os.path.basename(os.path.abspath(out_dir))) \
+            if import_dir is None else import_dir
+        self.database = database
+        self.container = Neo4jBulkExport.CONTAINER if container is None else container
+        self.data_access = Neo4jDataAccess() if data_access is None else data_access
+        self.record_created_at = int(time.time() * 1000)
+        self.status_cache = StatusCache()
+        os.makedirs(out_dir, exist_ok=True)
+
+        self.files = defaultdict(list)
+        self.counts = defaultdict(int)
+        self.part = 0
+        self.tweet_ids = np.array([], dtype=np.int64)
+        self.account_ids = np.array([], dtype=np.int64)
+        self.url_ids = {}
+        self.stub_tweets = []
+        self.stub_accounts = []
+        self.closed = False
+
+    ###################
+
+    #Nullable Int64 ids, <= 0 as null; python-int object columns keep all 64 bits.
+    #A float column has already rounded ids above 2^53, so it raises instead of being cast
+    @staticmethod
+    def to_ids(series):
+        series = pd.Series(series)
+        if pd.api.types.is_float_dtype(series) and series.notnull().any():
+            raise TypeError('Float id column %s: keep ids int64 / Int64 upstream' % series.name)
+        ids = series.astype('Int64')
+        return ids.where(ids > 0).reset_index(drop=True)
+
+    #Nullable Int64 counts (0 kept)
+    @staticmethod
+    def to_counts(series):
+        return pd.to_numeric(pd.Series(series), errors='coerce').round().astype('Int64').reset_index(drop=True)
+
+    @staticmethod
+    def to_iso(series, zoned):
+        dts = pd.to_datetime(pd.Series(series), utc=zoned)
+        return dts.dt.strftime('%Y-%m-%dT%H:%M:%SZ' if zoned else '%Y-%m-%dT%H:%M:%S')
+
+    #mask of ids neither null, repeated earlier in ids, nor in the sorted seen array; returns (mask, new seen)
+    @staticmethod
+    def first_new(ids, seen):
+        values = ids.fillna(0).to_numpy(dtype=np.int64)
+        mask = ids.notnull().to_numpy() & ~pd.Series(values).duplicated().to_numpy()
+        if len(seen) > 0:
+            pos = np.minimum(np.searchsorted(seen, values), len(seen) - 1)
+            mask &= seen[pos] != values
+        return mask, np.union1d(seen, values[mask])
+
+    def __write(self, group, df, cols):
+        if len(df) == 0:
+            return
+        name = '%s_part-%05d.csv' % (group, self.part)
+        df[cols].to_csv(os.path.join(self.out_dir, name), header=False, index=False)
+        self.files[group].append(name)
+        self.counts[group] += len(df)
+
+    def __write_nodes(self, label, df):
+        self.__write(label, df.reindex(columns=[c for c, h in Neo4jBulkExport.NODE_HEADERS[label]]),
+            [c for c, h in Neo4jBulkExport.NODE_HEADERS[label]])
+
+    def __write_rels(self, rel_type, start, end):
+        rels = pd.DataFrame({'start': start.reset_index(drop=True), 'end': end.reset_index(drop=True)})
+        rels = rels[rels['start'].notnull() & rels['end'].notnull()].drop_duplicates()
+        self.__write(rel_type, rels, ['start', 'end'])
+
+    ###################
+
+    # Raw tweet parquet rows (as written by FirehoseJob, any schema version)
+    def add_table(self, table, job_name, job_id=None):
+        self.add_df(DfHelper.table_to_pandas(table), job_name, job_id)
+
+    def add_df(self, df, job_name, job_id=None):
+        if len(df) == 0:
+            return
+        self.add_normalized_df(DfHelper(self.status_cache).normalize_parquet_dataframe(df), job_name, job_id)
+
+    # DfHelper.normalize_parquet_dataframe output
+    def add_normalized_df(self, pdf, job_name, job_id=None):
+        tweets_df, mentions_df, urls_df = self.data_access.build_param_frames(pdf, job_name, job_id)
+        tweet_ids = self.to_ids(tweets_df['tweet_id'])
+        is_new, self.tweet_ids = self.first_new(tweet_ids, self.tweet_ids)
+        tweets = tweets_df[is_new].reset_index(drop=True)
+        new_ids = tweet_ids[is_new].reset_index(drop=True)
+
+        self.__write_nodes('Tweet', pd.DataFrame({
+            'id': new_ids,
+            'text': tweets['text'],
+            'created_at': self.to_iso(tweets['tweet_created_at'], True),
+            'favorite_count': self.to_counts(tweets['favorite_count']),
+            'retweet_count': self.to_counts(tweets['retweet_count']),
+            'record_created_at': self.record_created_at,
+            'job_name': tweets['job_name'],
+            'job_id': tweets['job_id'],
+            'hashtags': tweets['hashtags'],
+            'hydrated': 'FULL',
+            'type': tweets['tweet_type']
+        }))
+
+        user_ids = self.to_ids(tweets_df['user_id'])
+        is_new_user, self.account_ids = self.first_new(user_ids, self.account_ids)
+        users = tweets_df[is_new_user].reset_index(drop=True)
+        self.__write_nodes('Account', pd.DataFrame({
+            'id': user_ids[is_new_user].reset_index(drop=True),
+            'name': users['user_name'],
+            'screen_name': users['user_screen_name'],
+            'followers_count': self.to_counts(users['user_followers_count']),
+            'friends_count': self.to_counts(users['user_friends_count']),
+            'location': users['user_location'],
+            'user_profile_image_url': users['user_profile_image_url'],
+            'created_at': self.to_iso(users['user_created_at'], False),
+            'record_created_at': self.record_created_at,
+            'job_name': users['job_name'],
+            'job_id': users['job_id']
+        }))
+
+        self.__write_rels('TWEETED', self.to_ids(tweets['user_id']), new_ids)
+        for tweet_type, (rel_type, col) in Neo4jDataAccess.TYPE_RELS.items():
+            of_type = (tweets['tweet_type'] == tweet_type).to_numpy()
+            targets = self.to_ids(tweets[col])[of_type]
+            self.__write_rels(rel_type, new_ids[of_type], targets)
+            self.stub_tweets.append(pd.DataFrame({
+                'id': targets, 'job_name': tweets['job_name'][of_type], 'job_id': tweets['job_id'][of_type]
+            }).dropna(subset=['id']))
+
+        mentions = mentions_df[self.to_ids(mentions_df['tweet_id']).isin(new_ids).to_numpy(dtype=bool)].reset_index(drop=True)
+        mentioned_ids = self.to_ids(mentions['user_id'])
+        self.__write_rels('MENTIONED', self.to_ids(mentions['tweet_id']), mentioned_ids)
+        self.stub_accounts.append(pd.DataFrame({
+            'id': mentioned_ids,
+            'mentioned_name': mentions['user_name'],
+            'mentioned_screen_name': mentions['user_screen_name'],
+            'job_name': mentions['job_name'],
+            'job_id': mentions['job_id']
+        }).dropna(subset=['id']).drop_duplicates('id'))
+
+        urls = urls_df[self.to_ids(urls_df['tweet_id']).isin(new_ids).to_numpy(dtype=bool)].reset_index(drop=True)
+        new_urls = urls[~urls['url'].isin(self.url_ids)].drop_duplicates('url')
+        first_url_id = len(self.url_ids) + 1
+        self.url_ids.update(zip(new_urls['url'], range(first_url_id, first_url_id + len(new_urls))))
+        self.__write_nodes('Url', new_urls.assign(
+            id=range(first_url_id, first_url_id + len(new_urls)),
+            full_url=new_urls['url'],
+            port=self.to_counts(new_urls['port']).to_numpy(),
+            record_created_at=self.record_created_at))
+        self.__write_rels('INCLUDES', self.to_ids(urls['tweet_id']), urls['url'].map(self.url_ids).astype('Int64'))
+
+        self.part += 1
+        logger.debug('Exported batch %s: %s rows, %s new tweets', self.part, len(pdf), len(new_ids))
+
+    # Streams parquet files (or every *.parquet under folders) batch_rows at a time
+    def add_parquet(self, paths, job_name, job_id=None, batch_rows=100000, input_profile=None):
+        for pdf in DfHelper(self.status_cache).iter_normalized_parquet(paths, batch_rows, input_profile=input_profile):
+            self.add_normalized_df(pdf, job_name, job_id)
+
+    ###################
+
+    # Writes PARTIAL stubs, headers and import.sh; returns the import command
+    def close(self):
+        if self.closed:
+            return self.import_command()
+
+        if len(self.stub_tweets) > 0:
+            stubs = pd.concat(self.stub_tweets, ignore_index=True)
+            stub_ids = stubs['id'].astype('Int64')
+            is_new, self.tweet_ids = self.first_new(stub_ids, self.tweet_ids)
+            self.__write_nodes('Tweet', stubs[is_new].assign(
+                record_created_at=self.record_created_at, hydrated='PARTIAL'))
+        if len(self.stub_accounts) > 0:
+            stubs = pd.concat(self.stub_accounts, ignore_index=True)
+            stub_ids = stubs['id'].astype('Int64')
+            is_new, self.account_ids = self.first_new(stub_ids, self.account_ids)
+            self.__write_nodes('Account', stubs[is_new].assign(record_created_at=self.record_created_at))
+        self.stub_tweets = []
+        self.stub_accounts = []
+
+        for label, header in Neo4jBulkExport.NODE_HEADERS.items():
+            self.__write_header(label, [h for c, h in header])
+        for rel_type, (start, end) in Neo4jBulkExport.REL_TYPES.items():
+            self.__write_header(rel_type, [':START_ID(%s)' % start, ':END_ID(%s)' % end])
+
+        command = self.import_command()
+        script_path = os.path.join(self.out_dir, 'import.sh')
+        with open(script_path, 'w') as f:
+            f.write('#!/bin/sh\n')
+            f.write('# Database %s must be empty and stopped; afterwards start it and apply\n' % self.database)
+            f.write('# infra/neo4j/scripts/neo4j-indexes.cypher (neo4j-admin import creates no indexes)\n')
+            f.write(command + '\n')
+        os.chmod(script_path, 0o755)
+        self.closed = True
+        logger.info('Exported %s to %s, import with %s (status cache: %s)',
+            dict(self.counts), self.out_dir, script_path, self.status_cache.stats())
+        return command
+
+    def __write_header(self, group, header):
+        with open(os.path.join(self.out_dir, '%s_header.csv' % group), 'w') as f:
+            f.write(','.join(header) + '\n')
+
+    def import_command(self):
+        def group_files(group):
+            return ','.join(posixpath.join(self.import_dir, n) for n in ['%s_header.csv' % group] + self.files[group])
+        args = [
+            'docker exec %s neo4j-admin import' % self.container,
+            '--database=%s' % self.database,
+            '--id-type=INTEGER',
+            '--skip-duplicate-nodes=true',
+            '--multiline-fields=true'
+        ]
+        args += ['--nodes=%s=%s' % (label, group_files(label))
+            for label in Neo4jBulkExport.NODE_HEADERS if len(self.files[label]) > 0]
+        args += ['--relationships=%s=%s' % (rel_type, group_files(rel_type))
+            for rel_type in Neo4jBulkExport.REL_TYPES if len(self.files[rel_type]) > 0]
+        return ' \\\n    '.join(args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export tweet parquet files as neo4j-admin import CSVs plus the matching import command')
+    parser.add_argument('out_dir', help='output folder, e.g. under /datadrive/neo4j/import (mounted at /import)')
+    parser.add_argument('paths', nargs='+', help='parquet files or folders of them (e.g. firehose_data/<job>)')
+    parser.add_argument('--job-name', required=True)
+    parser.add_argument('--job-id', default=None)
+    parser.add_argument('--batch-rows', type=int, default=100000)
+    parser.add_argument('--import-dir', default=None, help='out_dir as seen by the container (default /import/<out_dir name>)')
+    parser.add_argument('--database', default='neo4j')
+    parser.add_argument('--container', default=Neo4jBulkExport.CONTAINER)
+    parser.add_argument('--input-profile', default=None,
+        help='read only the <profile>2.parquet copy of each flush (default: one copy, by WRITER_PROFILES order)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    export = Neo4jBulkExport(args.out_dir, import_dir=args.import_dir, database=args.database, container=args.container)
+    export.add_parquet(args.paths, args.job_name, args.job_id, args.batch_rows, args.input_profile)
+    print(export.close())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
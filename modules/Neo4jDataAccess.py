@@ -1,26 +1,42 @@
-import ast
-import json
+import random
 import time
 import re
-
-from datetime import datetime
+import numpy as np
 import pandas as pd
-from neo4j import GraphDatabase, basic_auth
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from neo4j.exceptions import TransientError
 from urllib.parse import urlparse
 import logging
 
 from .DfHelper import DfHelper
+from .Neo4jDriverPool import Neo4jDriverPool
 
 logger = logging.getLogger('Neo4jDataAccess')
 
 
 class Neo4jDataAccess:
 
-    def __init__(self, debug=False, neo4j_creds=None, batch_size=2000, timeout="60s"):
+    #tweet_type -> (relationship to the referenced tweet, tweet param column holding its id)
+    TYPE_RELS = {
+        'REPLY': ('REPLYED', 'reply_tweet_id'),
+        'QUOTE_RETWEET': ('QUOTED', 'quoted_status_id'),
+        'RETWEET': ('RETWEETED', 'retweet_id')
+    }
+
+    def __init__(self, debug=False, neo4j_creds=None, batch_size=2000, timeout="60s", max_connection_pool_size=None,
+                 writer_threads=1, max_retries=5, retry_backoff_s=0.5, status_cache=None):
         self.creds = neo4j_creds
+        #status_cache: optional StatusCache handed to DfHelper, so embedded statuses parse once per job
+        self.status_cache = status_cache
         self.debug = debug
         self.timeout = timeout
         self.batch_size = batch_size
+        self.max_connection_pool_size = max_connection_pool_size
+        self.writer_threads = writer_threads
+        self.max_retries = max_retries
+        self.retry_backoff_s = retry_backoff_s
+        self.graph = None
         self.tweetsandaccounts = """
                   UNWIND $tweets AS t
                       //Add the Tweet
@@ -51,7 +67,7 @@ class Neo4jDataAccess:
                     MERGE (user:Account {id:t.user_id})
                         ON CREATE SET
                             user.id = t.user_id,
-                            user.name = t.name,
+                            user.name = t.user_name,
                             user.screen_name = t.user_screen_name,
                             user.followers_count = t.user_followers_count,
                             user.friends_count = t.user_friends_count,
@@ -73,67 +89,32 @@ class Neo4jDataAccess:
                             user.job_name = t.job_name,
                             user.job_id = t.job_id
 
-                    //Add Reply to tweets if needed
-                    FOREACH(ignoreMe IN CASE WHEN t.tweet_type='REPLY' THEN [1] ELSE [] END |
-                        MERGE (retweet:Tweet {id:t.reply_tweet_id})
-                            ON CREATE SET retweet.id=t.reply_tweet_id,
-                            retweet.record_created_at = timestamp(),
-                            retweet.job_name = t.job_name,
-                            retweet.job_id = t.job_id,
-                            retweet.hydrated = 'PARTIAL'
-                    )
-
-                    //Add QUOTE_RETWEET to tweets if needed
-                    FOREACH(ignoreMe IN CASE WHEN t.tweet_type='QUOTE_RETWEET' THEN [1] ELSE [] END |
-                        MERGE (quoteTweet:Tweet {id:t.quoted_status_id})
-                            ON CREATE SET quoteTweet.id=t.quoted_status_id,
-                            quoteTweet.record_created_at = timestamp(),
-                            quoteTweet.job_name = t.job_name,
-                            quoteTweet.job_id = t.job_id,
-                            quoteTweet.hydrated = 'PARTIAL'
-                    )
-
-                    //Add RETWEET to tweets if needed
-                    FOREACH(ignoreMe IN CASE WHEN t.tweet_type='RETWEET' THEN [1] ELSE [] END |
-                        MERGE (retweet:Tweet {id:t.retweet_id})
-                            ON CREATE SET retweet.id=t.retweet_id,
-                            retweet.record_created_at = timestamp(),
-                            retweet.job_name = t.job_name,
-                            retweet.job_id = t.job_id,
-                            retweet.hydrated = 'PARTIAL'
-                    )
+                    MERGE (user)-[:TWEETED]->(tweet)
         """
 
-        self.tweeted_rel = """UNWIND $tweets AS t
-                    MATCH (user:Account {id:t.user_id})
+        # One statement per tweet type that references another tweet, each sent only that
+        # type's rows (split client-side by df_to_graph_params), so no per-row CASE branching
+        # or OPTIONAL MATCHes: t.ref_id is the replied to / quoted / retweeted tweet
+        self.referenced_tweets = {
+            tweet_type: """UNWIND $tweets AS t
                     MATCH (tweet:Tweet {id:t.tweet_id})
-                    OPTIONAL MATCH (replied:Tweet {id:t.reply_tweet_id})
-                    OPTIONAL MATCH (quoteTweet:Tweet {id:t.quoted_status_id})
-                    OPTIONAL MATCH (retweet:Tweet {id:t.retweet_id})
-                    WITH user, tweet, replied, quoteTweet, retweet
-
-                    MERGE (user)-[r:TWEETED]->(tweet)
-
-                    FOREACH(ignoreMe IN CASE WHEN tweet.type='REPLY' AND replied.id>0 THEN [1] ELSE [] END |
-                        MERGE (tweet)-[:REPLYED]->(replied)
-                    )
-
-                    FOREACH(ignoreMe IN CASE WHEN tweet.type='QUOTE_RETWEET' AND quoteTweet.id>0 THEN [1] ELSE [] END |
-                        MERGE (tweet)-[:QUOTED]->(quoteTweet)
-                    )
-
-                    FOREACH(ignoreMe IN CASE WHEN tweet.type='RETWEET' AND retweet.id>0 THEN [1] ELSE [] END |
-                        MERGE (tweet)-[:RETWEETED]->(retweet)
-                    )
-
-        """
+                    MERGE (ref:Tweet {id:t.ref_id})
+                        ON CREATE SET ref.id=t.ref_id,
+                        ref.record_created_at = timestamp(),
+                        ref.job_name = t.job_name,
+                        ref.job_id = t.job_id,
+                        ref.hydrated = 'PARTIAL'
+                    MERGE (tweet)-[:%s]->(ref)
+            """ % rel_type
+            for tweet_type, (rel_type, ref_col) in Neo4jDataAccess.TYPE_RELS.items()
+        }
 
         self.mentions = """UNWIND $mentions AS t
                     MATCH (tweet:Tweet {id:t.tweet_id})
                     MERGE (user:Account {id:t.user_id})
                         ON CREATE SET
                             user.id = t.user_id,
-                            user.mentioned_name = t.name,
+                            user.mentioned_name = t.user_name,
                             user.mentioned_screen_name = t.user_screen_name,
                             user.record_created_at = timestamp(),
                             user.job_name = t.job_name,
@@ -150,7 +131,7 @@ class Neo4jDataAccess:
                             url.job_name = t.job_name,
                             url.job_id = t.job_id,
                             url.record_created_at = timestamp(),
-                            url.schema=t.scheme,
+                            url.schema=t.schema,
                             url.netloc=t.netloc,
                             url.path=t.path,
                             url.params=t.params,
@@ -174,25 +155,17 @@ class Neo4jDataAccess:
                     RETURN tweet
         """
 
+    # Drivers are shared process-wide via Neo4jDriverPool; use
+    # Neo4jDriverPool.close() for explicit shutdown
     def __get_neo4j_graph(self, role_type):
-        creds = None
         logging.debug('role_type: %s', role_type)
-        if not (self.creds is None):
-            creds = self.creds
-        else:
-            with open('neo4jcreds.json') as json_file:
-                creds = json.load(json_file)
-        res = list(filter(lambda c: c["type"] == role_type, creds))
-        if len(res):
-            logging.debug("creds %s", res)
-            creds = res[0]["creds"]
-            uri = f'bolt://{creds["host"]}:{creds["port"]}'
-            self.graph = GraphDatabase.driver(
-                uri, auth=basic_auth(creds['user'], creds['password']), encrypted=False)
-        else:
-            self.graph = None
+        self.graph = Neo4jDriverPool.get_driver(
+            role_type, self.creds, max_connection_pool_size=self.max_connection_pool_size)
         return self.graph
 
+    def health_check(self):
+        return Neo4jDriverPool.health_check()
+
     def get_from_neo(self, cypher, limit=1000):
         graph = self.__get_neo4j_graph('reader')
         # If the limit isn't set in the traversal then add it
@@ -233,10 +206,20 @@ class Neo4jDataAccess:
                 'Parameter df must be a DataFrame with a column named "id" ')
 
     def save_parquet_df_to_graph(self, df, job_name, job_id=None):
-        pdf = DfHelper().normalize_parquet_dataframe(df)
+        pdf = DfHelper(self.status_cache).normalize_parquet_dataframe(df)
         logging.info('Saving to Neo4j')
         self.__save_df_to_graph(pdf, job_name)
 
+    # save_parquet_df_to_graph for files larger than memory: parquet files (or folders of them)
+    # are normalized and written batch_rows rows at a time; returns the number of rows written
+    def save_parquet_file_to_graph(self, paths, job_name, job_id=None, batch_rows=None, input_profile=None):
+        rows = 0
+        for pdf in DfHelper(self.status_cache).iter_normalized_parquet(paths, batch_rows, input_profile=input_profile):
+            logging.info('Saving %s rows to Neo4j', len(pdf))
+            self.__save_df_to_graph(pdf, job_name, job_id)
+            rows += len(pdf)
+        return rows
+
     # Get the status of a DataFrame of Tweets by id.  Returns a dataframe with the hydrated status
     def get_tweet_hydrated_status_by_id(self, df):
         if 'id' in df:
@@ -263,130 +246,230 @@ class Neo4jDataAccess:
                 'Parameter df must be a DataFrame with a column named "id" ')
 
     # This saves the User and Tweet data right now
+    # Each batch_size slice is written as one transaction, so a batch's tweets/accounts
+    # always land before its relationships; with writer_threads > 1 slices are written
+    # concurrently, each in its own session. Across slices there is no ordering: a reply or
+    # quote may be written before the slice holding the tweet it references; that slice's MERGE
+    # then fills in the PARTIAL stub the relationship created
     def __save_df_to_graph(self, df, job_name, job_id=None):
         graph = self.__get_neo4j_graph('writer')
         global_tic = time.perf_counter()
-        params = []
-        mention_params = []
-        url_params = []
-        tic = time.perf_counter()
         logging.debug('df columns %s', df.columns)
-        for index, row in df.iterrows():
-            # determine the type of tweet
-            tweet_type = 'TWEET'
-            if row["in_reply_to_status_id"] is not None and row["in_reply_to_status_id"] > 0:
-                tweet_type = "REPLY"
-            elif "quoted_status_id" in row and row["quoted_status_id"] is not None and row["quoted_status_id"] > 0:
-                tweet_type = "QUOTE_RETWEET"
-            elif "retweet_id" in row and row["retweet_id"] is not None and row["retweet_id"] > 0:
-                tweet_type = "RETWEET"
-            try:
-                params.append({'tweet_id': row['status_id'],
-                               'text': row['full_text'],
-                               'tweet_created_at': row['created_at'].to_pydatetime(),
-                               'favorite_count': row['favorite_count'],
-                               'retweet_count': row['retweet_count'],
-                               'tweet_type': tweet_type,
-                               'job_id': job_id,
-                               'job_name': job_name,
-                               'hashtags': self.__normalize_hashtags(row['hashtags']),
-                               'user_id': row['user_id'],
-                               'user_name': row['user_name'],
-                               'user_location': row['user_location'],
-                               'user_screen_name': row['user_screen_name'],
-                               'user_followers_count': row['user_followers_count'],
-                               'user_friends_count': row['user_friends_count'],
-                               'user_created_at': pd.Timestamp(row['user_created_at'], unit='s').to_pydatetime(),
-                               'user_profile_image_url': row['user_profile_image_url'],
-                               'reply_tweet_id': row['in_reply_to_status_id'],
-                               'quoted_status_id': row['quoted_status_id'],
-                               'retweet_id': row['retweet_id'] if 'retweet_id' in row else None,
-                               })
-            except Exception as e:
-                logging.error('params.append exn', e)
-                logging.error('row', row)
-                raise e
-
-            # if there are urls then populate the url_params
-            if row['urls']:
-                url_params = self.__parse_urls(
-                    row, url_params, job_name, job_id)
-            # if there are user_mentions then populate the mentions_params
-            if row['user_mentions']:
-                for m in row['user_mentions']:
-                    mention_params.append({
-                        'tweet_id': row['status_id'],
-                        'user_id': m['id'],
-                        'user_name': m['name'],
-                        'user_screen_name': m['screen_name'],
-                        'job_id': job_id,
-                        'job_name': job_name,
-                    })
-            if index % self.batch_size == 0 and index > 0:
-                self.__write_to_neo(params, url_params, mention_params)
-                toc = time.perf_counter()
-                logging.info(
-                    f'Neo4j Periodic Save Complete in  {toc - tic:0.4f} seconds')
-                params = []
-                mention_params = []
-                url_params = []
-                tic = time.perf_counter()
-
-        self.__write_to_neo(params, url_params, mention_params)
+
+        def write_batch(start):
+            tic = time.perf_counter()
+            params = self.df_to_graph_params(
+                df.iloc[start:start + self.batch_size], job_name, job_id)
+            self.__write_to_neo(
+                params['tweets'], params['urls'], params['mentions'], params['referenced'])
+            toc = time.perf_counter()
+            logging.info(
+                f'Neo4j Periodic Save Complete in  {toc - tic:0.4f} seconds')
+
+        starts = range(0, max(len(df), 1), self.batch_size)
+        if self.writer_threads <= 1:
+            for start in starts:
+                write_batch(start)
+        else:
+            # bound in-flight batches so params for the whole df are never all in memory
+            with ThreadPoolExecutor(max_workers=self.writer_threads) as executor:
+                in_flight = deque()
+                try:
+                    for start in starts:
+                        if len(in_flight) >= 2 * self.writer_threads:
+                            in_flight.popleft().result()
+                        in_flight.append(executor.submit(write_batch, start))
+                    while len(in_flight) > 0:
+                        in_flight.popleft().result()
+                except Exception as e:
+                    for f in in_flight:
+                        f.cancel()
+                    raise e
         toc = time.perf_counter()
         logging.info(
             f"Neo4j Import Complete in  {toc - global_tic:0.4f} seconds")
 
-    def __write_to_neo(self, params, url_params, mention_params):
-        try:
-            with self.graph.session() as session:
-                session.run(self.tweetsandaccounts,
-                            tweets=params, timeout=self.timeout)
-                session.run(self.tweeted_rel, tweets=params,
-                            timeout=self.timeout)
-                session.run(self.mentions, mentions=mention_params,
-                            timeout=self.timeout)
-                session.run(self.urls, urls=url_params, timeout=self.timeout)
-        except Exception as inst:
-            logging.error('Neo4j Transaction error')
-            logging.error(type(inst))    # the exception instance
-            logging.error(inst.args)     # arguments stored in .args
-            # __str__ allows args to be printed directly,
-            logging.error(inst)
-            raise inst
-
-    def __normalize_hashtags(self, value):
-        if value:
-            hashtags = []
-            for h in value:
-                hashtags.append(h['text'])
-            return ','.join(hashtags)
-        else:
-            return None
+    # Columnar equivalent of the old per-row loop: returns the tweet, mention and url
+    # param frames for a normalized DataFrame (see DfHelper.normalize_parquet_dataframe)
+    def build_param_frames(self, df, job_name, job_id=None):
+        df = df.reset_index(drop=True)
+        n = len(df)
+
+        def col(name):
+            if name in df:
+                return df[name]
+            return pd.Series([None] * n, dtype='object')
+
+        def positive(name):
+            return (pd.to_numeric(col(name), errors='coerce') > 0).fillna(False).to_numpy(dtype=bool)
+
+        tweet_type = np.select(
+            [positive('in_reply_to_status_id'), positive('quoted_status_id'), positive('retweet_id')],
+            ['REPLY', 'QUOTE_RETWEET', 'RETWEET'],
+            default='TWEET')
+
+        tweets_df = pd.DataFrame({
+            'tweet_id': df['status_id'],
+            'text': df['full_text'],
+            'tweet_created_at': pd.Series(self.__to_pydatetimes(df['created_at']), dtype='object'),
+            'favorite_count': df['favorite_count'],
+            'retweet_count': df['retweet_count'],
+            'tweet_type': tweet_type,
+            'job_id': job_id,
+            'job_name': job_name,
+            'hashtags': self.__normalize_hashtags(df['hashtags']),
+            'user_id': self.__to_int_ids(df['user_id']),
+            'user_name': df['user_name'],
+            'user_location': df['user_location'],
+            'user_screen_name': df['user_screen_name'],
+            'user_followers_count': df['user_followers_count'],
+            'user_friends_count': df['user_friends_count'],
+            'user_created_at': pd.Series(self.__to_pydatetimes(
+                pd.to_datetime(df['user_created_at'], unit='s')), dtype='object'),
+            'user_profile_image_url': df['user_profile_image_url'],
+            'reply_tweet_id': self.__to_int_ids(df['in_reply_to_status_id']),
+            'quoted_status_id': self.__to_int_ids(df['quoted_status_id']),
+            'retweet_id': self.__to_int_ids(col('retweet_id')),
+        })
+
+        mentions = self.__explode_entities(df, 'user_mentions', ['id', 'name', 'screen_name'])
+        mentions_df = pd.DataFrame({
+            'tweet_id': mentions['status_id'],
+            'user_id': mentions['id'],
+            'user_name': mentions['name'],
+            'user_screen_name': mentions['screen_name'],
+        }).assign(job_id=job_id, job_name=job_name)
+
+        urls = self.__explode_entities(df, 'urls', ['expanded_url'])
+        urls_df = self.__parse_urls(urls['status_id'], urls['expanded_url'], job_name, job_id)
+
+        return tweets_df, mentions_df, urls_df
+
+    # Neo4j $tweets/$mentions/$urls parameter lists for a normalized DataFrame, plus
+    # 'referenced': {tweet_type: $tweets for that type's referenced_tweets statement}
+    def df_to_graph_params(self, df, job_name, job_id=None):
+        tweets_df, mentions_df, urls_df = self.build_param_frames(df, job_name, job_id)
+        return {
+            'tweets': self.__frame_to_records(tweets_df),
+            'mentions': self.__frame_to_records(mentions_df),
+            'urls': self.__frame_to_records(urls_df),
+            'referenced': self.__split_referenced(tweets_df)
+        }
+
+    def __split_referenced(self, tweets_df):
+        out = {}
+        for tweet_type, (rel_type, ref_col) in Neo4jDataAccess.TYPE_RELS.items():
+            rows = tweets_df[(tweets_df['tweet_type'] == tweet_type).to_numpy()
+                             & (pd.to_numeric(tweets_df[ref_col], errors='coerce') > 0).fillna(False).to_numpy(dtype=bool)]
+            out[tweet_type] = self.__frame_to_records(pd.DataFrame({
+                'tweet_id': rows['tweet_id'],
+                'ref_id': self.__to_int_ids(rows[ref_col]),
+                'job_name': rows['job_name'],
+                'job_id': rows['job_id']}))
+        return out
+
+    # Ids as python ints / None for the driver (MERGE matches ints and floats as different ids).
+    # A float column means ids above 2^53 were already rounded upstream, so it is an error, not cast
+    def __to_int_ids(self, series):
+        if pd.api.types.is_float_dtype(series) and series.notnull().any():
+            raise TypeError('Float id column %s: keep ids int64 / Int64 upstream' % series.name)
+        ids = series.astype('Int64')
+        return ids.astype('object').where(ids.notnull(), None)
+
+    def __write_to_neo(self, params, url_params, mention_params, referenced_params):
+        attempt = 0
+        while True:
+            try:
+                # commits on exit, rolls back if any statement fails
+                with self.graph.session() as session, session.begin_transaction() as tx:
+                    tx.run(self.tweetsandaccounts,
+                           tweets=params, timeout=self.timeout)
+                    for tweet_type, type_params in referenced_params.items():
+                        if len(type_params) > 0:
+                            tx.run(self.referenced_tweets[tweet_type],
+                                   tweets=type_params, timeout=self.timeout)
+                    tx.run(self.mentions, mentions=mention_params,
+                           timeout=self.timeout)
+                    tx.run(self.urls, urls=url_params, timeout=self.timeout)
+                return
+            except TransientError as inst:
+                # concurrent MERGEs on shared Account/Url nodes deadlock; the transaction rolled back
+                # and its statements are idempotent, so replay it. Terminated transactions are not retried
+                attempt = attempt + 1
+                if attempt > self.max_retries or not inst.is_retriable():
+                    logging.error('Neo4j Transaction error, giving up after %s retries', self.max_retries)
+                    logging.error(inst)
+                    raise inst
+                backoff_s = self.retry_backoff_s * (2 ** (attempt - 1))
+                backoff_s = backoff_s + random.uniform(0, backoff_s)
+                logging.warning('Neo4j transient error (%s), retry %s/%s in %0.2fs',
+                                type(inst).__name__, attempt, self.max_retries, backoff_s)
+                time.sleep(backoff_s)
+            except Exception as inst:
+                logging.error('Neo4j Transaction error')
+                logging.error(type(inst))    # the exception instance
+                logging.error(inst.args)     # arguments stored in .args
+                # __str__ allows args to be printed directly,
+                logging.error(inst)
+                raise inst
+
+    def __frame_to_records(self, df):
+        keys = list(df.columns)
+        cols = [df[c].tolist() for c in keys]
+        return [dict(zip(keys, vals)) for vals in zip(*cols)]
+
+    def __to_pydatetimes(self, series):
+        return [None if dt is pd.NaT else dt for dt in series.dt.to_pydatetime()]
+
+    # one row per (tweet, entity) with the requested entity dict fields as columns
+    def __explode_entities(self, df, col, fields):
+        if col not in df or len(df) == 0:
+            return pd.DataFrame(columns=['status_id'] + fields)
+        exploded = df[['status_id', col]].explode(col)
+        exploded = exploded[exploded[col].notnull()]
+        entities = pd.DataFrame(exploded[col].tolist(), index=exploded.index)
+        return entities.reindex(columns=fields).assign(status_id=exploded['status_id'])
+
+    def __normalize_hashtags(self, series):
+        texts = series.explode().dropna().str.get('text').dropna()
+        # object groupby-sum concatenates in cython, unlike agg(','.join)
+        joined = (texts + ',').groupby(level=0).sum().str[:-1]
+        return joined.reindex(series.index).astype('object').where(lambda s: s.notnull(), None)
 
-    def __parse_urls(self, row, url_params, job_name, job_id=None):
-        for u in row['urls']:
+    # urlparse once per distinct url, then join back onto the exploded (tweet, url) rows
+    def __parse_urls(self, tweet_ids, urls, job_name, job_id=None):
+        cols = ['tweet_id', 'url', 'job_id', 'job_name', 'schema', 'netloc', 'path', 'params',
+                'query', 'fragment', 'username', 'password', 'hostname', 'port']
+        parsed = {}
+        for u in pd.unique(urls):
             try:
-                parsed = urlparse(u['expanded_url'])
-                url_params.append({
-                    'tweet_id': row['status_id'],
-                    'url': u['expanded_url'],
-                    'job_id': job_id,
-                    'job_name': job_name,
-                    'schema': parsed.scheme,
-                    'netloc': parsed.netloc,
-                    'path': parsed.path,
-                    'params': parsed.params,
-                    'query': parsed.query,
-                    'fragment': parsed.fragment,
-                    'username': parsed.username,
-                    'password': parsed.password,
-                    'hostname': parsed.hostname,
-                    'port': parsed.port,
-                })
+                p = urlparse(u)
+                parsed[u] = {
+                    'schema': p.scheme,
+                    'netloc': p.netloc,
+                    'path': p.path,
+                    'params': p.params,
+                    'query': p.query,
+                    'fragment': p.fragment,
+                    'username': p.username,
+                    'password': p.password,
+                    'hostname': p.hostname,
+                    'port': p.port,
+                }
             except Exception as inst:
                 logging.error(type(inst))    # the exception instance
                 logging.error(inst.args)     # arguments stored in .args
                 # __str__ allows args to be printed directly,
                 logging.error(inst)
-        return url_params
+        if len(parsed) == 0:
+            return pd.DataFrame(columns=cols)
+        parsed_df = pd.DataFrame.from_dict(parsed, orient='index').astype('object')
+        parsed_df = parsed_df.where(parsed_df.notnull(), None)
+        keep = urls.isin(parsed_df.index)
+        out = parsed_df.reindex(urls[keep]).reset_index(drop=True)
+        out = out.assign(
+            tweet_id=tweet_ids[keep].reset_index(drop=True),
+            url=urls[keep].reset_index(drop=True),
+            job_id=job_id,
+            job_name=job_name)
+        return out[cols]
@@ -0,0 +1,95 @@
+import atexit
+import json
+import os
+import threading
+
+from neo4j import GraphDatabase, basic_auth
+import logging
+
+logger = logging.getLogger('Neo4jDriverPool')
+
+
+# Process-wide registry of long-lived neo4j drivers, one per (role, server, user, driver config).
+# Each driver keeps its own bolt connection pool, so Neo4jDataAccess instances
+# only pay connection setup on first use of a role instead of on every call.
+class Neo4jDriverPool:
+
+    DEFAULT_CREDS_FILE = 'neo4jcreds.json'
+
+    __lock = threading.RLock()
+    __drivers = {}
+    __creds_files = {}
+
+    @classmethod
+    def load_creds(cls, path=None):
+        path = os.path.abspath(path or cls.DEFAULT_CREDS_FILE)
+        with cls.__lock:
+            if not (path in cls.__creds_files):
+                with open(path) as json_file:
+                    cls.__creds_files[path] = json.load(json_file)
+            return cls.__creds_files[path]
+
+    @classmethod
+    def get_driver(cls, role_type, creds=None, max_connection_pool_size=None,
+                   connection_acquisition_timeout=None, max_connection_lifetime=None):
+        if creds is None:
+            creds = cls.load_creds()
+        res = list(filter(lambda c: c["type"] == role_type, creds))
+        if len(res) == 0:
+            return None
+        role_creds = res[0]["creds"]
+        uri = f'bolt://{role_creds["host"]}:{role_creds["port"]}'
+        config = {
+            k: v
+            for k, v in [
+                ('max_connection_pool_size', max_connection_pool_size),
+                ('connection_acquisition_timeout', connection_acquisition_timeout),
+                ('max_connection_lifetime', max_connection_lifetime)]
+            if not (v is None)
+        }
+        # Callers asking for a different pool size/timeouts get their own driver
+        key = (role_type, uri, role_creds['user'], tuple(sorted(config.items())))
+        with cls.__lock:
+            if not (key in cls.__drivers):
+                logger.debug('Creating %s driver for %s (%s)', role_type, uri, config)
+                cls.__drivers[key] = GraphDatabase.driver(
+                    uri, auth=basic_auth(role_creds['user'], role_creds['password']),
+                    encrypted=False, **config)
+            return cls.__drivers[key]
+
+    # Verify every registered driver can reach its server; unhealthy drivers are
+    # closed and evicted so the next get_driver() reconnects from scratch
+    @classmethod
+    def health_check(cls, role_type=None):
+        out = {}
+        with cls.__lock:
+            items = [(k, d) for k, d in cls.__drivers.items() if role_type is None or k[0] == role_type]
+        for key, driver in items:
+            try:
+                driver.verify_connectivity()
+                out[key] = True
+            except Exception as e:
+                logger.warning('Neo4j driver %s failed health check, evicting: %s', key, e)
+                out[key] = False
+                cls.__evict(key)
+        return out
+
+    @classmethod
+    def close(cls, role_type=None):
+        with cls.__lock:
+            keys = [k for k in cls.__drivers.keys() if role_type is None or k[0] == role_type]
+        for key in keys:
+            cls.__evict(key)
+
+    @classmethod
+    def __evict(cls, key):
+        with cls.__lock:
+            driver = cls.__drivers.pop(key, None)
+        if not (driver is None):
+            try:
+                driver.close()
+            except Exception as e:
+                logger.debug('Error closing driver %s: %s', key, e)
+
+
+atexit.register(Neo4jDriverPool.close)
@@ -0,0 +1,165 @@
+import argparse, os, sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .DfHelper import DfHelper
+from .ParquetWriterProfile import WRITER_PROFILES
+from .StatusCache import StatusCache
+
+import logging
+logger = logging.getLogger('ParallelNormalizer')
+
+
+# Normalizes a parquet backlog (files, or folders such as firehose_data/<job>) on a pool of
+# worker processes, as DfHelper.normalize_parquet_dataframe is GIL-bound pandas:
+#  - work units are runs of consecutive row groups of one file, about batch_rows rows each
+#  - workers read only DfHelper.NORMALIZE_COLUMNS, normalize, and send the result back as
+#    Arrow IPC stream bytes rather than a pickled DataFrame
+#  - results come back in unit order (files sorted, row groups ascending) whatever the finish
+#    order, with at most 2 x workers units in flight
+#  - each worker keeps its own StatusCache across the units it normalizes
+class ParallelNormalizer:
+
+    BATCH_ROWS = 50000
+
+    #per worker process, set by init_worker
+    worker_status_cache = None
+
+    def __init__(self, workers=None, batch_rows=None, columns=None, keep_nested=False, status_cache_items=None,
+                 input_profile=None):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.batch_rows = ParallelNormalizer.BATCH_ROWS if batch_rows is None else batch_rows
+        self.columns = DfHelper.NORMALIZE_COLUMNS if columns is None else columns
+        self.keep_nested = keep_nested
+        self.status_cache_items = status_cache_items
+        #writer copy to read when a folder holds several (see DfHelper.parquet_files)
+        self.input_profile = input_profile
+
+    ###################
+
+    # [(path, [row group indices])], in output order
+    def units(self, paths):
+        out = []
+        for path in DfHelper.parquet_files(paths, self.input_profile):
+            metadata = pq.ParquetFile(path).metadata
+            run = []
+            rows = 0
+            for i in range(metadata.num_row_groups):
+                run.append(i)
+                rows += metadata.row_group(i).num_rows
+                if rows >= self.batch_rows:
+                    out.append((path, run))
+                    run = []
+                    rows = 0
+            if len(run) > 0:
+                out.append((path, run))
+        return out
+
+    @staticmethod
+    def init_worker(status_cache_items):
+        ParallelNormalizer.worker_status_cache = \
+            None if status_cache_items == 0 else StatusCache(status_cache_items)
+
+    # Runs in a worker: normalized row groups of path as Arrow IPC stream bytes
+    @staticmethod
+    def normalize_unit(path, row_groups, columns, keep_nested):
+        parquet_file = pq.ParquetFile(path)
+        present = [c for c in columns if c in parquet_file.schema_arrow.names]
+        table = parquet_file.read_row_groups(row_groups, columns=present)
+        if table.num_rows == 0:
+            return None
+        pdf = DfHelper(ParallelNormalizer.worker_status_cache)\
+            .normalize_parquet_dataframe(DfHelper.table_to_pandas(table))
+        if not keep_nested:
+            pdf = pdf.drop(columns=[c for c in DfHelper.NESTED_COLUMNS if c in pdf])
+        try:
+            out = pa.Table.from_pandas(pdf, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            logger.error('Cannot convert normalized %s row groups %s to arrow: %s', path, row_groups, e)
+            raise e
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, out.schema) as writer:
+            writer.write_table(out)
+        return sink.getvalue().to_pybytes()
+
+    @staticmethod
+    def read_ipc(data):
+        return pa.ipc.open_stream(data).read_all()
+
+    ###################
+
+    # ((path, row_groups), normalized arrow table) per unit, in unit order; empty units are skipped
+    def iter_tables(self, paths):
+        units = self.units(paths)
+        logger.info('Normalizing %s units from %s on %s workers', len(units), paths, self.workers)
+        if self.workers <= 1:
+            ParallelNormalizer.init_worker(self.status_cache_items)
+            for unit in units:
+                data = ParallelNormalizer.normalize_unit(unit[0], unit[1], self.columns, self.keep_nested)
+                if not (data is None):
+                    yield unit, ParallelNormalizer.read_ipc(data)
+            return
+        with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=ParallelNormalizer.init_worker, initargs=(self.status_cache_items,)) as executor:
+            in_flight = deque()
+            try:
+                for unit in units:
+                    if len(in_flight) >= 2 * self.workers:
+                        done_unit, future = in_flight.popleft()
+                        data = future.result()
+                        if not (data is None):
+                            yield done_unit, ParallelNormalizer.read_ipc(data)
+                    in_flight.append((unit, executor.submit(
+                        ParallelNormalizer.normalize_unit, unit[0], unit[1], self.columns, self.keep_nested)))
+                while len(in_flight) > 0:
+                    done_unit, future = in_flight.popleft()
+                    data = future.result()
+                    if not (data is None):
+                        yield done_unit, ParallelNormalizer.read_ipc(data)
+            finally:
+                for done_unit, future in in_flight:
+                    future.cancel()
+
+    # Normalized DataFrames, as DfHelper.iter_normalized_parquet yields them but computed in parallel
+    def iter_normalized(self, paths):
+        for unit, table in self.iter_tables(paths):
+            yield DfHelper.table_to_pandas(table)
+
+    # One <out_dir>/part-NNNNN.parquet per unit (schemas can differ per unit); returns their paths
+    def write(self, paths, out_dir, profile=None):
+        os.makedirs(out_dir, exist_ok=True)
+        out = []
+        for i, (unit, table) in enumerate(self.iter_tables(paths)):
+            out_path = os.path.join(out_dir, 'part-%05d.parquet' % i)
+            tmp_path = os.path.join(out_dir, '.part-%05d.parquet.tmp' % i)
+            if profile is None:
+                pq.write_table(table, tmp_path)
+            else:
+                profile.write_table(table, tmp_path)
+            os.replace(tmp_path, out_path)
+            out.append(out_path)
+        return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Normalize tweet parquet files on a pool of worker processes')
+    parser.add_argument('out_dir', help='folder for the normalized part-NNNNN.parquet files')
+    parser.add_argument('paths', nargs='+', help='parquet files or folders of them (e.g. firehose_data/<job>)')
+    parser.add_argument('--workers', type=int, default=None, help='default: cpu count')
+    parser.add_argument('--batch-rows', type=int, default=ParallelNormalizer.BATCH_ROWS)
+    parser.add_argument('--profile', choices=list(WRITER_PROFILES.keys()), default='snappy')
+    parser.add_argument('--input-profile', default=None,
+        help='read only the <profile>2.parquet copy of each flush (default: one copy, by WRITER_PROFILES order)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    normalizer = ParallelNormalizer(workers=args.workers, batch_rows=args.batch_rows, input_profile=args.input_profile)
+    for path in normalizer.write(args.paths, args.out_dir, WRITER_PROFILES[args.profile]):
+        print(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,195 @@
+import argparse, datetime, os, re, sys, uuid
+from collections import defaultdict
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .ParquetWriterProfile import WRITER_PROFILES
+
+import logging
+logger = logging.getLogger('ParquetCompactor')
+
+
+# Merges the many small files FirehoseJob writes per hour into one file per hour (or day):
+#  - dedupes by tweet id, keeping the last hydration (files in mtime order, rows in file order)
+#  - sorts by id, which is also created_at order for snowflake ids
+#  - writes row groups of row_group_rows (with the profile's codec/encodings) under a hidden .tmp name, os.replace's it into place,
+#    then removes the inputs; a crash in between leaves duplicates for the next run, never gaps
+# Layouts:
+#  flat         firehose_data/<job>/<YYYY_MM_DD_HH>_bN.<suffix>  -> <YYYY_MM_DD_HH|YYYY_MM_DD>_b0.<suffix>,
+#               per suffix (<profile>2.parquet) so each keeps its writer profile
+#  partitioned  firehose_data/job=<job>/date=/hour=/part-*.parquet -> one part-compacted-*.parquet
+#               per hour directory with the given profile, then job=<job>/_metadata is rebuilt
+class ParquetCompactor:
+
+    ROW_GROUP_ROWS = 100000
+
+    FLAT_FILE_RE = re.compile(r'^(?P<day>\d{4}_\d{2}_\d{2})_(?P<hour>\d{2})_b(?P<run>\d+)\.(?P<suffix>\w+\.parquet)$')
+    def __init__(self, row_group_rows=None, profile='snappy', min_files=2, dry_run=False):
+        self.row_group_rows = ParquetCompactor.ROW_GROUP_ROWS if row_group_rows is None else row_group_rows
+        self.profile = WRITER_PROFILES[profile] if isinstance(profile, str) else profile
+        self.min_files = min_files
+        self.dry_run = dry_run
+
+    ###################
+
+    # Rows of table minus earlier duplicates of an id, sorted by id
+    @staticmethod
+    def dedupe_sorted(table):
+        order = pc.sort_indices(table, sort_keys=[('id', 'ascending')]).to_numpy()
+        ids = table.column('id').to_numpy()[order]
+        #sort_indices is stable, so the last row of each run of equal ids is the latest one
+        keep = np.ones(len(ids), dtype=bool)
+        keep[:-1] = ids[:-1] != ids[1:]
+        return table.take(pa.array(order[keep]))
+
+    @staticmethod
+    def read_all(paths):
+        tables = [pq.read_table(path) for path in paths]
+        schemas = set([t.schema.remove_metadata().to_string() for t in tables])
+        if len(schemas) > 1:
+            raise ValueError('Cannot compact files with different schemas: %s' % paths)
+        return pa.concat_tables(tables)
+
+    # Groups that cannot be read (e.g. a flat file whose writer is still open) are skipped
+    def compact_group(self, paths, out_path, profile=None):
+        try:
+            return [(out_path, *self.compact_files(paths, out_path, profile))]
+        except Exception as e:
+            logger.warning('Skipping %s: %s', out_path, e)
+            return []
+
+    # Compact paths into out_path; returns (rows in, rows out)
+    def compact_files(self, paths, out_path, profile=None):
+        profile = self.profile if profile is None else profile
+        paths = sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+        table = self.read_all(paths)
+        compacted = self.dedupe_sorted(table)
+        logger.info('Compacting %s files, %s rows -> %s rows: %s', len(paths), table.num_rows, compacted.num_rows, out_path)
+        if self.dry_run:
+            return table.num_rows, compacted.num_rows
+        folder, name = os.path.split(out_path)
+        tmp_path = os.path.join(folder, '.%s.tmp' % name)
+        try:
+            pq.write_table(compacted, tmp_path, row_group_size=self.row_group_rows, **profile.writer_kwargs())
+            os.replace(tmp_path, out_path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise e
+        for path in paths:
+            if os.path.abspath(path) != os.path.abspath(out_path):
+                os.remove(path)
+        return table.num_rows, compacted.num_rows
+
+    ###################
+
+    @staticmethod
+    def is_partitioned(folder):
+        return os.path.basename(os.path.normpath(folder)).startswith('job=')
+
+    # {(key, suffix): [paths]} for a flat job folder, key being the file's hour or day
+    def flat_groups(self, folder, by='hour'):
+        groups = defaultdict(list)
+        for name in sorted(os.listdir(folder)):
+            m = ParquetCompactor.FLAT_FILE_RE.match(name)
+            if m is None:
+                continue
+            key = m.group('day') if by == 'day' else '%s_%s' % (m.group('day'), m.group('hour'))
+            groups[(key, m.group('suffix'))].append(os.path.join(folder, name))
+        return groups
+
+    def compact_flat(self, folder, by='hour', only=None):
+        stats = []
+        for (key, suffix), paths in sorted(self.flat_groups(folder, by).items()):
+            if not (only is None) and not key.startswith(only):
+                continue
+            if len(paths) < self.min_files:
+                continue
+            out_path = os.path.join(folder, '%s_b0.%s' % (key, suffix))
+            profile = WRITER_PROFILES.get(suffix[:-len('2.parquet')], self.profile)
+            stats.extend(self.compact_group(paths, out_path, profile))
+        return stats
+
+    # Hour directories of a job=<job> folder, optionally only those under date=<only>
+    @staticmethod
+    def hour_folders(folder, only=None):
+        out = []
+        for date_name in sorted(os.listdir(folder)):
+            if not date_name.startswith('date=') or not (only is None or date_name == 'date=%s' % only):
+                continue
+            for hour_name in sorted(os.listdir(os.path.join(folder, date_name))):
+                if hour_name.startswith('hour='):
+                    out.append(os.path.join(folder, date_name, hour_name))
+        return out
+
+    @staticmethod
+    def visible_parquet_files(folder):
+        return [
+            os.path.join(folder, name)
+            for name in sorted(os.listdir(folder))
+            if name.endswith('.parquet') and not name.startswith(('.', '_'))
+        ]
+
+    def compact_partitioned(self, folder, only=None):
+        stats = []
+        for hour_folder in self.hour_folders(folder, only):
+            paths = self.visible_parquet_files(hour_folder)
+            if len(paths) < self.min_files:
+                continue
+            name = 'part-compacted-%s-%s.parquet' % (
+                datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8])
+            out_path = os.path.join(hour_folder, name)
+            stats.extend(self.compact_group(paths, out_path))
+        if len(stats) > 0 and not self.dry_run:
+            self.rebuild_metadata(folder)
+        return stats
+
+    # job=<job>/_metadata from the footers of every data file currently in the job folder
+    def rebuild_metadata(self, folder):
+        summary = None
+        for hour_folder in self.hour_folders(folder):
+            for path in self.visible_parquet_files(hour_folder):
+                file_metadata = pq.read_metadata(path)
+                file_metadata.set_file_path(os.path.relpath(path, folder).replace(os.sep, '/'))
+                if summary is None:
+                    summary = file_metadata
+                else:
+                    summary.append_row_groups(file_metadata)
+        if summary is None:
+            return
+        tmp_path = os.path.join(folder, '._metadata.tmp')
+        summary.write_metadata_file(tmp_path)
+        os.replace(tmp_path, os.path.join(folder, '_metadata'))
+
+    def compact(self, folder, by='hour', only=None):
+        if self.is_partitioned(folder):
+            return self.compact_partitioned(folder, only)
+        return self.compact_flat(folder, by, only)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Merge, dedupe and sort the small parquet files of one firehose_data job folder')
+    parser.add_argument('folder', help='firehose_data/<job> (flat) or firehose_data/job=<job> (partitioned)')
+    parser.add_argument('--by', choices=['hour', 'day'], default='hour',
+        help='flat layout: one output file per hour or per day; partitioned layouts always compact per hour')
+    parser.add_argument('--only', default=None,
+        help='only this hour/day prefix (flat, e.g. 2020_03_18) or date (partitioned, e.g. 2020-03-18)')
+    parser.add_argument('--row-group-rows', type=int, default=ParquetCompactor.ROW_GROUP_ROWS)
+    parser.add_argument('--profile', choices=list(WRITER_PROFILES.keys()), default='snappy',
+        help='writer profile for partitioned output (flat files keep the profile named by their suffix)')
+    parser.add_argument('--min-files', type=int, default=2, help='skip groups with fewer files')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    compactor = ParquetCompactor(
+        row_group_rows=args.row_group_rows, profile=args.profile, min_files=args.min_files, dry_run=args.dry_run)
+    for out_path, rows_in, rows_out in compactor.compact(args.folder, args.by, args.only):
+        print('%s: %s rows -> %s rows' % (out_path, rows_in, rows_out))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,78 @@
+import pyarrow.parquet as pq
+
+import logging
+logger = logging.getLogger('ParquetWriterProfile')
+
+
+# Codec + encoding settings for one parquet output, named by FirehoseJob's writers keys
+# (FirehoseJob(writers={'zstd': None}) writes <...>.zstd2.parquet with WRITER_PROFILES['zstd'])
+#  use_dictionary / write_statistics: True (all columns), False, or a list of column names
+#  row_group_size: rows per row group (None: one per written table, as before)
+#  data_page_size: target bytes per data page (None: arrow's 1MB default)
+class ParquetWriterProfile:
+
+    #low-cardinality strings that dictionary-encode well; free text and ids do not
+    DICTIONARY_COLS = ['lang', 'source', 'in_reply_to_screen_name']
+
+    #enough for row-group pruning on id (files are id-sorted once compacted)
+    STATISTICS_COLS = ['id']
+
+    def __init__(self, name, compression='snappy', compression_level=None,
+                 use_dictionary=True, write_statistics=True,
+                 row_group_size=None, data_page_size=None):
+        self.name = name
+        self.compression = compression
+        self.compression_level = compression_level
+        self.use_dictionary = use_dictionary
+        self.write_statistics = write_statistics
+        self.row_group_size = row_group_size
+        self.data_page_size = data_page_size
+
+    def __repr__(self):
+        return 'ParquetWriterProfile(%s)' % ', '.join(['%s=%s' % kv for kv in self.__dict__.items()])
+
+    @property
+    def file_suffix(self):
+        return '%s2.parquet' % self.name
+
+    #kwargs for pq.ParquetWriter / pq.write_table
+    def writer_kwargs(self):
+        kwargs = {
+            'compression': self.compression,
+            'use_dictionary': self.use_dictionary,
+            'write_statistics': self.write_statistics
+        }
+        if not (self.compression_level is None):
+            kwargs['compression_level'] = self.compression_level
+        if not (self.data_page_size is None):
+            kwargs['data_page_size'] = self.data_page_size
+        return kwargs
+
+    def open_writer(self, path, schema):
+        return pq.ParquetWriter(path, schema=schema, **self.writer_kwargs())
+
+    def write(self, writer, table):
+        writer.write_table(table, row_group_size=self.row_group_size)
+
+    def write_table(self, table, path, **kwargs):
+        pq.write_table(table, path, row_group_size=self.row_group_size, **self.writer_kwargs(), **kwargs)
+
+
+def tuned_profile(name, compression, compression_level=None):
+    return ParquetWriterProfile(
+        name, compression, compression_level,
+        use_dictionary=ParquetWriterProfile.DICTIONARY_COLS,
+        write_statistics=ParquetWriterProfile.STATISTICS_COLS,
+        row_group_size=100000,
+        data_page_size=1024 * 1024)
+
+
+### 'vanilla' and 'snappy' are the original pq_writer outputs, unchanged
+WRITER_PROFILES = {
+    'vanilla': ParquetWriterProfile('vanilla', 'NONE'),
+    'snappy': ParquetWriterProfile('snappy', 'SNAPPY'),
+    'lz4': tuned_profile('lz4', 'LZ4'),
+    'zstd': tuned_profile('zstd', 'ZSTD', 3),
+    'zstd9': tuned_profile('zstd9', 'ZSTD', 9),
+    'brotli': tuned_profile('brotli', 'BROTLI', 5)
+}
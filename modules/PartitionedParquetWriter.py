@@ -0,0 +1,116 @@
+import datetime, os, threading, uuid
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .ParquetWriterProfile import WRITER_PROFILES
+from .Snowflake import Snowflake
+
+import logging
+logger = logging.getLogger('PartitionedParquetWriter')
+
+
+# Hive-partitioned parquet dataset, partitioned by tweet creation time (from the snowflake id):
+#   <root>/job=<job>/date=<YYYY-MM-DD>/hour=<HH>/part-<writer>-<n>.parquet
+#   <root>/job=<job>/_metadata   row group summary of every file written there
+# Files are written under a hidden .tmp name and os.replace'd into place, so readers never
+# see partial files; names are unique per writer instance, so there is no probing for a free one.
+# Read back with pyarrow.dataset.parquet_dataset(<job dir>/_metadata, partitioning='hive');
+# _metadata is re-read whenever it changed on disk (e.g. rebuilt by ParquetCompactor); with
+# several processes writing one job, the last to write it wins, so rebuild it afterwards
+class PartitionedParquetWriter:
+
+    MS_PER_HOUR = 60 * 60 * 1000
+
+    def __init__(self, root='firehose_data', profile=None, write_metadata=True):
+        self.root = root
+        self.profile = WRITER_PROFILES['snappy'] if profile is None else profile
+        self.write_metadata = write_metadata
+        self.writer_id = '%s-%s' % (datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8])
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.summaries = {}
+
+    def job_folder(self, job_name):
+        return os.path.join(self.root, 'job=%s' % job_name)
+
+    # hours since epoch of each id's creation time
+    @staticmethod
+    def creation_hours(ids):
+        return Snowflake.creation_time(np.asarray(ids, dtype=np.int64)) // PartitionedParquetWriter.MS_PER_HOUR
+
+    @staticmethod
+    def partition_path(hour):
+        dt = datetime.datetime.utcfromtimestamp(int(hour) * 3600)
+        return os.path.join('date=%s' % dt.strftime('%Y-%m-%d'), 'hour=%s' % dt.strftime('%H'))
+
+    def __next_file_name(self):
+        with self.lock:
+            self.seq += 1
+            return 'part-%s-%05d.parquet' % (self.writer_id, self.seq)
+
+    def __write_file(self, table, path):
+        folder, name = os.path.split(path)
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = os.path.join(folder, '.%s.tmp' % name)
+        collector = []
+        try:
+            self.profile.write_table(table, tmp_path, metadata_collector=collector)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise e
+        return collector[0]
+
+    # Write table's rows into their hour partitions (one new file per partition); returns the paths
+    def write(self, table, job_name='generic_job'):
+        if table.num_rows == 0:
+            return []
+        folder = self.job_folder(job_name)
+        hours = self.creation_hours(table.column('id').to_numpy())
+        paths = []
+        written = []
+        for hour in np.unique(hours):
+            part = table.filter(pa.array(hours == hour))
+            relative_path = os.path.join(self.partition_path(hour), self.__next_file_name())
+            path = os.path.join(folder, relative_path)
+            logger.debug('Writing %s rows to %s', part.num_rows, path)
+            file_metadata = self.__write_file(part, path)
+            file_metadata.set_file_path(relative_path.replace(os.sep, '/'))
+            written.append(file_metadata)
+            paths.append(path)
+        if self.write_metadata:
+            self.__update_metadata(folder, table.schema, written)
+        return paths
+
+    @staticmethod
+    def __mtime(path):
+        return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+    def __summary(self, folder, schema):
+        path = os.path.join(folder, '_metadata')
+        mtime = self.__mtime(path)
+        if not (folder in self.summaries) or self.summaries[folder][1] != mtime:
+            summary = None
+            if not (mtime is None):
+                summary = pq.read_metadata(path)
+                if not summary.schema.to_arrow_schema().equals(schema):
+                    logger.warning('Schema changed since %s was written, starting a new summary', path)
+                    summary = None
+            self.summaries[folder] = (summary, mtime)
+        return self.summaries[folder][0]
+
+    def __update_metadata(self, folder, schema, written):
+        with self.lock:
+            summary = self.__summary(folder, schema)
+            for file_metadata in written:
+                if summary is None:
+                    summary = file_metadata
+                else:
+                    summary.append_row_groups(file_metadata)
+            path = os.path.join(folder, '_metadata')
+            tmp_path = os.path.join(folder, '._metadata.tmp')
+            summary.write_metadata_file(tmp_path)
+            os.replace(tmp_path, path)
+            self.summaries[folder] = (summary, self.__mtime(path))
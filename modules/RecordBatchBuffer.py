@@ -0,0 +1,37 @@
+import pyarrow as pa
+
+import logging
+logger = logging.getLogger('RecordBatchBuffer')
+
+
+# Holds the record batches received since the last flush. Appends are O(1);
+# the chunks are only combined once, when the buffer is turned into a table.
+class RecordBatchBuffer:
+
+    def __init__(self, schema=None):
+        self.schema = schema
+        self.batches = []
+        self.num_rows = 0
+        self.nbytes = 0
+
+    def append(self, data):
+        batches = data.to_batches() if isinstance(data, pa.Table) else [data]
+        for batch in batches:
+            if self.schema is None:
+                self.schema = batch.schema
+            self.batches.append(batch)
+            self.num_rows += batch.num_rows
+            self.nbytes += batch.nbytes
+
+    def is_empty(self):
+        return self.num_rows == 0
+
+    def to_table(self):
+        if len(self.batches) == 0:
+            return None
+        return pa.Table.from_batches(self.batches, self.schema).combine_chunks()
+
+    def clear(self):
+        self.batches = []
+        self.num_rows = 0
+        self.nbytes = 0
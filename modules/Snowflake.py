@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+import logging
+logger = logging.getLogger('Snowflake')
+
+
+# Twitter snowflake ids, vectorized over int64 arrays (python ints work too):
+#   id = (ms - EPOCH) << 22 | machine_id << 12 | sequence_id
+class Snowflake:
+
+    EPOCH = 1288834974657
+
+    TIME_SHIFT = 22
+    MACHINE_SHIFT = 12
+    MACHINE_MASK = 0b1111111111
+    SEQUENCE_MASK = 0b111111111111
+
+    ###################
+
+    @staticmethod
+    def creation_time(ids):
+        return (ids >> Snowflake.TIME_SHIFT) + Snowflake.EPOCH
+
+    @staticmethod
+    def machine_id(ids):
+        return (ids >> Snowflake.MACHINE_SHIFT) & Snowflake.MACHINE_MASK
+
+    @staticmethod
+    def sequence_id(ids):
+        return ids & Snowflake.SEQUENCE_MASK
+
+    # ids -> DataFrame of id, created_at (UTC datetime64[ms]), created_at_ms, machine_id, sequence_id
+    @staticmethod
+    def decode(ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        created_at_ms = Snowflake.creation_time(ids)
+        return pd.DataFrame({
+            'id': ids,
+            'created_at': pd.to_datetime(created_at_ms, unit='ms', utc=True),
+            'created_at_ms': created_at_ms,
+            'machine_id': Snowflake.machine_id(ids),
+            'sequence_id': Snowflake.sequence_id(ids)
+        })
+
+    ###################
+
+    # Every id for ms in [begin_ms, end_ms) x machine_ids x sequence_ids, in that nesting order
+    @staticmethod
+    def ids(begin_ms, end_ms, machine_ids, sequence_ids=(0,)):
+        machines, sequences = np.meshgrid(
+            np.asarray(machine_ids, dtype=np.int64), np.asarray(sequence_ids, dtype=np.int64), indexing='ij')
+        return Snowflake.ids_for_pairs(begin_ms, end_ms, machines.ravel(), sequences.ravel())
+
+    # Every id for ms in [begin_ms, end_ms) x the (machine_ids[i], sequence_ids[i]) pairs
+    @staticmethod
+    def ids_for_pairs(begin_ms, end_ms, machine_ids, sequence_ids):
+        times = (np.arange(begin_ms, end_ms, dtype=np.int64) - Snowflake.EPOCH) << Snowflake.TIME_SHIFT
+        suffixes = (np.asarray(machine_ids, dtype=np.int64) << Snowflake.MACHINE_SHIFT) \
+            | np.asarray(sequence_ids, dtype=np.int64)
+        return (times[:, None] | suffixes[None, :]).ravel()
+
+    # Same ids as ids(), as consecutive arrays of at most block_size ids (whole milliseconds each)
+    @staticmethod
+    def id_blocks(begin_ms, end_ms, machine_ids, sequence_ids=(0,), block_size=1000000):
+        ids_per_ms = len(machine_ids) * len(sequence_ids)
+        ms_per_block = max(block_size // ids_per_ms, 1)
+        for block_begin in range(begin_ms, end_ms, ms_per_block):
+            yield Snowflake.ids(block_begin, min(block_begin + ms_per_block, end_ms), machine_ids, sequence_ids)
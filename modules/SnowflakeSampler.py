@@ -0,0 +1,215 @@
+import datetime, os
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+
+from .Snowflake import Snowflake
+
+import logging
+logger = logging.getLogger('SnowflakeSampler')
+
+
+# Chooses which (machine_id, sequence_id) suffixes ingest_range probes for each millisecond,
+# from the hit rates of earlier probes, instead of every machine at sequence 0:
+#  - each block of ids probes probes_per_ms suffixes per ms (default len(machine_ids): the
+#    same lookup quota as the fixed scan), picked by Thompson sampling on Beta(hits+1, misses+1),
+#    plus an explore share picked uniformly so suffixes that went quiet get re-checked
+#  - sequence numbers count up within a busy ms, so when the highest sequence in play hits at
+#    expand_rate or more for some machine, the next sequence number becomes a candidate
+#  - counts decay with a half_life_s half-life (of tweet time), tracking activity shifts
+#  - hourly_stats() / save() give probes + hits per (hour, machine_id, sequence_id);
+#    stats_path, when given, is reloaded on start and rewritten as each hour completes
+#  - state() / set_state() copy the exact decayed counts, which ingest_range checkpoints
+class SnowflakeSampler:
+
+    MAX_SEQUENCE = Snowflake.SEQUENCE_MASK
+    PRIOR_PROBES = 10
+
+    def __init__(self, machine_ids, probes_per_ms=None, max_sequence=0,
+                 expand_rate=0.2, expand_min_probes=200, half_life_s=600, explore=0.1,
+                 stats_path=None, seed=0):
+        self.machine_ids = np.asarray(machine_ids, dtype=np.int64)
+        self.probes_per_ms = len(machine_ids) if probes_per_ms is None else probes_per_ms
+        self.max_sequence = max_sequence
+        self.expand_rate = expand_rate
+        self.expand_min_probes = expand_min_probes
+        self.half_life_s = half_life_s
+        self.explore = explore
+        self.stats_path = stats_path
+        self.rng = np.random.default_rng(seed)
+
+        self.machine_index = {int(m): i for i, m in enumerate(self.machine_ids)}
+        self.probes = np.zeros((len(machine_ids), max_sequence + 1))
+        self.hits = np.zeros((len(machine_ids), max_sequence + 1))
+        self.hourly = defaultdict(lambda: np.zeros(2, dtype=np.int64))
+        self.current_hour = None
+        self.last_ms = None
+
+        if not (stats_path is None) and os.path.exists(stats_path):
+            self.load(stats_path)
+
+    ###################
+
+    #row of each machine id in probes/hits, -1 for machine ids not sampled
+    def __machine_indices(self, machines):
+        order = np.argsort(self.machine_ids)
+        sorted_ids = self.machine_ids[order]
+        pos = np.minimum(np.searchsorted(sorted_ids, machines), len(sorted_ids) - 1)
+        return np.where(sorted_ids[pos] == machines, order[pos], -1)
+
+    #New sequence columns start from a weak prior: the hit rate one sequence below, worth PRIOR_PROBES
+    def __grow(self, max_sequence):
+        for sequence in range(self.max_sequence + 1, max_sequence + 1):
+            below_probes = self.probes[:, -1]
+            below_rate = np.where(below_probes > 0, self.hits[:, -1] / np.maximum(below_probes, 1), 0)
+            self.probes = np.hstack([self.probes, np.full((len(self.machine_ids), 1), float(SnowflakeSampler.PRIOR_PROBES))])
+            self.hits = np.hstack([self.hits, (below_rate * SnowflakeSampler.PRIOR_PROBES)[:, None]])
+        self.max_sequence = max(self.max_sequence, max_sequence)
+
+    def __expand(self):
+        if self.max_sequence >= SnowflakeSampler.MAX_SEQUENCE:
+            return
+        top_probes = self.probes[:, self.max_sequence]
+        top_hits = self.hits[:, self.max_sequence]
+        ready = top_probes >= self.expand_min_probes
+        if (ready & (top_hits >= self.expand_rate * top_probes)).any():
+            logger.info('Hit density at sequence %s is high, also probing sequence %s',
+                self.max_sequence, self.max_sequence + 1)
+            self.__grow(self.max_sequence + 1)
+
+    # (machine_ids, sequence_ids) to probe for the next block
+    def choose(self):
+        draws = self.rng.beta(self.hits + 1, self.probes - self.hits + 1)
+        k = min(self.probes_per_ms, draws.size)
+        k_explore = min(int(round(k * self.explore)), draws.size - k)
+        ranked = np.argsort(-draws.ravel())
+        picked = ranked[:k - k_explore]
+        if k_explore > 0:
+            picked = np.concatenate([picked, self.rng.choice(ranked[k - k_explore:], k_explore, replace=False)])
+        machine_idx, sequence_ids = np.unravel_index(picked, draws.shape)
+        return self.machine_ids[machine_idx], sequence_ids.astype(np.int64)
+
+    # Like Snowflake.id_blocks, but re-choosing the probed suffixes before every block
+    def id_blocks(self, begin_ms, end_ms, block_size=1000000):
+        ms_per_block = max(block_size // self.probes_per_ms, 1)
+        for block_begin in range(begin_ms, end_ms, ms_per_block):
+            machine_ids, sequence_ids = self.choose()
+            yield Snowflake.ids_for_pairs(block_begin, min(block_begin + ms_per_block, end_ms), machine_ids, sequence_ids)
+
+    ###################
+
+    # probed_ids: every id looked up; hit_ids: those that came back as tweets
+    def record(self, probed_ids, hit_ids):
+        probed_ids = np.asarray(probed_ids, dtype=np.int64)
+        if len(probed_ids) == 0:
+            return
+        hit = np.isin(probed_ids, np.asarray(hit_ids, dtype=np.int64))
+        hours = Snowflake.creation_time(probed_ids) // (3600 * 1000)
+        machines = Snowflake.machine_id(probed_ids)
+        sequences = Snowflake.sequence_id(probed_ids)
+
+        for hour in np.unique(hours):
+            self.__on_hour(int(hour))
+        self.__decay(int(Snowflake.creation_time(probed_ids.max())))
+
+        machine_idx = self.__machine_indices(machines)
+        in_range = machine_idx >= 0
+        if in_range.any():
+            self.__grow(int(sequences[in_range].max()))
+            cells = machine_idx[in_range] * self.probes.shape[1] + sequences[in_range]
+            self.probes += np.bincount(cells, minlength=self.probes.size).reshape(self.probes.shape)
+            self.hits += np.bincount(cells, weights=hit[in_range], minlength=self.hits.size).reshape(self.hits.shape)
+
+        #(hour, machine, sequence) packed like the low bits of an id, for a fast 1-d unique
+        keys, inverse = np.unique(
+            (hours << 22) | (machines << Snowflake.MACHINE_SHIFT) | sequences, return_inverse=True)
+        probe_counts = np.bincount(inverse, minlength=len(keys))
+        hit_counts = np.bincount(inverse, weights=hit, minlength=len(keys)).astype(np.int64)
+        for key, probes, hits in zip(keys.tolist(), probe_counts.tolist(), hit_counts.tolist()):
+            self.hourly[(key >> 22, (key >> Snowflake.MACHINE_SHIFT) & Snowflake.MACHINE_MASK, key & Snowflake.SEQUENCE_MASK)] += [probes, hits]
+
+        self.__expand()
+
+    def __on_hour(self, hour):
+        if self.current_hour is None:
+            self.current_hour = hour
+        elif hour > self.current_hour:
+            self.__close_hour(self.current_hour)
+            self.current_hour = hour
+
+    def __decay(self, ms):
+        if not (self.last_ms is None) and ms > self.last_ms:
+            factor = 0.5 ** ((ms - self.last_ms) / (self.half_life_s * 1000.0))
+            self.probes *= factor
+            self.hits *= factor
+        self.last_ms = ms if self.last_ms is None else max(ms, self.last_ms)
+
+    def __close_hour(self, hour):
+        stats = self.hourly_stats()
+        hour_stats = stats[stats['hour'] == self.hour_start(hour)]
+        probes = hour_stats['probes'].sum()
+        hits = hour_stats['hits'].sum()
+        logger.info('Hour %s: %s hits / %s probes (%.4f), sequences 0-%s',
+            self.hour_start(hour), hits, probes, hits / probes if probes > 0 else 0, self.max_sequence)
+        if not (self.stats_path is None):
+            self.save(self.stats_path)
+
+    @staticmethod
+    def hour_start(hour):
+        return pd.Timestamp(datetime.datetime.utcfromtimestamp(hour * 3600), tz='UTC')
+
+    ###################
+
+    # One row per (hour, machine_id, sequence_id) probed
+    def hourly_stats(self):
+        rows = [(hour, machine, sequence, counts[0], counts[1]) for (hour, machine, sequence), counts in self.hourly.items()]
+        df = pd.DataFrame(rows, columns=['hour', 'machine_id', 'sequence_id', 'probes', 'hits'])
+        df = df.assign(
+            hour=pd.to_datetime(df['hour'].astype(np.int64) * 3600, unit='s', utc=True),
+            hit_rate=df['hits'] / df['probes'])
+        return df.sort_values(['hour', 'machine_id', 'sequence_id']).reset_index(drop=True)
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        self.hourly_stats().to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    # Decayed Beta counts and their clock, as arrays (current_hour / last_ms: -1 for none yet)
+    def state(self):
+        return {
+            'machine_ids': self.machine_ids.copy(),
+            'probes': self.probes.copy(),
+            'hits': self.hits.copy(),
+            'current_hour': -1 if self.current_hour is None else self.current_hour,
+            'last_ms': -1 if self.last_ms is None else self.last_ms
+        }
+
+    def set_state(self, state):
+        if not np.array_equal(np.asarray(state['machine_ids']), self.machine_ids):
+            raise ValueError('Sampler state is for machine ids %s, not %s' % (
+                np.asarray(state['machine_ids']).tolist(), self.machine_ids.tolist()))
+        self.probes = np.array(state['probes'], dtype=np.float64)
+        self.hits = np.array(state['hits'], dtype=np.float64)
+        self.max_sequence = self.probes.shape[1] - 1
+        self.current_hour = None if int(state['current_hour']) < 0 else int(state['current_hour'])
+        self.last_ms = None if int(state['last_ms']) < 0 else int(state['last_ms'])
+
+    # Restore hourly counts, then rebuild the decayed per-suffix counts hour by hour
+    def load(self, path):
+        df = pd.read_parquet(path)
+        if len(df) == 0:
+            return
+        hours = (df['hour'].values.astype('datetime64[s]').astype(np.int64) // 3600)
+        for hour, machine, sequence, probes, hits in zip(hours, df['machine_id'], df['sequence_id'], df['probes'], df['hits']):
+            self.hourly[(int(hour), int(machine), int(sequence))] += [int(probes), int(hits)]
+        for hour in sorted(set(hours.tolist())):
+            self.__decay(hour * 3600 * 1000)
+            self.current_hour = hour
+            rows = df[hours == hour]
+            for machine, sequence, probes, hits in zip(rows['machine_id'], rows['sequence_id'], rows['probes'], rows['hits']):
+                if int(machine) in self.machine_index:
+                    self.__grow(int(sequence))
+                    self.probes[self.machine_index[int(machine)], int(sequence)] += probes
+                    self.hits[self.machine_index[int(machine)], int(sequence)] += hits
+        logger.info('Loaded sampler stats for %s hours from %s, sequences 0-%s',
+            len(set(hours.tolist())), path, self.max_sequence)
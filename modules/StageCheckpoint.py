@@ -0,0 +1,100 @@
+import datetime, json, os
+import numpy as np
+import pyarrow.parquet as pq
+
+from .ParquetWriterProfile import WRITER_PROFILES
+
+import logging
+logger = logging.getLogger('StageCheckpoint')
+
+
+# Parquet checkpoints of one pipeline run, keyed by input file and hour, so a retried or
+# re-run hour picks up from the last completed stage instead of starting over:
+#   <root>/<input file name>/<hour>/<stage>/part-NNNNN.parquet   chunks, each via tmp file + os.replace
+#   <root>/<input file name>/<hour>/<stage>/_COMPLETE.json         written last: parts, rows, stats
+# A stage with _COMPLETE.json is done; an incomplete one keeps the parts already written,
+# which the stage can read back (column_values, has_part) to skip the work they cover.
+class StageCheckpoint:
+
+    MANIFEST = '_COMPLETE.json'
+
+    def __init__(self, root, input_path, hour, profile='snappy'):
+        self.root = root
+        self.input_name = os.path.splitext(os.path.basename(input_path))[0]
+        self.hour = hour
+        self.folder = os.path.join(root, self.input_name, hour)
+        self.profile = WRITER_PROFILES[profile]
+
+    def __repr__(self):
+        return 'StageCheckpoint(%s)' % self.folder
+
+    def stage_dir(self, stage):
+        return os.path.join(self.folder, stage)
+
+    def is_complete(self, stage):
+        return os.path.exists(os.path.join(self.stage_dir(stage), StageCheckpoint.MANIFEST))
+
+    def manifest(self, stage):
+        if not self.is_complete(stage):
+            return None
+        with open(os.path.join(self.stage_dir(stage), StageCheckpoint.MANIFEST)) as f:
+            return json.load(f)
+
+    # Finished parts of stage, in write order
+    def parts(self, stage):
+        folder = self.stage_dir(stage)
+        if not os.path.isdir(folder):
+            return []
+        return [
+            os.path.join(folder, n) for n in sorted(os.listdir(folder))
+            if n.endswith('.parquet') and not n.startswith('.')
+        ]
+
+    def has_part(self, stage, name):
+        return os.path.exists(os.path.join(self.stage_dir(stage), name))
+
+    # Writes table as part `name` of stage, or as the next part-NNNNN.parquet; returns its path
+    def write_part(self, stage, table, name=None):
+        if self.is_complete(stage):
+            raise ValueError('Checkpoint stage %s/%s is already complete' % (self.folder, stage))
+        folder = self.stage_dir(stage)
+        os.makedirs(folder, exist_ok=True)
+        if name is None:
+            name = 'part-%05d.parquet' % len(self.parts(stage))
+        path = os.path.join(folder, name)
+        tmp_path = os.path.join(folder, '.%s.tmp' % name)
+        self.profile.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        logger.debug('Checkpointed %s rows to %s', table.num_rows, path)
+        return path
+
+    # Distinct values of column across the parts written so far (e.g. ids already hydrated)
+    def column_values(self, stage, column):
+        values = [
+            pq.read_table(path, columns=[column]).column(column).to_numpy()
+            for path in self.parts(stage)
+        ]
+        if len(values) == 0:
+            return np.array([])
+        return np.unique(np.concatenate(values))
+
+    # Marks stage done; later runs skip it. stats: extra counters kept in the manifest
+    def complete(self, stage, **stats):
+        parts = self.parts(stage)
+        manifest = {
+            'input_name': self.input_name,
+            'hour': self.hour,
+            'stage': stage,
+            'parts': [os.path.basename(path) for path in parts],
+            'rows': sum(pq.ParquetFile(path).metadata.num_rows for path in parts),
+            'completed_at': datetime.datetime.utcnow().isoformat()
+        }
+        manifest.update(stats)
+        folder = self.stage_dir(stage)
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = os.path.join(folder, '.%s.tmp' % StageCheckpoint.MANIFEST)
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(folder, StageCheckpoint.MANIFEST))
+        logger.info('Checkpoint %s/%s complete: %s parts, %s rows', self.folder, stage, len(parts), manifest['rows'])
+        return manifest
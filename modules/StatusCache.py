@@ -0,0 +1,73 @@
+import sys, threading
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger('StatusCache')
+
+
+# LRU of flattened embedded statuses (retweeted_status / quoted_status), keyed by the
+# embedded status id, so an original retweeted thousands of times is parsed once per job
+# rather than once per flush. Values are small dicts ({'id', 'created_at', 'user_id'}).
+# Bounded by entry count and by estimated bytes: whichever is hit first evicts the least
+# recently used entries. Thread-safe, as flushes may normalize on several threads.
+class StatusCache:
+
+    MAX_ITEMS = 200000
+    MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, max_items=None, max_bytes=None):
+        self.max_items = StatusCache.MAX_ITEMS if max_items is None else max_items
+        self.max_bytes = StatusCache.MAX_BYTES if max_bytes is None else max_bytes
+        self.lock = threading.Lock()
+        self.__entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def entry_bytes(key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value.values())
+
+    # {key: value} for the keys present (None keys never are); counts a hit or miss per key
+    def get_many(self, keys):
+        out = {}
+        with self.lock:
+            for key in keys:
+                value = None if key is None else self.__entries.get(key)
+                if value is None:
+                    self.misses += 1
+                else:
+                    self.__entries.move_to_end(key)
+                    out[key] = value
+                    self.hits += 1
+        return out
+
+    def put_many(self, items):
+        with self.lock:
+            for key, value in items:
+                if key is None:
+                    continue
+                if key in self.__entries:
+                    self.bytes -= StatusCache.entry_bytes(key, self.__entries.pop(key))
+                self.__entries[key] = value
+                self.bytes += StatusCache.entry_bytes(key, value)
+            while len(self.__entries) > 0 and (len(self.__entries) > self.max_items or self.bytes > self.max_bytes):
+                old_key, old_value = self.__entries.popitem(last=False)
+                self.bytes -= StatusCache.entry_bytes(old_key, old_value)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'items': len(self.__entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0
+            }
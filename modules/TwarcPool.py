@@ -1,11 +1,234 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import logging
+logger = logging.getLogger('TwarcPool')
+
+
+# Estimated quota for one (client, endpoint) over Twitter's 15 minute windows:
+# consumed locally per request, corrected from x-rate-limit-* headers when present
+class TokenBucket:
+
+    WINDOW_S = 15 * 60
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.remaining = limit
+        self.reset_at = 0
+
+    def refill(self, now):
+        if self.reset_at <= now and self.remaining < self.limit:
+            self.remaining = self.limit
+            self.reset_at = 0
+
+    def consume(self, now):
+        self.refill(now)
+        if self.reset_at == 0:
+            self.reset_at = now + TokenBucket.WINDOW_S
+        self.remaining = max(self.remaining - 1, 0)
+
+    def observe(self, limit, remaining, reset_at):
+        if not (limit is None):
+            self.limit = limit
+        self.remaining = remaining
+        self.reset_at = reset_at
+
+    def exhaust(self, reset_at):
+        self.remaining = 0
+        self.reset_at = reset_at
+
+    def headroom(self, now):
+        self.refill(now)
+        return self.remaining / self.limit if self.limit > 0 else 0.0
+
+
 class TwarcPool:
 
+    #requests per 15 minute window per user-auth credential
+    ENDPOINT_LIMITS = {
+        'statuses/lookup': 900,
+        'search/tweets': 180,
+        'statuses/user_timeline': 900
+    }
+
+    #smoothing for the per-client latency average
+    LATENCY_EWMA_ALPHA = 0.2
+
     def __init__(self, pool):
         self.pool = pool
         self.last_idx = 0
-        
-    def next_twarc(self):
-        idx = (self.last_idx + 1) % len(self.pool)
-        self.last_idx = idx
-        t = self.pool[ idx ]
-        return t
\ No newline at end of file
+        self.cond = threading.Condition()
+        self.busy = set()
+        self.buckets = [
+            {endpoint: TokenBucket(limit) for endpoint, limit in TwarcPool.ENDPOINT_LIMITS.items()}
+            for t in pool
+        ]
+        self.health = [
+            {'requests': 0, 'errors': 0, 'consecutive_errors': 0, 'rate_limited': 0, 'latency_s': None}
+            for t in pool
+        ]
+        for idx, t in enumerate(pool):
+            self.__observe_requests(idx, t)
+
+    ###################
+
+    @staticmethod
+    def endpoint_of(url):
+        path = urlparse(url).path
+        parts = path.split('/')
+        #/1.1/statuses/lookup.json -> statuses/lookup
+        return '/'.join(parts[2:]).rsplit('.json', 1)[0] if len(parts) > 2 else path
+
+    #Wrap the client's get/post so every request, including twarc's own paging and
+    #retries, is metered against its bucket and scored for latency/errors
+    def __observe_requests(self, idx, twarc):
+        for method in ['get', 'post']:
+            fn = getattr(twarc, method, None)
+            if not (fn is None):
+                setattr(twarc, method, self.__observed(idx, fn))
+
+    def __observed(self, idx, fn):
+        def observed(url, *args, **kwargs):
+            endpoint = TwarcPool.endpoint_of(url)
+            self.__wait_for_quota(idx, endpoint)
+            tic = time.time()
+            try:
+                resp = fn(url, *args, **kwargs)
+            except Exception as e:
+                self.record_error(idx, endpoint)
+                raise e
+            self.record_response(idx, endpoint, resp, time.time() - tic)
+            return resp
+        return observed
+
+    #A client already bound to a paging call sleeps out its own window rather than hit a 429
+    def __wait_for_quota(self, idx, endpoint):
+        with self.cond:
+            bucket = self.buckets[idx].get(endpoint)
+            if bucket is None:
+                return
+            now = time.time()
+            while bucket.headroom(now) <= 0 and bucket.reset_at > now:
+                wait_s = bucket.reset_at - now
+                logger.info('twarc client %s out of %s quota, sleeping %0.1fs', idx, endpoint, wait_s)
+                self.cond.wait(wait_s)
+                now = time.time()
+            bucket.consume(now)
+
+    def record_response(self, idx, endpoint, resp, latency_s):
+        with self.cond:
+            h = self.health[idx]
+            h['requests'] += 1
+            h['latency_s'] = latency_s if h['latency_s'] is None \
+                else (1 - TwarcPool.LATENCY_EWMA_ALPHA) * h['latency_s'] + TwarcPool.LATENCY_EWMA_ALPHA * latency_s
+            status = getattr(resp, 'status_code', 200)
+            if status == 429 or status >= 500:
+                h['errors'] += 1
+                h['consecutive_errors'] += 1
+            else:
+                h['consecutive_errors'] = 0
+            bucket = self.buckets[idx].get(endpoint)
+            if bucket is None:
+                return
+            headers = getattr(resp, 'headers', {}) or {}
+            try:
+                bucket.observe(
+                    int(headers['x-rate-limit-limit']) if 'x-rate-limit-limit' in headers else None,
+                    int(headers['x-rate-limit-remaining']),
+                    int(headers['x-rate-limit-reset']))
+            except (KeyError, ValueError, TypeError):
+                pass
+            if status == 429:
+                h['rate_limited'] += 1
+                try:
+                    bucket.exhaust(int(headers['x-rate-limit-reset']))
+                except (KeyError, ValueError, TypeError):
+                    bucket.exhaust(time.time() + TokenBucket.WINDOW_S)
+            self.cond.notify_all()
+
+    def record_error(self, idx, endpoint):
+        with self.cond:
+            h = self.health[idx]
+            h['requests'] += 1
+            h['errors'] += 1
+            h['consecutive_errors'] += 1
+
+    ###################
+
+    # Quota headroom discounted by recent failures and slowness; 0 when drained
+    def score(self, idx, endpoint, now=None):
+        now = time.time() if now is None else now
+        bucket = self.buckets[idx].get(endpoint)
+        headroom = 1.0 if bucket is None else bucket.headroom(now)
+        h = self.health[idx]
+        latency_s = 1.0 if h['latency_s'] is None else h['latency_s']
+        return headroom / (1 + h['consecutive_errors']) / (1 + latency_s)
+
+    # Index of the best-scoring candidate, or the earliest reset to wait for when all are drained
+    def __best(self, endpoint, candidates):
+        now = time.time()
+        best_idx = None
+        best_score = 0
+        for k in range(1, len(self.pool) + 1):
+            idx = (self.last_idx + k) % len(self.pool)
+            if idx in candidates:
+                score = self.score(idx, endpoint, now)
+                if score > best_score:
+                    best_idx, best_score = idx, score
+        if not (best_idx is None):
+            return best_idx, None
+        resets = [self.buckets[idx][endpoint].reset_at for idx in candidates if endpoint in self.buckets[idx]]
+        return None, (max(min(resets) - now, 0.1) if len(resets) > 0 else None)
+
+    def next_twarc(self, endpoint='statuses/lookup'):
+        with self.cond:
+            while True:
+                idx, wait_s = self.__best(endpoint, set(range(len(self.pool))))
+                if not (idx is None):
+                    self.last_idx = idx
+                    return self.pool[idx]
+                logger.info('All twarc clients out of %s quota, waiting %0.1fs', endpoint, wait_s)
+                self.cond.wait(wait_s)
+
+    # For concurrent use: blocks until some idle client has quota for endpoint,
+    # picking the one with most headroom; pair with release(idx)
+    def acquire(self, endpoint='statuses/lookup'):
+        with self.cond:
+            while True:
+                idle = set(range(len(self.pool))) - self.busy
+                idx, wait_s = self.__best(endpoint, idle)
+                if not (idx is None):
+                    self.last_idx = idx
+                    self.busy.add(idx)
+                    return idx, self.pool[idx]
+                if len(idle) > 0:
+                    logger.info('All idle twarc clients out of %s quota, waiting %0.1fs', endpoint, wait_s)
+                self.cond.wait(wait_s)
+
+    def release(self, idx):
+        with self.cond:
+            self.busy.discard(idx)
+            self.cond.notify_all()
+
+    # Per-client quota + health snapshot, e.g. for logging utilization from a flow
+    def stats(self):
+        with self.cond:
+            now = time.time()
+            return [
+                {
+                    'idx': idx,
+                    'busy': idx in self.busy,
+                    **{k: v for k, v in self.health[idx].items()},
+                    'endpoints': {
+                        endpoint: {
+                            'limit': bucket.limit,
+                            'remaining': bucket.remaining,
+                            'reset_in_s': max(bucket.reset_at - now, 0),
+                            'utilization': 1 - bucket.headroom(now)
+                        }
+                        for endpoint, bucket in self.buckets[idx].items()
+                    }
+                }
+                for idx in range(len(self.pool))
+            ]
@@ -1,16 +1,35 @@
 from prefect import Flow, Client, task
 from prefect.tasks.shell import ShellTask
-import arrow, ast, graphistry, json, os, pprint
+import arrow, graphistry, json, os, pprint
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 from modules.FirehoseJob import FirehoseJob
+from modules.DfHelper import DfHelper
+from modules.RecordBatchBuffer import RecordBatchBuffer
+from modules.StageCheckpoint import StageCheckpoint
+from modules.StatusCache import StatusCache
 from datetime import timedelta, datetime
 from prefect.schedules import IntervalSchedule
 import prefect
 from prefect.engine.signals import ENDRUN
 from prefect.engine.state import Skipped
 
+# Each run streams one hourly id file through hydrate -> normalize, checkpointing every
+# chunk as parquet under CHECKPOINT_ROOT/<id file>/<hour>/<stage>/ (see StageCheckpoint):
+# a retried task or a re-run of the same hour skips completed stages, and an interrupted
+# stage continues after the parts it already wrote instead of rehydrating from scratch
+CHECKPOINT_ROOT = 'pipeline_checkpoints'
+# hydrated tweets per checkpoint part (one part -> one normalized part)
+PART_ROWS = 5000
+
+def run_timestamp():
+    if 'backfill_timestamp' in prefect.context:
+        return arrow.get(prefect.context['backfill_timestamp'])
+    return prefect.context['scheduled_start_time']
+
 @task(log_stdout=True, skip_on_upstream_skip=True)
 def load_creds():
     with open('twittercreds.json') as json_file:
@@ -22,11 +41,7 @@ def load_creds():
 def load_path():
     data_dirs = ['COVID-19-TweetIDs/2020-01', 'COVID-19-TweetIDs/2020-02', 'COVID-19-TweetIDs/2020-03']
 
-    timestamp = None
-    if 'backfill_timestamp' in prefect.context:
-        timestamp = arrow.get(prefect.context['backfill_timestamp'])
-    else:
-        timestamp = prefect.context['scheduled_start_time']
+    timestamp = run_timestamp()
     print('TIMESTAMP = ', timestamp)
     suffix = timestamp.strftime('%Y-%m-%d-%H')
 
@@ -42,131 +57,77 @@ def load_path():
     raise ENDRUN(state=Skipped())
 
 @task(log_stdout=True, skip_on_upstream_skip=True)
-def clean_timeline_tweets(pdf):
-    return pdf.rename(columns={'id': 'status_id', 'id_str': 'status_id_str'})
-
-@task(log_stdout=True, skip_on_upstream_skip=True)
-def clean_datetimes(pdf):
-    print('cleaning datetimes...')
-    pdf = pdf.assign(created_at=pd.to_datetime(pdf['created_at']))
-    pdf = pdf.assign(created_date=pdf['created_at'].apply(lambda dt: dt.timestamp()))
-    print('   ...cleaned')
-    return pdf
-
-#some reason always False
-#this seems to match full_text[:2] == 'RT'
-@task(log_stdout=True, skip_on_upstream_skip=True)
-def clean_retweeted(pdf):
-    return pdf.assign(retweeted=pdf['retweeted_status'] != 'None')
-
-def update_to_type(row):
-    if row['is_quote_status']:
-        return 'retweet_quote'
-    if row['retweeted']:
-        return 'retweet'
-    if row['in_reply_to_status_id'] is not None and row['in_reply_to_status_id'] > 0:
-        return 'reply'
-    return 'original'
-
-@task(log_stdout=True, skip_on_upstream_skip=True)
-def tag_status_type(pdf):
-    ##only materialize required fields..
-    print('tagging status...')
-    pdf2 = pdf\
-        .assign(status_type=pdf[['is_quote_status', 'retweeted', 'in_reply_to_status_id']].apply(update_to_type, axis=1))
-    print('   ...tagged')
-    return pdf2
-
-def try_load(s):
-    try:
-        out = ast.literal_eval(s)
-        return {
-            k if type(k) == str else str(k): out[k]
-            for k in out.keys()
-        }
-    except:
-        if s != 0.0:
-            print('bad s', s)
-        return {}
-
-def flatten_status_col(pdf, col, status_type, prefix):
-    print('flattening %s...' % col)
-    print('    ', pdf.columns)
-    #retweet_status -> hash -> lookup json for hash -> pull out id/created_at/user_id
-    pdf_hashed = pdf.assign(hashed=pdf[col].apply(hash))
-    retweets = pdf_hashed[ pdf_hashed['status_type'] == status_type ][['hashed', col]]\
-        .drop_duplicates('hashed').reset_index(drop=True)
-    retweets_flattened = pd.io.json.json_normalize(
-        retweets[col].replace("(").replace(")")\
-            .apply(try_load))
-    print('   ... fixing dates')
-    created_at_datetime = pd.to_datetime(retweets_flattened['created_at'])
-    created_at = np.full_like(created_at_datetime, np.nan, dtype=np.float64)
-    created_at[created_at_datetime.notnull()] = created_at_datetime[created_at_datetime.notnull()].apply(lambda dt: dt.timestamp())
-    retweets_flattened = retweets_flattened.assign(
-        created_at = created_at,
-        user_id = retweets_flattened['user.id'])
-    retweets = retweets[['hashed']]\
-        .assign(**{
-            prefix + c: retweets_flattened[c]
-            for c in retweets_flattened if c in ['id', 'created_at', 'user_id']
-        })
-    print('   ... remerging')
-    pdf_with_flat_retweets = pdf_hashed.merge(retweets, on='hashed', how='left').drop(columns='hashed')
-    print('   ...flattened', pdf_with_flat_retweets.shape)
-    return pdf_with_flat_retweets
-
-@task(log_stdout=True, skip_on_upstream_skip=True)
-def flatten_retweets(pdf):
-    print('flattening retweets...')
-    pdf2 = flatten_status_col(pdf, 'retweeted_status', 'retweet', 'retweet_')
-    print('   ...flattened', pdf2.shape)
-    return pdf2
-
-@task(log_stdout=True, skip_on_upstream_skip=True)
-def flatten_quotes(pdf):
-    print('flattening quotes...')
-    pdf2 = flatten_status_col(pdf, 'quoted_status', 'retweet_quote', 'quote_')
-    print('   ...flattened', pdf2.shape)
-    return pdf2
-
-@task(log_stdout=True, skip_on_upstream_skip=True)
-def flatten_users(pdf):
-    print('flattening users')
-    pdf_user_cols = pd.io.json.json_normalize(pdf['user'].replace("(").replace(")").apply(ast.literal_eval))
-    pdf2 = pdf.assign(**{
-        'user_' + c: pdf_user_cols[c]
-        for c in pdf_user_cols if c in [
-            'id', 'screen_name', 'created_at', 'followers_count', 'friends_count', 'favourites_count',
-            'utc_offset', 'time_zone', 'verified', 'statuses_count', 'profile_image_url',
-            'name', 'description'
-        ]})
-    print('   ... fixing dates')
-    pdf2 = pdf2.assign(user_created_at=pd.to_datetime(pdf2['user_created_at']).apply(lambda dt: dt.timestamp()))
-    print('   ...flattened')
-    return pdf2
-
-@task(log_stdout=True, skip_on_upstream_skip=True)
-def load_tweets(creds, path):
-    print(path)
-    fh = FirehoseJob(creds, PARQUET_SAMPLE_RATE_TIME_S=30, save_to_neo=prefect.context.get('save_to_neo', False))
-    cnt = 0
-    data = []
-    for arr in fh.process_id_file(path, job_name="500m_COVID-REHYDRATE"):
-        data.append(arr.to_pandas())
-        print('{}/{}'.format(len(data), len(arr)))
-        cnt += len(arr)
-        print('TOTAL: ' + str(cnt))
-    data = pd.concat(data, ignore_index=True, sort=False)
-    if len(data) == 0:
+def load_checkpoint(path):
+    checkpoint = StageCheckpoint(
+        prefect.context.get('checkpoint_root', CHECKPOINT_ROOT), path, run_timestamp().strftime('%Y-%m-%d-%H'))
+    print(checkpoint)
+    return checkpoint
+
+# Hydrated tweets, PART_ROWS per part; a retry only asks for the ids no part holds yet
+@task(log_stdout=True, skip_on_upstream_skip=True, max_retries=3, retry_delay=timedelta(minutes=5))
+def load_tweets(creds, path, checkpoint):
+    stage = 'hydrated'
+    if not checkpoint.is_complete(stage):
+        ids = FirehoseJob.read_id_file(path)
+        done_ids = checkpoint.column_values(stage, 'id')
+        if len(done_ids) > 0:
+            ids = [i for i, done in zip(ids, np.isin(np.array(ids, dtype=np.int64), done_ids)) if not done]
+            print('resuming: {} ids already hydrated, {} to go'.format(len(done_ids), len(ids)))
+        job_name = "500m_COVID-REHYDRATE"
+        fh = FirehoseJob(creds, PARQUET_SAMPLE_RATE_TIME_S=30, save_to_neo=prefect.context.get('save_to_neo', False))
+        buffer = RecordBatchBuffer()
+        cnt = 0
+        try:
+            for arr in fh.process_ids(ids, job_name=job_name):
+                if arr is None or len(arr) == 0:
+                    continue
+                buffer.append(arr)
+                cnt += len(arr)
+                print('TOTAL: ' + str(cnt))
+                if buffer.num_rows >= PART_ROWS:
+                    checkpoint.write_part(stage, buffer.to_table())
+                    buffer.clear()
+        finally:
+            #flush and close the firehose_data writers now, not whenever __del__ runs
+            fh.destroy(job_name)
+        if not buffer.is_empty():
+            checkpoint.write_part(stage, buffer.to_table())
+        checkpoint.complete(stage)
+    rows = checkpoint.manifest(stage)['rows']
+    print('hydrated: {} tweets'.format(rows))
+    if rows == 0:
         raise ENDRUN(state=Skipped())
-    return data
+    return checkpoint
+
+# DfHelper.normalize_parquet_dataframe per hydrated part, written under the same part name
+@task(log_stdout=True, skip_on_upstream_skip=True, max_retries=3, retry_delay=timedelta(minutes=1))
+def normalize_tweets(checkpoint):
+    stage = 'normalized'
+    if not checkpoint.is_complete(stage):
+        helper = DfHelper(StatusCache())
+        for part in checkpoint.parts('hydrated'):
+            name = os.path.basename(part)
+            if checkpoint.has_part(stage, name):
+                continue
+            print('normalizing {}...'.format(name))
+            tables = [
+                pa.Table.from_pandas(pdf, preserve_index=False)
+                for pdf in helper.iter_normalized_parquet(part, columns=pq.ParquetFile(part).schema_arrow.names)
+            ]
+            if len(tables) > 0:
+                checkpoint.write_part(stage, pa.concat_tables(tables, promote=True), name)
+        checkpoint.complete(stage)
+    print('normalized: {} tweets'.format(checkpoint.manifest(stage)['rows']))
+    return checkpoint
 
 @task(log_stdout=True, skip_on_upstream_skip=True)
-def sample(tweets):
-    print('responses shape', tweets.shape)
+def sample(checkpoint):
+    parts = checkpoint.parts('normalized')
+    print('normalized parts', len(parts), checkpoint.manifest('normalized'))
+    tweets = DfHelper.table_to_pandas(pq.read_table(parts[0]))
+    print('first part shape', tweets.shape)
     print(tweets.columns)
-    print(tweets.sample(5))
+    print(tweets.sample(min(5, len(tweets))))
 
 schedule = IntervalSchedule(
     # start_date=datetime(2020, 1, 20),
@@ -179,16 +140,11 @@ schedule = IntervalSchedule(
 with Flow("Rehydration Pipeline") as flow:
     creds = load_creds()
     path_list = load_path()
-    tweets = load_tweets(creds, path_list)
-    tweets = clean_timeline_tweets(tweets)
-    tweets = clean_datetimes(tweets)
-    tweets = clean_retweeted(tweets)
-    tweets = tag_status_type(tweets)
-    tweets = flatten_retweets(tweets)
-    tweets = flatten_quotes(tweets)
-    tweets = flatten_users(tweets)
+    checkpoint = load_checkpoint(path_list)
+    hydrated = load_tweets(creds, path_list, checkpoint)
+    normalized = normalize_tweets(hydrated)
 
-    sample(tweets)
+    sample(normalized)
 
 LOCAL_MODE = False
 
@@ -14,12 +14,11 @@ pd.set_option('display.max_columns', 500)
 pd.set_option('display.max_colwidth', None)
 
 
-# Test save_parquet_df_to_graph
+# Test save_parquet_file_to_graph (streams the file in chunks)
 print('----')
 print('Testing Parquet Save')
-tdf = pd.read_parquet(
-    './data/2020_03_22_02_b1.snappy2.parquet', engine='pyarrow')
-Neo4jDataAccess().save_parquet_df_to_graph(tdf, 'dave')
+Neo4jDataAccess().save_parquet_file_to_graph(
+    './data/2020_03_22_02_b1.snappy2.parquet', 'dave')
 print('----')
 
 # Test get_tweet_hydrated_status_by_id
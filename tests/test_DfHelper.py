@@ -0,0 +1,107 @@
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from modules.DfHelper import DfHelper
+from modules.Neo4jDataAccess import Neo4jDataAccess
+from modules.StatusCache import StatusCache
+
+# Real snowflakes above 2^53: float64 would round the first to ...664
+ORIGINAL_ID = 1240108746791153674
+QUOTED_ID = 1240108746791153675
+USER_ID = 1240108000000000001
+
+
+def status(tid, user_id=USER_ID, **fields):
+    return {
+        'created_at': 'Wed Mar 18 03:22:15 +0000 2020',
+        'id': tid,
+        'full_text': 'tweet %s' % tid,
+        'user': {'id': user_id, 'screen_name': 'u%s' % user_id, 'name': 'n', 'location': 'Earth',
+                 'created_at': 'Wed Mar 18 03:22:15 +0000 2020', 'followers_count': 1, 'friends_count': 2,
+                 'profile_image_url': 'http://pbs.twimg.com/x.jpg'},
+        'entities': {'urls': [], 'hashtags': [], 'user_mentions': []},
+        **fields
+    }
+
+
+def raw_df():
+    tweets = [
+        status(ORIGINAL_ID + 4096),
+        status(ORIGINAL_ID + 8192, retweeted_status=status(ORIGINAL_ID)),
+        status(ORIGINAL_ID + 12288, is_quote_status=True, quoted_status_id=QUOTED_ID,
+               quoted_status=status(QUOTED_ID)),
+        status(ORIGINAL_ID + 16384, retweeted_status=status(ORIGINAL_ID)),
+    ]
+    return pd.DataFrame({
+        'id': [t['id'] for t in tweets],
+        'created_at': [t['created_at'] for t in tweets],
+        'full_text': [t['full_text'] for t in tweets],
+        'favorite_count': 0,
+        'retweet_count': 0,
+        'in_reply_to_status_id': 0,
+        'quoted_status_id': [t.get('quoted_status_id', 0) for t in tweets],
+        'is_quote_status': [t.get('is_quote_status', False) for t in tweets],
+        'retweeted_status': [json.dumps(t['retweeted_status']) if 'retweeted_status' in t else None for t in tweets],
+        'quoted_status': [json.dumps(t['quoted_status']) if 'quoted_status' in t else None for t in tweets],
+        'user': [json.dumps(t['user']) for t in tweets],
+        'entities': [json.dumps(t['entities']) for t in tweets],
+    })
+
+
+@pytest.mark.parametrize('status_cache', [None, StatusCache()])
+def test_embedded_snowflakes_stay_exact(status_cache):
+    for _ in range(2):
+        df = DfHelper(status_cache).normalize_parquet_dataframe(raw_df())
+        assert df['retweet_id'].dtype == 'Int64'
+        assert df['retweet_id'].tolist() == [pd.NA, ORIGINAL_ID, pd.NA, ORIGINAL_ID]
+        assert df['quote_id'].tolist() == [pd.NA, pd.NA, QUOTED_ID, pd.NA]
+        assert df['retweet_user_id'].tolist()[1] == USER_ID
+        assert df['user_id'].tolist() == [USER_ID] * 4
+
+
+def test_graph_params_reference_exact_ids():
+    df = DfHelper().normalize_parquet_dataframe(raw_df())
+    referenced = Neo4jDataAccess().df_to_graph_params(df, 'test')['referenced']
+    assert [r['ref_id'] for r in referenced['RETWEET']] == [ORIGINAL_ID, ORIGINAL_ID]
+    assert [r['ref_id'] for r in referenced['QUOTE_RETWEET']] == [QUOTED_ID]
+    assert all(type(r['ref_id']) == int for rows in referenced.values() for r in rows)
+
+
+def test_table_to_pandas_keeps_nullable_int64_exact():
+    table = pa.table({'retweet_id': pa.array([ORIGINAL_ID, None], pa.int64())})
+    assert DfHelper.table_to_pandas(table)['retweet_id'].tolist() == [ORIGINAL_ID, pd.NA]
+
+
+@pytest.mark.parametrize('status_cache', [None, StatusCache()])
+def test_partially_missing_embedded_ids_stay_exact(status_cache):
+    no_user = status(QUOTED_ID)
+    del no_user['user']
+    df = raw_df().iloc[:2]
+    df = pd.concat([df, df.assign(id=df['id'] + 1, retweeted_status=[None, json.dumps(no_user)])], ignore_index=True)
+    out = DfHelper(status_cache).normalize_parquet_dataframe(df)
+    assert out['retweet_id'].tolist() == [pd.NA, ORIGINAL_ID, pd.NA, QUOTED_ID]
+    assert out['retweet_user_id'].tolist() == [pd.NA, USER_ID, pd.NA, pd.NA]
+
+
+def test_parquet_files_reads_one_writer_copy_per_flush(tmp_path):
+    job = tmp_path / 'job'
+    job.mkdir()
+    names = ['2020_03_18_03_b1.snappy2.parquet', '2020_03_18_03_b1.vanilla2.parquet',
+             '2020_03_18_03_b2.snappy2.parquet', 'extra.parquet']
+    for name in names:
+        (job / name).write_bytes(b'')
+    assert [p.split('/')[-1] for p in DfHelper.parquet_files(str(job))] == \
+        ['2020_03_18_03_b1.vanilla2.parquet', '2020_03_18_03_b2.snappy2.parquet', 'extra.parquet']
+    assert [p.split('/')[-1] for p in DfHelper.parquet_files(str(job), 'snappy')] == \
+        ['2020_03_18_03_b1.snappy2.parquet', '2020_03_18_03_b2.snappy2.parquet', 'extra.parquet']
+
+
+def test_iter_normalized_parquet_skips_duplicate_writer_copies(tmp_path):
+    table = pa.Table.from_pandas(raw_df(), preserve_index=False)
+    for name in ['2020_03_18_03_b1.snappy2.parquet', '2020_03_18_03_b1.vanilla2.parquet']:
+        pq.write_table(table, str(tmp_path / name))
+    rows = sum(len(pdf) for pdf in DfHelper().iter_normalized_parquet(str(tmp_path)))
+    assert rows == table.num_rows
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from modules.DfHelper import DfHelper
+from modules.FieldExtractor import FieldExtractor
+
+BIG_ID = 1240108746791153674
+
+RECORDS = [
+    {'id': 1, 'created_at': 'a', 'user': {'id': 10, 'screen_name': 'x'}, 'urls': []},
+    {'id': 2, 'user': {'id': 20}, 'hashtags': [{'text': 'covid19'}]},
+    {'id': 3, 'created_at': 'c', 'user': None},
+    {},
+]
+
+
+def test_matches_json_normalize_projection():
+    paths = ['id', 'created_at', 'user.id', 'user.screen_name', 'urls', 'hashtags']
+    wide = pd.json_normalize(RECORDS)
+    narrow = FieldExtractor(paths).extract(RECORDS)
+    assert list(narrow.columns) == paths
+    pd.testing.assert_frame_equal(narrow, wide[paths])
+
+
+def test_missing_paths_dropped_unless_keep_missing():
+    assert list(FieldExtractor(['id', 'user_mentions']).extract(RECORDS).columns) == ['id']
+    kept = FieldExtractor(['id', 'user_mentions'], keep_missing=True).extract(RECORDS)
+    assert list(kept.columns) == ['id', 'user_mentions']
+    assert kept['user_mentions'].isnull().all()
+
+
+def test_non_dict_records_and_parents_read_as_missing():
+    df = FieldExtractor(['user.id']).extract([None, 'x', {'user': 'x'}, {'user': {'id': 5}}])
+    assert np.isnan(df['user.id'].tolist()[:3]).all()
+    assert df['user.id'].tolist()[3] == 5
+
+
+def test_int64_dtype_keeps_padded_snowflakes_exact():
+    records = [{'id': BIG_ID}, {}, {'id': BIG_ID + 1}]
+    assert FieldExtractor(['id']).extract(records)['id'].tolist()[0] != BIG_ID
+    exact = FieldExtractor(['id'], dtypes={'id': 'Int64'}).extract(records, index=pd.Index([7, 8, 9]))
+    assert exact['id'].tolist() == [BIG_ID, pd.NA, BIG_ID + 1]
+    assert list(exact.index) == [7, 8, 9]
+
+
+def test_dfhelper_field_sets_match_json_normalize():
+    users = [r['user'] for r in RECORDS if isinstance(r.get('user'), dict)]
+    narrow = DfHelper.USER_FIELDS.extract(users)
+    wide = pd.json_normalize(users)
+    pd.testing.assert_frame_equal(narrow, wide[list(narrow.columns)], check_dtype=False)
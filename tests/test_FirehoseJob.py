@@ -0,0 +1,111 @@
+import pyarrow as pa
+import numpy as np
+import pytest
+
+from modules.FirehoseJob import FirehoseJob
+from tests.test_DfHelper import ORIGINAL_ID, QUOTED_ID, status
+
+
+def tweet(tid, **fields):
+    return status(tid, **{
+        'in_reply_to_status_id': None, 'in_reply_to_user_id': None, 'favorited': False, 'retweeted': False,
+        'truncated': False, 'is_quote_status': False, 'contributors': None, **fields})
+
+
+def test_pandas_path_keeps_partially_null_ids_exact():
+    tweets = [
+        tweet(ORIGINAL_ID + 4096, in_reply_to_status_id=ORIGINAL_ID, quoted_status_id=None),
+        tweet(ORIGINAL_ID + 8192, in_reply_to_status_id=None, quoted_status_id=QUOTED_ID),
+    ]
+    fh = FirehoseJob(writers={})
+    df = fh.clean_df(fh.tweets_to_df(tweets))
+    assert df['in_reply_to_status_id'].tolist() == [ORIGINAL_ID, 0]
+    assert df['quoted_status_id'].tolist() == [0, QUOTED_ID]
+
+
+def flush_one(fh, tid, neo4j_error=None, parquet_error=None):
+    def flush_neo4j(table, job_name):
+        if not (neo4j_error is None):
+            raise neo4j_error
+    fh.flush_neo4j = flush_neo4j
+    if not (parquet_error is None):
+        def flush_parquet(table, job_name):
+            raise parquet_error
+        fh.flush_parquet = flush_parquet
+    fh.buffer.append(pa.table({'id': pa.array([tid], pa.int64())}))
+    fh.flush('test')
+    fh.drain_flushes()
+
+
+@pytest.mark.parametrize('async_flush', [False, True])
+def test_ids_recorded_only_after_neo4j_write(tmp_path, monkeypatch, async_flush):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / 'ids.npy')
+    fh = FirehoseJob(writers={}, save_to_neo=True, async_flush=async_flush, hydrated_cache_path=path)
+    with pytest.raises(RuntimeError):
+        flush_one(fh, ORIGINAL_ID, RuntimeError('neo4j down'))
+    assert fh.hydrated_cache.contains([ORIGINAL_ID]).tolist() == [False]
+
+    fh = FirehoseJob(writers={}, save_to_neo=True, async_flush=async_flush, hydrated_cache_path=path)
+    flush_one(fh, QUOTED_ID)
+    assert fh.hydrated_cache.contains([ORIGINAL_ID, QUOTED_ID]).tolist() == [False, True]
+
+
+@pytest.mark.parametrize('async_flush', [False, True])
+def test_ids_not_recorded_when_parquet_write_fails(tmp_path, async_flush):
+    fh = FirehoseJob(writers={}, save_to_neo=True, async_flush=async_flush,
+                     hydrated_cache_path=str(tmp_path / 'ids.npy'))
+    with pytest.raises(OSError):
+        flush_one(fh, ORIGINAL_ID, parquet_error=OSError('disk full'))
+    assert fh.hydrated_cache.contains([ORIGINAL_ID]).tolist() == [False]
+
+
+def test_ids_recorded_after_parquet_without_neo4j(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fh = FirehoseJob(writers={}, hydrated_cache_path=str(tmp_path / 'ids.npy'))
+    fh.buffer.append(pa.table({'id': pa.array([ORIGINAL_ID], pa.int64())}))
+    fh.flush('test')
+    assert fh.hydrated_cache.contains([ORIGINAL_ID]).tolist() == [True]
+
+
+class FakeTwarc:
+    def __init__(self, tweets):
+        self.tweets = tweets
+        self.requested = []
+
+    def next_twarc(self, endpoint):
+        return self
+
+    def hydrate(self, ids):
+        self.requested.extend(ids)
+        return (self.tweets[i] for i in ids if i in self.tweets)
+
+
+class FakeDataAccess:
+    def get_tweet_hydrated_status_by_id(self, df):
+        return df.assign(hydrated=None)
+
+
+class FakeSampler:
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.recorded = []
+
+    def id_blocks(self, begin, end, block_size):
+        return iter(self.blocks)
+
+    def record(self, probed_ids, hit_ids):
+        self.recorded.append((list(probed_ids), sorted(np.asarray(hit_ids).tolist())))
+
+
+def test_ingest_range_counts_known_ids_as_sampler_hits(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    known, fetched, empty = ORIGINAL_ID, ORIGINAL_ID + 4096, ORIGINAL_ID + 8192
+    fh = FirehoseJob(writers={}, hydrated_cache_path=str(tmp_path / 'ids.npy'))
+    fh.hydrated_cache.add([known])
+    fh.twarc_pool = FakeTwarc({fetched: tweet(fetched)})
+    fh.neo4j_data_access = lambda: FakeDataAccess()
+    sampler = FakeSampler([np.array([known, fetched, empty], dtype=np.int64)])
+    list(fh.ingest_range(0, 1, job_name='test', sampler=sampler))
+    assert fh.twarc_pool.requested == [fetched, empty]
+    assert sampler.recorded == [([known, fetched, empty], [known, fetched])]
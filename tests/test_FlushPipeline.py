@@ -0,0 +1,76 @@
+import threading
+import pyarrow as pa
+import pytest
+
+from modules.FirehoseJob import FirehoseJob
+from modules.FlushPipeline import FlushPipeline
+
+
+def test_every_stage_sees_every_item_in_order():
+    seen = {'a': [], 'b': []}
+    pipeline = FlushPipeline([(name, seen[name].append) for name in seen])
+    for i in range(10):
+        pipeline.submit(i)
+    pipeline.wait()
+    assert seen == {'a': list(range(10)), 'b': list(range(10))}
+    pipeline.close()
+
+
+def test_stage_error_is_raised_and_later_items_skipped():
+    ran = []
+
+    def stage(i):
+        if i == 1:
+            raise ValueError('write failed')
+        ran.append(i)
+    pipeline = FlushPipeline([('parquet', stage)])
+    pipeline.submit(0)
+    pipeline.submit(1)
+    with pytest.raises(ValueError):
+        pipeline.wait()
+    with pytest.raises(ValueError):
+        pipeline.submit(2)
+    with pytest.raises(ValueError):
+        pipeline.close()
+    assert ran == [0]
+    assert [stage_name for stage_name, e in pipeline.errors] == ['parquet']
+
+
+def test_completed_counts_items_every_stage_finished():
+    release = threading.Event()
+    pipeline = FlushPipeline([('fast', lambda i: None), ('slow', lambda i: release.wait(5))], max_queue_size=5)
+    for i in range(3):
+        pipeline.submit(i)
+    assert pipeline.completed() == 0
+    release.set()
+    pipeline.wait()
+    assert pipeline.completed() == 3
+    pipeline.close()
+
+
+def test_submit_blocks_when_a_stage_falls_behind():
+    release = threading.Event()
+    pipeline = FlushPipeline([('slow', lambda i: release.wait())], max_queue_size=1)
+    pipeline.submit(0)
+    pipeline.submit(1)
+    submitted = threading.Event()
+    producer = threading.Thread(target=lambda: (pipeline.submit(2), submitted.set()))
+    producer.start()
+    assert not submitted.wait(0.2)
+    release.set()
+    assert submitted.wait(5)
+    producer.join()
+    pipeline.close()
+
+
+def test_firehose_wait_for_flushes_reraises_background_errors():
+    fh = FirehoseJob(writers={}, async_flush=True)
+    def flush_parquet(table, job_name):
+        raise IOError('disk full')
+    fh.flush_parquet = flush_parquet
+    fh.buffer.append(pa.table({'id': pa.array([1], pa.int64())}))
+    fh.flush('test')
+    with pytest.raises(IOError):
+        fh.wait_for_flushes()
+    with pytest.raises(IOError):
+        fh.check_flushes()
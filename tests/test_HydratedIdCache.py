@@ -0,0 +1,36 @@
+import os
+import numpy as np
+
+from modules.HydratedIdCache import HydratedIdCache
+
+BIG_ID = 1240108746791153674
+
+
+def test_contains_after_add(tmp_path):
+    cache = HydratedIdCache(str(tmp_path / 'ids.npy'))
+    cache.add([BIG_ID, 5, 5])
+    assert cache.contains([5, BIG_ID, BIG_ID + 1, 0]).tolist() == [True, True, False, False]
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_log_persists_across_instances(tmp_path):
+    path = str(tmp_path / 'ids.npy')
+    HydratedIdCache(path).add([BIG_ID, 7])
+    assert os.path.exists(path + '.log') and not os.path.exists(path)
+    assert HydratedIdCache(path).contains([7, BIG_ID, 8]).tolist() == [True, True, False]
+
+
+def test_compaction_merges_log_into_sorted_base(tmp_path):
+    path = str(tmp_path / 'ids.npy')
+    cache = HydratedIdCache(path, compact_every=3)
+    cache.add([30, 10])
+    cache.add([10])
+    assert not os.path.exists(path)
+    cache.add([BIG_ID, 20])
+    assert os.path.exists(path) and not os.path.exists(path + '.log')
+    assert np.load(path).tolist() == [10, 20, 30, BIG_ID]
+    cache.add([40])
+    reopened = HydratedIdCache(path, compact_every=3)
+    assert reopened.contains([10, 20, 30, 40, BIG_ID, 50]).tolist() == [True] * 5 + [False]
+    assert len(reopened) == 5
@@ -0,0 +1,165 @@
+import json
+import threading
+import numpy as np
+import pytest
+
+from modules.FirehoseJob import FirehoseJob
+from modules.IngestCheckpoint import IngestCheckpoint
+from modules.Snowflake import Snowflake
+from modules.SnowflakeSampler import SnowflakeSampler
+from tests.test_FirehoseJob import FakeDataAccess, FakeTwarc, tweet
+
+BEGIN, END = 1584500000000, 1584500000010
+
+
+def advance(checkpoint, next_ms, tweets):
+    checkpoint.advance(next_ms=next_ms, last_id=1240108746791153674, epoch_ms=next_ms - 1,
+                       machine_id=1, sequence_id=0, ids=100, tweets=tweets, flushes=1)
+
+
+def test_new_checkpoint_starts_at_begin(tmp_path):
+    checkpoint = IngestCheckpoint(str(tmp_path / 'cp.json'), 'job', BEGIN, END)
+    assert checkpoint.next_ms == BEGIN
+    assert not checkpoint.is_complete()
+
+
+def test_resumes_with_running_totals(tmp_path):
+    path = str(tmp_path / 'nested' / 'cp.json')
+    advance(IngestCheckpoint(path, 'job', BEGIN, END), BEGIN + 4, tweets=7)
+
+    resumed = IngestCheckpoint(path, 'job', BEGIN, END)
+    assert resumed.next_ms == BEGIN + 4
+    assert resumed.state['last_id'] == 1240108746791153674
+    advance(resumed, END, tweets=3)
+
+    saved = json.load(open(path))
+    assert (saved['blocks'], saved['ids'], saved['tweets'], saved['flushes']) == (2, 200, 10, 2)
+    assert IngestCheckpoint(path, 'job', BEGIN, END).is_complete()
+
+
+@pytest.mark.parametrize('job_name, end, sequence_ids', [
+    ('other job', END, (0,)),
+    ('job', END + 1, (0,)),
+    ('job', END, (0, 1)),
+])
+def test_rejects_checkpoint_of_another_scan(tmp_path, job_name, end, sequence_ids):
+    path = str(tmp_path / 'cp.json')
+    advance(IngestCheckpoint(path, 'job', BEGIN, END), BEGIN + 4, tweets=7)
+    with pytest.raises(ValueError):
+        IngestCheckpoint(path, job_name, BEGIN, end, sequence_ids)
+
+
+def test_sampled_and_fixed_scans_do_not_share_a_checkpoint(tmp_path):
+    path = str(tmp_path / 'cp.json')
+    advance(IngestCheckpoint(path, 'job', BEGIN, END), BEGIN + 4, tweets=7)
+    with pytest.raises(ValueError):
+        IngestCheckpoint(path, 'job', BEGIN, END, sampled=True)
+
+    saved = json.load(open(path))
+    del saved['sampled']
+    json.dump(saved, open(path, 'w'))
+    assert IngestCheckpoint(path, 'job', BEGIN, END).next_ms == BEGIN + 4
+
+
+def test_crash_mid_write_keeps_previous_checkpoint(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cp.json')
+    checkpoint = IngestCheckpoint(path, 'job', BEGIN, END)
+    advance(checkpoint, BEGIN + 4, tweets=7)
+
+    def failing_dump(*args, **kwargs):
+        raise IOError('disk full')
+    monkeypatch.setattr(json, 'dump', failing_dump)
+    with pytest.raises(IOError):
+        advance(checkpoint, BEGIN + 8, tweets=1)
+    monkeypatch.undo()
+    assert IngestCheckpoint(path, 'job', BEGIN, END).next_ms == BEGIN + 4
+
+
+class CrashingTwarc(FakeTwarc):
+    def __init__(self, crash_after, tweets=None):
+        FakeTwarc.__init__(self, {} if tweets is None else tweets)
+        self.crash_after = crash_after
+
+    def hydrate(self, ids):
+        if len(self.requested) >= self.crash_after:
+            raise IOError('connection reset')
+        return FakeTwarc.hydrate(self, ids)
+
+
+IDS_PER_MS = len(FirehoseJob.MACHINE_IDS)
+
+
+def job(twarc, **kwargs):
+    fh = FirehoseJob(writers={}, BATCH_LEN=IDS_PER_MS, **kwargs)
+    fh.twarc_pool = twarc
+    fh.neo4j_data_access = lambda: FakeDataAccess()
+    return fh
+
+
+#one tweet per ms: the first candidate id of each ms in [BEGIN, END)
+def tweet_per_ms():
+    ids = [int(block[0]) for block in Snowflake.id_blocks(BEGIN, END, FirehoseJob.MACHINE_IDS, (0,), IDS_PER_MS)]
+    return {i: tweet(i) for i in ids}
+
+
+def test_ingest_range_resumes_after_last_finished_block(tmp_path):
+    path = str(tmp_path / 'cp.json')
+
+    first = CrashingTwarc(crash_after=2 * IDS_PER_MS)
+    with pytest.raises(IOError):
+        list(job(first).ingest_range(BEGIN, END, 'job', ids_per_chunk=IDS_PER_MS, checkpoint_path=path))
+    assert IngestCheckpoint(path, 'job', BEGIN, END).next_ms == BEGIN + 2
+
+    second = FakeTwarc({})
+    list(job(second).ingest_range(BEGIN, END, 'job', ids_per_chunk=IDS_PER_MS, checkpoint_path=path))
+    assert Snowflake.creation_time(np.array(second.requested[:1]))[0] == BEGIN + 2
+    assert len(second.requested) == (END - BEGIN - 2) * IDS_PER_MS
+    assert IngestCheckpoint(path, 'job', BEGIN, END).is_complete()
+
+
+def test_ingest_range_checkpoints_blocks_with_their_flushes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / 'cp.json')
+    fh = job(FakeTwarc(tweet_per_ms()))
+    assert sum(arr.num_rows for arr in fh.ingest_range(
+        BEGIN, END, 'job', ids_per_chunk=IDS_PER_MS, checkpoint_path=path)) == END - BEGIN
+    saved = json.load(open(path))
+    assert (saved['blocks'], saved['tweets'], saved['flushes']) == (END - BEGIN, END - BEGIN, fh.flush_count)
+    assert IngestCheckpoint(path, 'job', BEGIN, END).is_complete()
+
+
+def test_ingest_range_checkpoint_does_not_wait_on_background_flushes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / 'cp.json')
+    fh = job(FakeTwarc(tweet_per_ms()), async_flush=True, FLUSH_QUEUE_SIZE=END - BEGIN)
+    written = threading.Event()
+    fh.flush_parquet = lambda table, job_name: written.wait(5)
+    for i, arr in enumerate(fh.ingest_range(BEGIN, END, 'job', ids_per_chunk=IDS_PER_MS, checkpoint_path=path)):
+        if i == 4:
+            #5 blocks hydrated while their parquet writes are still pending: none checkpointed
+            assert IngestCheckpoint(path, 'job', BEGIN, END).next_ms == BEGIN
+            assert fh.written_flush_count() == 0
+            written.set()
+    assert IngestCheckpoint(path, 'job', BEGIN, END).is_complete()
+    fh.drain_flushes()
+
+
+def test_sampled_ingest_range_resumes_with_checkpointed_sampler_state(tmp_path):
+    path = str(tmp_path / 'cp.json')
+    first = SnowflakeSampler(FirehoseJob.MACHINE_IDS, seed=1)
+    with pytest.raises(IOError):
+        list(job(CrashingTwarc(crash_after=2 * IDS_PER_MS)).ingest_range(
+            BEGIN, END, 'job', ids_per_chunk=IDS_PER_MS, checkpoint_path=path, sampler=first))
+    checkpoint = IngestCheckpoint(path, 'job', BEGIN, END, sampled=True)
+    assert checkpoint.next_ms == BEGIN + 2
+    assert checkpoint.state['sequence_ids'] is None
+    assert np.array_equal(checkpoint.sampler_state()['probes'], first.probes)
+
+    second = SnowflakeSampler(FirehoseJob.MACHINE_IDS, seed=2)
+    restored = []
+    set_state = second.set_state
+    second.set_state = lambda state: restored.append(state['probes']) or set_state(state)
+    list(job(FakeTwarc({})).ingest_range(
+        BEGIN, END, 'job', ids_per_chunk=IDS_PER_MS, checkpoint_path=path, sampler=second))
+    assert len(restored) == 1 and np.array_equal(restored[0], first.probes)
+    assert IngestCheckpoint(path, 'job', BEGIN, END, sampled=True).is_complete()
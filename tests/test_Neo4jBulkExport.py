@@ -0,0 +1,32 @@
+import glob, os
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.DfHelper import DfHelper
+from modules.Neo4jBulkExport import Neo4jBulkExport
+from tests.test_DfHelper import ORIGINAL_ID, QUOTED_ID, raw_df
+
+
+def read_group(out_dir, group):
+    paths = sorted(glob.glob(os.path.join(out_dir, '%s_part-*.csv' % group)))
+    return pd.concat([pd.read_csv(p, header=None, dtype=str) for p in paths], ignore_index=True)
+
+
+def test_to_ids_keeps_64_bits_and_nulls_non_positive():
+    ids = Neo4jBulkExport.to_ids(pd.Series([ORIGINAL_ID, None, 0], dtype='object'))
+    assert ids.tolist() == [ORIGINAL_ID, pd.NA, pd.NA]
+
+
+def test_to_ids_rejects_float_ids():
+    with pytest.raises(TypeError):
+        Neo4jBulkExport.to_ids(pd.Series([float(ORIGINAL_ID), np.nan]))
+
+
+def test_referenced_stub_and_end_ids_are_exact(tmp_path):
+    export = Neo4jBulkExport(str(tmp_path))
+    export.add_normalized_df(DfHelper().normalize_parquet_dataframe(raw_df()), 'test')
+    export.close()
+    assert read_group(str(tmp_path), 'RETWEETED')[1].tolist() == [str(ORIGINAL_ID)] * 2
+    assert read_group(str(tmp_path), 'QUOTED')[1].tolist() == [str(QUOTED_ID)]
+    assert {str(ORIGINAL_ID), str(QUOTED_ID)} <= set(read_group(str(tmp_path), 'Tweet')[0])
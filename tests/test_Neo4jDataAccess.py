@@ -0,0 +1,99 @@
+import json
+import re
+import pytest
+from neo4j.exceptions import ClientError, ServiceUnavailable, TransientError
+
+from modules.DfHelper import DfHelper
+from modules.Neo4jDataAccess import Neo4jDataAccess
+from tests.test_DfHelper import ORIGINAL_ID, raw_df
+
+DEADLOCK = 'Neo.TransientError.Transaction.DeadlockDetected'
+
+
+def neo4j_error(cls, code):
+    e = cls('boom')
+    e.code = code
+    return e
+
+
+class FakeTx:
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def run(self, cypher, **params):
+        if len(self.graph.errors) > 0:
+            raise self.graph.errors.pop(0)
+        self.graph.statements.append(cypher)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class FakeSession:
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def begin_transaction(self):
+        self.graph.transactions += 1
+        return FakeTx(self.graph)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class FakeGraph:
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.transactions = 0
+        self.statements = []
+
+    def session(self):
+        return FakeSession(self)
+
+
+def write(errors, max_retries=2):
+    da = Neo4jDataAccess(max_retries=max_retries, retry_backoff_s=0)
+    da.graph = FakeGraph(errors)
+    da._Neo4jDataAccess__write_to_neo([], [], [], {'RETWEET': []})
+    return da.graph
+
+
+def test_transient_errors_replay_the_transaction():
+    graph = write([neo4j_error(TransientError, DEADLOCK)] * 2)
+    assert graph.transactions == 3
+    assert len(graph.statements) == 3
+
+
+def test_transient_errors_give_up_after_max_retries():
+    with pytest.raises(TransientError):
+        write([neo4j_error(TransientError, DEADLOCK)] * 3)
+
+
+@pytest.mark.parametrize('error', [
+    neo4j_error(TransientError, 'Neo.TransientError.Transaction.Terminated'),
+    neo4j_error(ClientError, 'Neo.ClientError.Statement.SyntaxError'),
+    ServiceUnavailable('down')])
+def test_other_errors_are_not_retried(error):
+    da = Neo4jDataAccess(max_retries=2, retry_backoff_s=0)
+    da.graph = FakeGraph([error])
+    with pytest.raises(type(error)):
+        da._Neo4jDataAccess__write_to_neo([], [], [], {})
+    assert da.graph.transactions == 1
+
+
+def test_url_statement_reads_only_keys_the_params_send():
+    df = raw_df().iloc[:1].assign(entities=json.dumps(
+        {'urls': [{'expanded_url': 'https://example.org/a?b=1'}], 'hashtags': [], 'user_mentions': []}))
+    da = Neo4jDataAccess()
+    urls = da.df_to_graph_params(DfHelper().normalize_parquet_dataframe(df), 'test')['urls']
+    assert [(u['tweet_id'], u['schema'], u['hostname']) for u in urls] == [(ORIGINAL_ID + 4096, 'https', 'example.org')]
+    assert set(re.findall(r'\bt\.(\w+)', da.urls)) <= set(urls[0].keys())
@@ -0,0 +1,31 @@
+import modules.Neo4jDriverPool as driver_pool
+from modules.Neo4jDriverPool import Neo4jDriverPool
+
+CREDS = [{'type': 'writer', 'creds': {'host': 'localhost', 'port': 7687, 'user': 'neo4j', 'password': 'pw'}}]
+
+
+class FakeDriver:
+
+    def __init__(self, uri, **config):
+        self.uri = uri
+        self.config = config
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_drivers_keyed_by_config(monkeypatch):
+    monkeypatch.setattr(driver_pool.GraphDatabase, 'driver', FakeDriver)
+    try:
+        default = Neo4jDriverPool.get_driver('writer', CREDS)
+        small = Neo4jDriverPool.get_driver('writer', CREDS, max_connection_pool_size=2)
+        assert Neo4jDriverPool.get_driver('writer', CREDS) is default
+        assert Neo4jDriverPool.get_driver('writer', CREDS, max_connection_pool_size=2) is small
+        assert not (small is default)
+        assert small.config['max_connection_pool_size'] == 2
+        assert not ('max_connection_pool_size' in default.config)
+        assert Neo4jDriverPool.get_driver('reader', CREDS) is None
+    finally:
+        Neo4jDriverPool.close()
+    assert default.closed and small.closed
@@ -0,0 +1,43 @@
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from modules.ParquetCompactor import ParquetCompactor
+
+BIG_ID = 1240108746791153674
+
+
+def write(path, ids, text, mtime):
+    pq.write_table(pa.table({'id': pa.array(ids, pa.int64()), 'text': [text] * len(ids)}), path)
+    os.utime(path, (mtime, mtime))
+
+
+def test_dedupe_sorted_keeps_last_copy_of_each_id():
+    table = pa.table({'id': [3, 1, 3, 2, 1], 'v': ['a', 'b', 'c', 'd', 'e']})
+    out = ParquetCompactor.dedupe_sorted(table)
+    assert out.column('id').to_pylist() == [1, 2, 3]
+    assert out.column('v').to_pylist() == ['e', 'd', 'c']
+
+
+def test_compact_flat_dedupes_per_hour_and_suffix(tmp_path):
+    folder = str(tmp_path)
+    write(os.path.join(folder, '2020_03_18_03_b0.snappy2.parquet'), [BIG_ID + 1, BIG_ID], 'old', 1000)
+    write(os.path.join(folder, '2020_03_18_03_b1.snappy2.parquet'), [BIG_ID], 'new', 2000)
+    write(os.path.join(folder, '2020_03_18_04_b0.snappy2.parquet'), [5], 'other hour', 1000)
+
+    stats = ParquetCompactor().compact(folder)
+
+    out_path = os.path.join(folder, '2020_03_18_03_b0.snappy2.parquet')
+    assert stats == [(out_path, 3, 2)]
+    assert sorted(os.listdir(folder)) == ['2020_03_18_03_b0.snappy2.parquet', '2020_03_18_04_b0.snappy2.parquet']
+    out = pq.read_table(out_path)
+    assert out.column('id').to_pylist() == [BIG_ID, BIG_ID + 1]
+    assert out.column('text').to_pylist() == ['new', 'old']
+
+
+def test_dry_run_leaves_files(tmp_path):
+    folder = str(tmp_path)
+    write(os.path.join(folder, '2020_03_18_03_b0.snappy2.parquet'), [1, 2], 'a', 1000)
+    write(os.path.join(folder, '2020_03_18_03_b1.snappy2.parquet'), [2], 'b', 2000)
+    assert ParquetCompactor(dry_run=True).compact(folder)[0][1:] == (3, 2)
+    assert len(os.listdir(folder)) == 2
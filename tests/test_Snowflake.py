@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from modules.Snowflake import Snowflake
+
+# A real tweet id: 2020-03-18 02:52:19.998 UTC, machine 375, sequence 10
+TWEET_ID = 1240108746791153674
+
+
+def test_decode_real_tweet_id():
+    decoded = Snowflake.decode([TWEET_ID]).iloc[0]
+    assert decoded['id'] == TWEET_ID
+    assert decoded['created_at_ms'] == 1584499939998
+    assert decoded['created_at'] == pd.Timestamp('2020-03-18 02:52:19.998', tz='UTC')
+    assert (decoded['machine_id'], decoded['sequence_id']) == (375, 10)
+
+
+def test_encode_decode_round_trip():
+    machine_ids, sequence_ids = [375, 0, Snowflake.MACHINE_MASK], [10, 0, Snowflake.SEQUENCE_MASK]
+    ids = Snowflake.ids_for_pairs(1584499939998, 1584499940001, machine_ids, sequence_ids)
+    assert ids[0] == TWEET_ID
+    decoded = Snowflake.decode(ids)
+    assert decoded['created_at_ms'].tolist() == [1584499939998] * 3 + [1584499939999] * 3 + [1584499940000] * 3
+    assert decoded['machine_id'].tolist() == machine_ids * 3
+    assert decoded['sequence_id'].tolist() == sequence_ids * 3
+
+
+def test_ids_nesting_and_blocks_cover_the_same_ids():
+    ids = Snowflake.ids(1584499939998, 1584499940008, [375, 382], [0, 1, 2])
+    assert len(ids) == 10 * 2 * 3
+    assert (np.diff(Snowflake.creation_time(ids)) >= 0).all()
+    assert Snowflake.machine_id(ids[:6]).tolist() == [375, 375, 375, 382, 382, 382]
+    blocks = list(Snowflake.id_blocks(1584499939998, 1584499940008, [375, 382], [0, 1, 2], block_size=13))
+    assert [len(b) for b in blocks] == [12] * 5
+    assert np.concatenate(blocks).tolist() == ids.tolist()
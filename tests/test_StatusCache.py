@@ -0,0 +1,52 @@
+import pandas as pd
+
+from modules.DfHelper import DfHelper
+from modules.StatusCache import StatusCache
+from tests.test_DfHelper import raw_df
+
+
+def entry(i):
+    return {'id': i, 'created_at': 1584500000 + i, 'user_id': 1000 + i}
+
+
+def test_get_many_counts_hits_and_misses():
+    cache = StatusCache()
+    cache.put_many([(1, entry(1)), (None, entry(2))])
+    assert cache.get_many([1, 2, None]) == {1: entry(1)}
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 1)
+    assert cache.stats()['hit_rate'] == 1 / 3
+
+
+def test_evicts_least_recently_used_by_count():
+    cache = StatusCache(max_items=2)
+    cache.put_many([(1, entry(1)), (2, entry(2))])
+    cache.get_many([1])
+    cache.put_many([(3, entry(3))])
+    assert sorted(cache.get_many([1, 2, 3])) == [1, 3]
+    assert cache.evictions == 1
+
+
+def test_evicts_by_byte_budget():
+    size = StatusCache.entry_bytes(1, entry(1))
+    cache = StatusCache(max_bytes=3 * size)
+    cache.put_many((i, entry(i)) for i in range(1, 6))
+    assert len(cache) == 3
+    assert cache.bytes <= 3 * size
+    assert sorted(cache.get_many(range(1, 6))) == [3, 4, 5]
+    assert cache.evictions == 2
+
+
+def test_replacing_a_key_keeps_byte_count_exact():
+    cache = StatusCache()
+    cache.put_many([(1, entry(1))])
+    cache.put_many([(1, {'id': 1})])
+    assert cache.bytes == StatusCache.entry_bytes(1, {'id': 1})
+    assert len(cache) == 1
+
+
+def test_cached_normalization_matches_uncached():
+    plain = DfHelper().normalize_parquet_dataframe(raw_df())
+    cache = StatusCache()
+    for _ in range(2):
+        pd.testing.assert_frame_equal(DfHelper(cache).normalize_parquet_dataframe(raw_df()), plain)
+    assert cache.hits > 0